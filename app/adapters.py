@@ -0,0 +1,54 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+from urllib.parse import ParseResult
+
+UNKNOWN_URL_CLASSIFICATION = {"service": None, "kind": None, "supported": False}
+
+
+def _no_track_id(url: str) -> str | None:
+    return None
+
+
+@dataclass(frozen=True)
+class SourceAdapter:
+    """Everything the bot needs to know about one music service.
+
+    ``classify`` gets the parsed URL, its non-empty path parts and the parsed
+    query string and returns the same dict shape as ``classify_music_url``.
+    ``fetch_batch`` takes canonical IDs and returns payloads keyed by ID.
+    ``cache_ttl`` of ``None`` means the global ``CACHE_TTL_SECONDS``.
+    """
+
+    service: str
+    hosts: frozenset[str]
+    classify: Callable[[ParseResult, list[str], dict], dict]
+    extract_id: Callable[[str], str | None] = _no_track_id
+    fetch: Callable[[str], Awaitable[dict | None]] | None = None
+    fetch_batch: Callable[[list[str]], Awaitable[dict[str, dict]]] | None = None
+    redirect_hosts: frozenset[str] = frozenset()
+    cache_ttl: int | None = None
+    max_concurrency: int = 4
+
+
+_adapter_semaphores: dict[str, asyncio.Semaphore] = {}
+
+
+def build_host_index(adapters: list[SourceAdapter]) -> dict[str, SourceAdapter]:
+    index = {}
+    for adapter in adapters:
+        for host in adapter.hosts:
+            if host in index:
+                raise ValueError(
+                    f"Host {host} is claimed by both {index[host].service} and {adapter.service}"
+                )
+            index[host] = adapter
+    return index
+
+
+def get_adapter_semaphore(adapter: SourceAdapter) -> asyncio.Semaphore:
+    semaphore = _adapter_semaphores.get(adapter.service)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(adapter.max_concurrency)
+        _adapter_semaphores[adapter.service] = semaphore
+    return semaphore
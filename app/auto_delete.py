@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import math
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from app.cache import get_due_deletions, get_next_deletion_due, remove_deletions, schedule_deletions
+
+AUTO_DELETE_TICK_SECONDS = 1
+AUTO_DELETE_FETCH_LIMIT = 1000
+DELETE_MESSAGES_BATCH_SIZE = 100
+AUTO_DELETE_RETRY_SECONDS = 60
+
+
+class AutoDeleteScheduler:
+    """Timer wheel over the ``pending_deletions`` table.
+
+    Due times are rounded up to whole ticks so messages from the same chat
+    that expire together share one ``deleteMessages`` call. Only the next due
+    time lives in memory; pending deletions survive restarts in SQLite. Rows
+    are dropped once Telegram deleted or refused the messages; network errors
+    and exhausted flood retries move them ``retry_after`` seconds later.
+    """
+
+    def __init__(
+        self,
+        delete_batch: Callable[[int, list[int]], Awaitable],
+        tick: int = AUTO_DELETE_TICK_SECONDS,
+        retry_after: int = AUTO_DELETE_RETRY_SECONDS,
+    ):
+        self.delete_batch = delete_batch
+        self.tick = tick
+        self.retry_after = retry_after
+        self._wakeup: asyncio.Event | None = None
+        self._next_due: int | None = None
+
+    def schedule(self, chat_id: int, message_ids: list[int], delay: int):
+        due_at = math.ceil((time.time() + delay) / self.tick) * self.tick
+        schedule_deletions(chat_id, message_ids, due_at)
+        if self._wakeup is not None and (self._next_due is None or due_at < self._next_due):
+            self._wakeup.set()
+
+    async def flush_due(self, now: int | None = None) -> int:
+        now = int(time.time()) if now is None else now
+        deleted = 0
+        retried = set()
+        while rows := get_due_deletions(now, AUTO_DELETE_FETCH_LIMIT):
+            by_chat = defaultdict(list)
+            for chat_id, message_id in rows:
+                by_chat[chat_id].append(message_id)
+
+            for chat_id, message_ids in by_chat.items():
+                for start in range(0, len(message_ids), DELETE_MESSAGES_BATCH_SIZE):
+                    batch = message_ids[start:start + DELETE_MESSAGES_BATCH_SIZE]
+                    try:
+                        await self.delete_batch(chat_id, batch)
+                    except (TelegramBadRequest, TelegramForbiddenError) as exc:
+                        # Too old, already gone or the bot left the chat: retrying won't help.
+                        logging.warning(
+                            "Не удалось удалить сообщения %s в чате %s: %s", batch, chat_id, exc
+                        )
+                    except Exception as exc:
+                        logging.warning(
+                            "Не удалось удалить сообщения %s в чате %s, повтор через %s с: %s",
+                            batch, chat_id, self.retry_after, exc,
+                        )
+                        schedule_deletions(chat_id, batch, now + self.retry_after)
+                        retried.update((chat_id, message_id) for message_id in batch)
+            done = [row for row in rows if row not in retried]
+            remove_deletions(done)
+            deleted += len(done)
+        return deleted
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        while True:
+            self._next_due = get_next_deletion_due()
+            timeout = None if self._next_due is None else max(0, self._next_due - time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush_due()
@@ -1,13 +1,35 @@
+import asyncio
 import json
+import logging
 import os
 import sqlite3
 import time
+from collections import Counter
 from contextlib import closing
 
 from app.config import CACHE_DB_PATH, CACHE_TTL_SECONDS
+from app.metrics import CACHE_LOOKUPS_TOTAL
+from app.formatting import (
+    are_durations_compatible,
+    build_track_signature_key,
+    normalize_text,
+    should_show_album,
+    should_show_label,
+    should_show_release_date,
+)
+
+LOCAL_SEARCH_COLUMNS = ("artist", "track", "album", "label")
+ENTITY_FIELDS = ("artist", "track", "album", "image", "label", "release_date", "duration_ms")
+_local_search_enabled = True
+# Kept in memory so /stats never scans a table; seeded once by init_cache_db.
+table_row_counts = {"url_cache": 0, "pending_deletions": 0}
+TRACK_HIT_FLUSH_INTERVAL_SECONDS = 10
+# Cache hits are counted here and written to track_popularity in batches.
+_pending_track_hits: Counter = Counter()
 
 
 def init_cache_db():
+    global _local_search_enabled
     cache_dir = os.path.dirname(CACHE_DB_PATH)
     if cache_dir:
         os.makedirs(cache_dir, exist_ok=True)
@@ -22,10 +44,101 @@ def init_cache_db():
             )
             """
         )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS track_popularity (
+                url TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS track_entities (
+                id INTEGER PRIMARY KEY,
+                isrc TEXT UNIQUE,
+                signature TEXT NOT NULL,
+                artist TEXT,
+                track TEXT,
+                album TEXT,
+                image TEXT,
+                label TEXT,
+                label_source TEXT,
+                release_date TEXT,
+                duration_ms INTEGER,
+                updated_at INTEGER NOT NULL
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS track_entities_signature ON track_entities (signature)"
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS track_service_links (
+                entity_id INTEGER NOT NULL,
+                service TEXT NOT NULL,
+                service_id TEXT,
+                url TEXT NOT NULL,
+                PRIMARY KEY (entity_id, service)
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pending_deletions (
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                due_at INTEGER NOT NULL,
+                PRIMARY KEY (chat_id, message_id)
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS pending_deletions_due_at ON pending_deletions (due_at)"
+        )
+        try:
+            conn.execute(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS track_search USING fts5(
+                    url UNINDEXED,
+                    artist,
+                    track,
+                    album,
+                    label
+                )
+                """
+            )
+        except sqlite3.OperationalError as exc:
+            logging.warning("SQLite FTS5 недоступен, локальный поиск отключён: %s", exc)
+            _local_search_enabled = False
+        else:
+            backfill_track_search(conn)
         conn.commit()
+        for table in table_row_counts:
+            (table_row_counts[table],) = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
 
 
-def get_cached_track(url: str):
+def backfill_track_search(conn: sqlite3.Connection):
+    if conn.execute("SELECT 1 FROM track_search LIMIT 1").fetchone():
+        return
+    for url, payload_json in conn.execute("SELECT url, payload_json FROM url_cache").fetchall():
+        try:
+            index_track(conn, url, json.loads(payload_json))
+        except json.JSONDecodeError:
+            continue
+
+
+def index_track(conn: sqlite3.Connection, url: str, payload: dict):
+    conn.execute("DELETE FROM track_search WHERE url = ?", (url,))
+    conn.execute(
+        "INSERT INTO track_search (url, artist, track, album, label) VALUES (?, ?, ?, ?, ?)",
+        (url, *(normalize_text(payload.get(column, "")) for column in LOCAL_SEARCH_COLUMNS)),
+    )
+
+
+def lookup_cached_track(url: str) -> tuple[dict | None, str]:
+    """Read a cached payload without counting it; the second item is the lookup result label."""
     now = int(time.time())
     with closing(sqlite3.connect(CACHE_DB_PATH)) as conn:
         row = conn.execute(
@@ -34,31 +147,253 @@ def get_cached_track(url: str):
         ).fetchone()
 
         if not row:
-            return None
+            return None, "miss"
 
         payload_json, expires_at = row
         if expires_at <= now:
-            conn.execute("DELETE FROM url_cache WHERE url = ?", (url,))
+            table_row_counts["url_cache"] -= conn.execute("DELETE FROM url_cache WHERE url = ?", (url,)).rowcount
+            if _local_search_enabled:
+                conn.execute("DELETE FROM track_search WHERE url = ?", (url,))
             conn.commit()
-            return None
+            return None, "expired"
 
     try:
-        return json.loads(payload_json)
+        return json.loads(payload_json), "hit"
     except json.JSONDecodeError:
-        return None
+        return None, "hit"
+
+
+def get_cached_track(url: str):
+    payload, result = lookup_cached_track(url)
+    CACHE_LOOKUPS_TOTAL.inc(result)
+    return payload
 
 
-def set_cached_track(url: str, payload: dict):
-    expires_at = int(time.time()) + CACHE_TTL_SECONDS
+def set_cached_track(url: str, payload: dict, ttl: int | None = None):
+    expires_at = int(time.time()) + (ttl or CACHE_TTL_SECONDS)
+    payload_json = json.dumps(payload, ensure_ascii=False)
     with closing(sqlite3.connect(CACHE_DB_PATH)) as conn:
+        # Insert and update are separate statements so the row counter knows which one happened.
+        inserted = conn.execute(
+            "INSERT INTO url_cache (url, payload_json, expires_at) VALUES (?, ?, ?) ON CONFLICT(url) DO NOTHING",
+            (url, payload_json, expires_at),
+        ).rowcount
+        if inserted:
+            table_row_counts["url_cache"] += inserted
+        else:
+            conn.execute(
+                "UPDATE url_cache SET payload_json = ?, expires_at = ? WHERE url = ?",
+                (payload_json, expires_at, url),
+            )
+        if _local_search_enabled:
+            index_track(conn, url, payload)
+        conn.commit()
+
+
+def record_track_hit(url: str):
+    _pending_track_hits[url] += 1
+
+
+def flush_track_hits() -> int:
+    """Write the buffered hit counts in one transaction; returns how many URLs were updated."""
+    if not _pending_track_hits:
+        return 0
+    hits = list(_pending_track_hits.items())
+    _pending_track_hits.clear()
+    with closing(sqlite3.connect(CACHE_DB_PATH)) as conn:
+        conn.executemany(
+            """
+            INSERT INTO track_popularity (url, hits) VALUES (?, ?)
+            ON CONFLICT(url) DO UPDATE SET hits = hits + excluded.hits
+            """,
+            hits,
+        )
+        conn.commit()
+    return len(hits)
+
+
+async def run_track_hit_flusher(interval: float = TRACK_HIT_FLUSH_INTERVAL_SECONDS):
+    try:
+        while True:
+            await asyncio.sleep(interval)
+            flush_track_hits()
+    finally:
+        flush_track_hits()
+
+
+def search_cached_tracks(query: str, limit: int = 5) -> list[dict]:
+    """Full-text search over already resolved tracks, most popular first."""
+    tokens = normalize_text(query).split()
+    if not tokens or not _local_search_enabled:
+        return []
+
+    match = " ".join(f'"{token}"*' for token in tokens)
+    with closing(sqlite3.connect(CACHE_DB_PATH)) as conn:
+        rows = conn.execute(
+            """
+            SELECT url_cache.payload_json
+            FROM track_search
+            JOIN url_cache ON url_cache.url = track_search.url
+            LEFT JOIN track_popularity ON track_popularity.url = track_search.url
+            WHERE track_search MATCH ? AND url_cache.expires_at > ?
+            ORDER BY COALESCE(track_popularity.hits, 0) DESC, bm25(track_search)
+            LIMIT ?
+            """,
+            (match, int(time.time()), limit),
+        ).fetchall()
+
+    payloads = []
+    for (payload_json,) in rows:
+        try:
+            payloads.append(json.loads(payload_json))
+        except json.JSONDecodeError:
+            continue
+    return payloads
+
+
+def has_known_value(field: str, value, source: str) -> bool:
+    if field == "label":
+        return bool(value) and value != "Unknown Label" and should_show_label(source, value)
+    if field == "album":
+        return should_show_album(value)
+    if field == "release_date":
+        return should_show_release_date(value)
+    return bool(value)
+
+
+def find_track_entity(conn: sqlite3.Connection, isrc: str | None, signature: str, payload: dict):
+    if isrc:
+        row = conn.execute("SELECT * FROM track_entities WHERE isrc = ?", (isrc,)).fetchone()
+        if row:
+            return dict(row)
+
+    rows = conn.execute(
+        "SELECT * FROM track_entities WHERE signature = ? ORDER BY updated_at DESC",
+        (signature,),
+    ).fetchall()
+    for row in rows:
+        if isrc and row["isrc"] and row["isrc"] != isrc:
+            continue
+        if are_durations_compatible(dict(row), payload):
+            return dict(row)
+    return None
+
+
+def remember_track_entity(payload: dict, service_id: str | None = None) -> dict:
+    """Attach a resolved payload to its canonical recording.
+
+    Recordings are keyed by ISRC, or by the artist/title signature when no ISRC
+    is known. Returns the payload with gaps filled from what other services
+    already told us, plus a ``links`` map of every known service URL.
+    """
+    if payload.get("artist") == "Unknown Artist" or payload.get("track") in {"Unknown", "Unknown Track"}:
+        return payload
+
+    source = payload["source"]
+    isrc = (payload.get("isrc") or "").upper() or None
+    signature = build_track_signature_key(payload)
+    now = int(time.time())
+    with closing(sqlite3.connect(CACHE_DB_PATH)) as conn:
+        conn.row_factory = sqlite3.Row
+        # Merges run in worker threads: take the write lock before the lookup so
+        # two merges of the same recording can't both decide to insert it.
+        conn.execute("BEGIN IMMEDIATE")
+        entity = find_track_entity(conn, isrc, signature, payload)
+        if entity is None:
+            cursor = conn.execute(
+                "INSERT INTO track_entities (isrc, signature, updated_at) VALUES (?, ?, ?)",
+                (isrc, signature, now),
+            )
+            entity = {"id": cursor.lastrowid, "isrc": isrc, "label_source": None}
+
+        updates = {}
+        for field in ENTITY_FIELDS:
+            value = payload.get(field)
+            if not has_known_value(field, value, source):
+                continue
+            # Spotify labels come from the label's own metadata, so they win.
+            if entity.get(field) is None or (
+                field == "label" and source == "spotify" and entity["label_source"] != "spotify"
+            ):
+                updates[field] = value
+        if "label" in updates:
+            updates["label_source"] = source
+        if isrc and not entity.get("isrc"):
+            updates["isrc"] = isrc
+        updates["updated_at"] = now
+
+        assignments = ", ".join(f"{column} = ?" for column in updates)
+        conn.execute(
+            f"UPDATE track_entities SET {assignments} WHERE id = ?",
+            (*updates.values(), entity["id"]),
+        )
         conn.execute(
             """
-            INSERT INTO url_cache (url, payload_json, expires_at)
-            VALUES (?, ?, ?)
-            ON CONFLICT(url) DO UPDATE SET
-                payload_json = excluded.payload_json,
-                expires_at = excluded.expires_at
+            INSERT INTO track_service_links (entity_id, service, service_id, url)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(entity_id, service) DO UPDATE SET
+                service_id = excluded.service_id,
+                url = excluded.url
             """,
-            (url, json.dumps(payload, ensure_ascii=False), expires_at),
+            (entity["id"], source, service_id, payload["source_url"]),
         )
+        links = dict(
+            conn.execute(
+                "SELECT service, url FROM track_service_links WHERE entity_id = ?",
+                (entity["id"],),
+            ).fetchall()
+        )
+        conn.commit()
+
+    entity.update(updates)
+    enriched = dict(payload)
+    for field in ENTITY_FIELDS:
+        if not has_known_value(field, enriched.get(field), source) and entity.get(field) is not None:
+            enriched[field] = entity[field]
+    enriched["links"] = {**links, **(payload.get("links") or {})}
+    return enriched
+
+
+def schedule_deletions(chat_id: int, message_ids: list[int], due_at: int):
+    rows = [(chat_id, message_id, due_at) for message_id in message_ids]
+    with closing(sqlite3.connect(CACHE_DB_PATH)) as conn:
+        inserted = conn.executemany(
+            "INSERT INTO pending_deletions (chat_id, message_id, due_at) VALUES (?, ?, ?) ON CONFLICT DO NOTHING",
+            rows,
+        ).rowcount
+        if inserted < len(rows):
+            conn.executemany(
+                "UPDATE pending_deletions SET due_at = ? WHERE chat_id = ? AND message_id = ?",
+                [(due_at, chat_id, message_id) for chat_id, message_id, due_at in rows],
+            )
+        conn.commit()
+    table_row_counts["pending_deletions"] += inserted
+
+
+def get_next_deletion_due() -> int | None:
+    with closing(sqlite3.connect(CACHE_DB_PATH)) as conn:
+        (due_at,) = conn.execute("SELECT MIN(due_at) FROM pending_deletions").fetchone()
+    return due_at
+
+
+def get_due_deletions(now: int, limit: int = 1000) -> list[tuple[int, int]]:
+    with closing(sqlite3.connect(CACHE_DB_PATH)) as conn:
+        return conn.execute(
+            """
+            SELECT chat_id, message_id FROM pending_deletions
+            WHERE due_at <= ?
+            ORDER BY due_at
+            LIMIT ?
+            """,
+            (now, limit),
+        ).fetchall()
+
+
+def remove_deletions(rows: list[tuple[int, int]]):
+    with closing(sqlite3.connect(CACHE_DB_PATH)) as conn:
+        removed = conn.executemany(
+            "DELETE FROM pending_deletions WHERE chat_id = ? AND message_id = ?",
+            rows,
+        ).rowcount
         conn.commit()
+    table_row_counts["pending_deletions"] -= removed
@@ -0,0 +1,223 @@
+import asyncio
+import json
+import logging
+import math
+import time
+from urllib.parse import urlparse
+
+from app.cache import get_cached_track, lookup_cached_track, set_cached_track
+from app.config import CACHE_BACKEND, CACHE_REDIS_URL, CACHE_TTL_SECONDS
+from app.metrics import CACHE_LOOKUPS_TOTAL
+
+REDIS_KEY_PREFIX = "spotify_bot:track:"
+REDIS_TIMEOUT_SECONDS = 1.0
+# After a failure Redis is skipped for this long, so an outage doesn't add a timeout to every lookup.
+REDIS_FAILURE_BACKOFF_SECONDS = 30.0
+
+
+class RespError(Exception):
+    pass
+
+
+def encode_resp_command(*args) -> bytes:
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        parts.append(f"${len(data)}\r\n".encode())
+        parts.append(data + b"\r\n")
+    return b"".join(parts)
+
+
+async def read_resp_reply(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Соединение с Redis закрыто")
+    prefix, body = line[:1], line[1:-2]
+    if prefix == b"+":
+        return body.decode()
+    if prefix == b"-":
+        # Returned, not raised, so the rest of a pipeline stays aligned.
+        return RespError(body.decode())
+    if prefix == b":":
+        return int(body)
+    if prefix == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if prefix == b"*":
+        length = int(body)
+        if length < 0:
+            return None
+        return [await read_resp_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"Неожиданный ответ Redis: {line!r}")
+
+
+class RespClient:
+    """Minimal Redis protocol client: one connection, commands pipelined per call."""
+
+    def __init__(self, url: str, timeout: float = REDIS_TIMEOUT_SECONDS):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._lock: asyncio.Lock | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        for reply in await self._send(setup):
+            if isinstance(reply, RespError):
+                raise reply
+
+    async def _send(self, commands: list[tuple]) -> list:
+        self._writer.write(b"".join(encode_resp_command(*command) for command in commands))
+        await self._writer.drain()
+        return [await read_resp_reply(self._reader) for _ in commands]
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def pipeline(self, commands: list[tuple]) -> list:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self.close()
+            self._lock = asyncio.Lock()
+            self._loop = loop
+
+        async with self._lock:
+            try:
+                async with asyncio.timeout(self.timeout):
+                    if self._writer is None or self._writer.is_closing():
+                        await self._connect()
+                    return await self._send(commands)
+            except (OSError, TimeoutError, ConnectionError, asyncio.IncompleteReadError, RespError):
+                self.close()
+                raise
+
+    async def execute(self, *args):
+        reply = (await self.pipeline([args]))[0]
+        if isinstance(reply, RespError):
+            raise reply
+        return reply
+
+
+class SQLiteTrackStore:
+    """Parsed-track cache in the local SQLite file."""
+
+    async def get(self, url: str) -> dict | None:
+        return get_cached_track(url)
+
+    async def get_many(self, urls: list[str]) -> dict[str, dict]:
+        results = {}
+        for url in urls:
+            cached = get_cached_track(url)
+            if cached:
+                results[url] = cached
+        return results
+
+    async def set(self, url: str, payload: dict, ttl: int | None = None):
+        set_cached_track(url, payload, ttl)
+
+
+class RedisTrackStore(SQLiteTrackStore):
+    """Shared cache in a Redis-compatible server, in front of the local SQLite copy.
+
+    Every write still goes to SQLite as well, because local search and the
+    canonical track store read from that file. A Redis hit is copied there with
+    the remaining TTL of the shared entry. A lookup is counted once, after both
+    layers were asked, so a Redis hit is a hit. Redis failures are logged, count
+    as misses and make the store skip Redis for ``failure_backoff`` seconds.
+    """
+
+    def __init__(self, client: RespClient, failure_backoff: float = REDIS_FAILURE_BACKOFF_SECONDS):
+        self.client = client
+        self.failure_backoff = failure_backoff
+        self._skip_until = 0.0
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self._skip_until
+
+    def _mark_failed(self, message: str, exc: Exception):
+        self._skip_until = time.monotonic() + self.failure_backoff
+        logging.warning("%s: %s, Redis пропускается %.0f с", message, exc, self.failure_backoff)
+
+    async def get(self, url: str) -> dict | None:
+        return (await self.get_many([url])).get(url)
+
+    async def get_many(self, urls: list[str]) -> dict[str, dict]:
+        results = {}
+        local_misses = {}
+        for url in urls:
+            cached, result = lookup_cached_track(url)
+            if cached:
+                results[url] = cached
+                CACHE_LOOKUPS_TOTAL.inc("hit")
+            else:
+                local_misses[url] = result
+        try:
+            results.update(await self._get_many_shared(list(local_misses)))
+        finally:
+            for url, result in local_misses.items():
+                CACHE_LOOKUPS_TOTAL.inc("hit" if url in results else result)
+        return results
+
+    async def _get_many_shared(self, missing: list[str]) -> dict[str, dict]:
+        results = {}
+        if not missing or not self.available:
+            return results
+
+        commands = []
+        for url in missing:
+            commands.extend((("GET", REDIS_KEY_PREFIX + url), ("PTTL", REDIS_KEY_PREFIX + url)))
+        try:
+            replies = await self.client.pipeline(commands)
+        except Exception as exc:
+            self._mark_failed("Redis-кеш недоступен", exc)
+            return results
+
+        for url, reply, ttl_ms in zip(missing, replies[::2], replies[1::2]):
+            # PTTL is -2 once the key expired between the two commands and -1 without an expiry.
+            if not isinstance(reply, bytes) or ttl_ms == -2:
+                continue
+            try:
+                payload = json.loads(reply)
+            except json.JSONDecodeError:
+                continue
+            ttl = math.ceil(ttl_ms / 1000) if isinstance(ttl_ms, int) and ttl_ms > 0 else None
+            set_cached_track(url, payload, ttl)
+            results[url] = payload
+        return results
+
+    async def set(self, url: str, payload: dict, ttl: int | None = None):
+        await super().set(url, payload, ttl)
+        if not self.available:
+            return
+        try:
+            await self.client.execute(
+                "SET",
+                REDIS_KEY_PREFIX + url,
+                json.dumps(payload, ensure_ascii=False),
+                "EX",
+                ttl or CACHE_TTL_SECONDS,
+            )
+        except Exception as exc:
+            self._mark_failed(f"Не удалось записать {url} в Redis-кеш", exc)
+
+
+def build_track_store(backend: str = CACHE_BACKEND, redis_url: str = CACHE_REDIS_URL):
+    if backend == "redis":
+        return RedisTrackStore(RespClient(redis_url))
+    return SQLiteTrackStore()
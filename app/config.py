@@ -55,6 +55,46 @@ def _parse_cache_ttl(raw_value: str) -> int:
     return ttl
 
 
+def _parse_positive_number(name: str, raw_value: str, default):
+    try:
+        value = type(default)(raw_value)
+        if value <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        logging.warning(
+            "Некорректное значение %s='%s'. Использую %s.",
+            name,
+            raw_value,
+            default,
+        )
+        return default
+    return value
+
+
+def _parse_optional_port(name: str, raw_value: str) -> int:
+    try:
+        port = int(raw_value)
+        if not 0 <= port <= 65535:
+            raise ValueError
+    except (TypeError, ValueError):
+        logging.warning("Некорректное значение %s='%s'. Порт отключён.", name, raw_value)
+        return 0
+    return port
+
+
+def _parse_id_list(name: str, raw_value: str) -> frozenset[int]:
+    ids = set()
+    for item in raw_value.replace(";", ",").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            ids.add(int(item))
+        except ValueError:
+            logging.warning("Некорректный id '%s' в %s пропущен.", item, name)
+    return frozenset(ids)
+
+
 logging.basicConfig(level=logging.INFO)
 load_environment()
 
@@ -64,6 +104,48 @@ SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
 AUTO_DELETE_DELAY = _parse_auto_delete_delay(os.getenv("AUTO_DELETE_DELAY", "0"))
 CACHE_DB_PATH = os.getenv("CACHE_DB_PATH", "cache/music_cache.sqlite3")
 CACHE_TTL_SECONDS = _parse_cache_ttl(os.getenv("CACHE_TTL_SECONDS", "43200"))
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite").lower()
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+UPDATE_WORKERS = _parse_positive_number("UPDATE_WORKERS", os.getenv("UPDATE_WORKERS", "8"), 8)
+UPDATE_QUEUE_LIMIT = _parse_positive_number(
+    "UPDATE_QUEUE_LIMIT", os.getenv("UPDATE_QUEUE_LIMIT", "200"), 200
+)
+UPDATE_SHED_AFTER_SECONDS = _parse_positive_number(
+    "UPDATE_SHED_AFTER_SECONDS", os.getenv("UPDATE_SHED_AFTER_SECONDS", "30"), 30.0
+)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = _parse_positive_number("WEBHOOK_PORT", os.getenv("WEBHOOK_PORT", "8080"), 8080)
+TRACE_FILE_PATH = os.getenv("TRACE_FILE_PATH", "")
+TRACE_SAMPLE_RATE = _parse_positive_number(
+    "TRACE_SAMPLE_RATE", os.getenv("TRACE_SAMPLE_RATE", "0.01"), 0.01
+)
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR", "false").lower() in {"1", "true", "yes"}
+LOOP_LAG_THRESHOLD_SECONDS = _parse_positive_number(
+    "LOOP_LAG_THRESHOLD_SECONDS", os.getenv("LOOP_LAG_THRESHOLD_SECONDS", "0.25"), 0.25
+)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = _parse_optional_port("METRICS_PORT", os.getenv("METRICS_PORT", "0"))
+UPSTREAM_BASE_URL = os.getenv("UPSTREAM_BASE_URL", "").rstrip("/")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+UPDATE_RECORD_PATH = os.getenv("UPDATE_RECORD_PATH", "")
+ADMIN_USER_IDS = _parse_id_list("ADMIN_USER_IDS", os.getenv("ADMIN_USER_IDS", ""))
+MEMORY_LIMIT_MB = _parse_positive_number("MEMORY_LIMIT_MB", os.getenv("MEMORY_LIMIT_MB", "300"), 300)
+MEMORY_SOFT_LIMIT_PERCENT = _parse_positive_number(
+    "MEMORY_SOFT_LIMIT_PERCENT", os.getenv("MEMORY_SOFT_LIMIT_PERCENT", "70"), 70
+)
+MEMORY_HARD_LIMIT_PERCENT = _parse_positive_number(
+    "MEMORY_HARD_LIMIT_PERCENT", os.getenv("MEMORY_HARD_LIMIT_PERCENT", "85"), 85
+)
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(os.path.dirname(CACHE_DB_PATH) or ".", "profiles"))
 
 if not TELEGRAM_TOKEN or not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
     raise ValueError("❌ Не найдены необходимые переменные окружения! Проверь .env файл.")
+
+if CACHE_BACKEND not in {"sqlite", "redis"}:
+    raise ValueError(f"❌ Неизвестный CACHE_BACKEND='{CACHE_BACKEND}'. Допустимо: sqlite, redis.")
+
+if WEBHOOK_URL and not WEBHOOK_SECRET:
+    raise ValueError("❌ Для webhook-режима нужен WEBHOOK_SECRET. Проверь .env файл.")
@@ -1,6 +1,8 @@
 import re
 from datetime import datetime
 
+TRACK_DURATION_TOLERANCE_MS = 3000
+
 
 def format_date_ru(date_str: str) -> str:
     """Convert dates to DD.MM.YYYY, MM.YYYY or YYYY."""
@@ -44,6 +46,8 @@ def build_track_payload(
     release_date: str,
     source: str,
     source_url: str,
+    duration_ms: int | None = None,
+    isrc: str | None = None,
 ):
     return {
         "artist": artist or "Unknown Artist",
@@ -54,6 +58,8 @@ def build_track_payload(
         "release_date": release_date or "Unknown Date",
         "source": source,
         "source_url": source_url,
+        "duration_ms": duration_ms,
+        "isrc": isrc,
     }
 
 
@@ -68,6 +74,26 @@ def tokenize_text(value: str) -> set[str]:
     return set(normalize_text(value).split())
 
 
+def build_track_signature(payload: dict) -> tuple[frozenset, frozenset]:
+    return (
+        frozenset(tokenize_text(payload.get("artist", ""))),
+        frozenset(tokenize_text(payload.get("track", ""))),
+    )
+
+
+def build_track_signature_key(payload: dict) -> str:
+    artist_tokens, track_tokens = build_track_signature(payload)
+    return f"{' '.join(sorted(artist_tokens))}|{' '.join(sorted(track_tokens))}"
+
+
+def are_durations_compatible(first: dict, second: dict) -> bool:
+    first_duration = first.get("duration_ms")
+    second_duration = second.get("duration_ms")
+    if not first_duration or not second_duration:
+        return True
+    return abs(first_duration - second_duration) <= TRACK_DURATION_TOLERANCE_MS
+
+
 def is_suspicious_yandex_label(label: str) -> bool:
     normalized = normalize_text(label)
     suspicious_parts = {
@@ -91,7 +117,8 @@ def is_suspicious_yandex_label(label: str) -> bool:
 def should_show_label(source: str, label: str) -> bool:
     if not label:
         return False
-    if source in {"apple_music", "soundcloud", "youtube", "youtube_music"} and label in {
+    if source in {"spotify", "apple_music", "soundcloud", "youtube", "youtube_music"} and label in {
+        "Spotify",
         "Apple Music",
         "SoundCloud",
         "YouTube",
@@ -136,9 +163,18 @@ def build_caption(
         lines.append(f"Release date: {release_date}")
     if should_show_label(source, label):
         lines.append(f"Label: {label}")
-    if sender_display:
-        lines.extend(["", f"_from {escape_markdown_text(sender_display)}_"])
-    return "\n".join(lines)
+    return append_sender_footer("\n".join(lines), sender_display)
+
+
+def append_sender_footer(text: str, sender_display: str | None) -> str:
+    if not sender_display:
+        return text
+    return f"{text}\n\n_from {escape_markdown_text(sender_display)}_"
+
+
+def build_digest_caption(captions: list[str], sender_display: str | None = None) -> str:
+    text = "\n\n".join(f"{index}. {caption}" for index, caption in enumerate(captions, start=1))
+    return append_sender_footer(text, sender_display)
 
 
 def build_inline_description(album: str, label: str, source: str) -> str:
@@ -0,0 +1,85 @@
+import os
+import time
+from collections import deque
+
+from app.config import MEMORY_LIMIT_MB
+
+SOURCE_STATS_WINDOWS = (300, 3600)
+SOURCE_SAMPLE_LIMIT = 4096
+CGROUP_MEMORY_LIMIT_PATHS = (
+    "/sys/fs/cgroup/memory.max",
+    "/sys/fs/cgroup/memory/memory.limit_in_bytes",
+)
+# cgroup v1 reports "no limit" as a huge number rather than "max".
+UNLIMITED_MEMORY_BYTES = 1 << 60
+
+
+class SourceHealth:
+    """Recent fetch outcomes per source, kept in bounded deques.
+
+    Recording is an append; percentiles and error rates are only computed when
+    someone asks for a summary.
+    """
+
+    def __init__(self, max_samples: int = SOURCE_SAMPLE_LIMIT):
+        self.max_samples = max_samples
+        self._samples: dict[str, deque] = {}
+
+    def record(self, source: str, duration: float, ok: bool, now: float | None = None):
+        samples = self._samples.get(source)
+        if samples is None:
+            samples = self._samples[source] = deque(maxlen=self.max_samples)
+        samples.append((time.monotonic() if now is None else now, duration, ok))
+
+    def summary(self, window: float, now: float | None = None) -> dict[str, dict]:
+        now = time.monotonic() if now is None else now
+        result = {}
+        for source, samples in sorted(self._samples.items()):
+            recent = [(duration, ok) for at, duration, ok in samples if now - at <= window]
+            if not recent:
+                continue
+            durations = sorted(duration for duration, _ in recent)
+            result[source] = {
+                "count": len(recent),
+                "p50": durations[len(durations) // 2],
+                "p95": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+                "error_rate": sum(1 for _, ok in recent if not ok) / len(recent),
+            }
+        return result
+
+
+source_health = SourceHealth()
+
+
+async def timed_fetch(source: str, awaitable):
+    """Await an adapter fetch and record its duration and whether it produced anything."""
+    started_at = time.perf_counter()
+    try:
+        result = await awaitable
+    except Exception:
+        source_health.record(source, time.perf_counter() - started_at, False)
+        raise
+    source_health.record(source, time.perf_counter() - started_at, bool(result))
+    return result
+
+
+def get_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            resident_pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+def get_memory_limit_bytes() -> int:
+    """Container memory limit from the cgroup, or ``MEMORY_LIMIT_MB`` outside a container."""
+    for path in CGROUP_MEMORY_LIMIT_PATHS:
+        try:
+            with open(path, encoding="ascii") as limit_file:
+                raw_limit = limit_file.read().strip()
+        except OSError:
+            continue
+        if raw_limit.isdigit() and int(raw_limit) < UNLIMITED_MEMORY_BYTES:
+            return int(raw_limit)
+    return MEMORY_LIMIT_MB * 1024 * 1024
@@ -0,0 +1,63 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from app.metrics import Histogram
+
+LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds",
+    "Delay between when a loop callback was due and when it ran.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+
+
+class LoopLagMonitor:
+    """Measures event loop scheduling delay and reports what blocks it.
+
+    A task on the loop sleeps ``interval`` and records how late it wakes up. A
+    watchdog thread checks the task's heartbeat. When the loop has been stuck
+    for longer than ``threshold``, it logs the loop thread's current stack,
+    which is the synchronous code doing the blocking.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._heartbeat = time.monotonic()
+        self._reported_heartbeat = None
+        self._loop_thread_id = None
+        self._stop = threading.Event()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        watchdog.start()
+        try:
+            while True:
+                self._heartbeat = time.monotonic()
+                expected = loop.time() + self.interval
+                await asyncio.sleep(self.interval)
+                lag = max(0.0, loop.time() - expected)
+                LOOP_LAG_SECONDS.observe(lag)
+                self.max_lag = max(self.max_lag, lag)
+        finally:
+            self._stop.set()
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.threshold or heartbeat == self._reported_heartbeat:
+                continue
+            self._reported_heartbeat = heartbeat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "стек недоступен"
+            logging.warning("Event loop заблокирован уже %.3f с, текущий стек:\n%s", stalled, stack)
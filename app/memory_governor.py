@@ -0,0 +1,189 @@
+import asyncio
+import gc
+import itertools
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Callable
+
+from app.config import MEMORY_HARD_LIMIT_PERCENT, MEMORY_SOFT_LIMIT_PERCENT
+from app.health import get_memory_limit_bytes, get_rss_bytes
+from app.metrics import Counter, Gauge
+
+# A heavy HTML fetch holds the capped response body, its decoded text and a
+# BeautifulSoup tree that is several times larger than the text.
+HEAVY_FETCH_RESERVATION_BYTES = 8 * 1024 * 1024
+HEAVY_FETCH_ADMISSION_TIMEOUT_SECONDS = 5.0
+MEMORY_CHECK_INTERVAL_SECONDS = 1.0
+CACHE_RELIEF_COOLDOWN_SECONDS = 10.0
+SOFT_PRESSURE_KEEP_SHARE = 0.5
+
+MEMORY_GOVERNOR_DECISIONS_TOTAL = Counter(
+    "memory_governor_decisions_total",
+    "Memory governor decisions: heavy fetch admitted, delayed or rejected, caches shrunk or cleared.",
+    ("decision",),
+)
+CACHE_ENTRIES_EVICTED_TOTAL = Counter(
+    "cache_entries_evicted_total", "In-memory cache entries dropped under memory pressure.", ("cache",)
+)
+
+
+class MemoryPressureError(Exception):
+    pass
+
+
+class HeavyFetchLease:
+    __slots__ = ("governor", "response_bytes")
+
+    def __init__(self, governor: "MemoryGovernor"):
+        self.governor = governor
+        self.response_bytes = 0
+
+    def hold(self, size: int):
+        """Account for a response body this fetch is now holding."""
+        self.governor.response_bytes += size - self.response_bytes
+        self.response_bytes = size
+
+
+class MemoryGovernor:
+    """Keeps the process under the container memory limit.
+
+    Heavy HTML fetches reserve ``reservation_bytes`` each and are admitted
+    while the reservations fit between RSS and the hard limit; one fetch is
+    always allowed so lookups never stall completely. Above the soft limit
+    the registered in-memory caches lose their oldest half, above the hard
+    limit they are cleared.
+    """
+
+    def __init__(
+        self,
+        soft_limit_percent: int = MEMORY_SOFT_LIMIT_PERCENT,
+        hard_limit_percent: int = MEMORY_HARD_LIMIT_PERCENT,
+        reservation_bytes: int = HEAVY_FETCH_RESERVATION_BYTES,
+        admission_timeout: float = HEAVY_FETCH_ADMISSION_TIMEOUT_SECONDS,
+        rss_reader: Callable[[], int] = get_rss_bytes,
+        limit_reader: Callable[[], int] = get_memory_limit_bytes,
+    ):
+        self.soft_share = soft_limit_percent / 100
+        self.hard_share = hard_limit_percent / 100
+        self.reservation_bytes = reservation_bytes
+        self.admission_timeout = admission_timeout
+        self.rss_reader = rss_reader
+        self.limit_bytes = limit_reader()
+        self.rss_bytes = 0
+        self.reserved_bytes = 0
+        self.response_bytes = 0
+        self.in_flight = 0
+        self._caches: dict[str, Callable[[], dict]] = {}
+        self._sampled_at = float("-inf")
+        self._relieved_at = float("-inf")
+        self._condition: asyncio.Condition | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+    def register_cache(self, name: str, get_cache: Callable[[], dict]):
+        """``get_cache`` returns the live dict, so rebinding the module global is fine."""
+        self._caches[name] = get_cache
+
+    def sample(self, force: bool = False) -> float:
+        """Current RSS as a share of the limit; /proc is read at most once per check interval."""
+        now = time.monotonic()
+        if force or now - self._sampled_at >= MEMORY_CHECK_INTERVAL_SECONDS:
+            self._sampled_at = now
+            self.rss_bytes = self.rss_reader()
+            self.relieve_pressure(now)
+        return self.rss_bytes / self.limit_bytes
+
+    def available_bytes(self) -> int:
+        return int(self.limit_bytes * self.hard_share) - self.rss_bytes - self.reserved_bytes
+
+    def can_admit(self) -> bool:
+        self.sample()
+        return self.in_flight == 0 or self.available_bytes() >= self.reservation_bytes
+
+    def relieve_pressure(self, now: float):
+        pressure = self.rss_bytes / self.limit_bytes
+        if pressure < self.soft_share or now - self._relieved_at < CACHE_RELIEF_COOLDOWN_SECONDS:
+            return
+        self._relieved_at = now
+        keep_share = 0.0 if pressure >= self.hard_share else SOFT_PRESSURE_KEEP_SHARE
+        evicted = self.shrink_caches(keep_share)
+        MEMORY_GOVERNOR_DECISIONS_TOTAL.inc("caches_cleared" if keep_share == 0 else "caches_shrunk")
+        gc.collect()
+        logging.warning(
+            "⚠️ Память %.0f МБ из %.0f МБ: из кешей удалено %s записей",
+            self.rss_bytes / 1048576,
+            self.limit_bytes / 1048576,
+            evicted,
+        )
+
+    def shrink_caches(self, keep_share: float) -> int:
+        """Drop the oldest entries; the bounded caches keep insertion order."""
+        evicted = 0
+        for name, get_cache in self._caches.items():
+            cache = get_cache()
+            drop = len(cache) - int(len(cache) * keep_share)
+            for key in list(itertools.islice(cache, drop)):
+                cache.pop(key, None)
+            CACHE_ENTRIES_EVICTED_TOTAL.inc(name, amount=drop)
+            evicted += drop
+        return evicted
+
+    def _get_condition(self) -> asyncio.Condition:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+        return self._condition
+
+    @asynccontextmanager
+    async def heavy_fetch(self):
+        """Admission for one HTML fetch and parse; raises MemoryPressureError on timeout."""
+        condition = self._get_condition()
+        async with condition:
+            if not self.can_admit():
+                MEMORY_GOVERNOR_DECISIONS_TOTAL.inc("delayed")
+                deadline = time.monotonic() + self.admission_timeout
+                while not self.can_admit():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        MEMORY_GOVERNOR_DECISIONS_TOTAL.inc("rejected")
+                        raise MemoryPressureError("Недостаточно памяти для загрузки страницы")
+                    try:
+                        # RSS is re-read at least once per check interval while waiting.
+                        await asyncio.wait_for(condition.wait(), min(remaining, MEMORY_CHECK_INTERVAL_SECONDS))
+                    except asyncio.TimeoutError:
+                        pass
+            MEMORY_GOVERNOR_DECISIONS_TOTAL.inc("admitted")
+            self.in_flight += 1
+            self.reserved_bytes += self.reservation_bytes
+
+        lease = HeavyFetchLease(self)
+        try:
+            yield lease
+        finally:
+            lease.hold(0)
+            self.in_flight -= 1
+            self.reserved_bytes -= self.reservation_bytes
+            async with condition:
+                condition.notify()
+
+    async def run(self):
+        """Samples RSS between fetches too, so caches shrink even when nothing is admitted."""
+        while True:
+            self.sample(force=True)
+            await asyncio.sleep(MEMORY_CHECK_INTERVAL_SECONDS)
+
+
+memory_governor = MemoryGovernor()
+Gauge("process_resident_memory_bytes", "Resident set size of the bot process.", lambda: memory_governor.rss_bytes)
+Gauge("memory_limit_bytes", "Container memory limit the governor works against.", lambda: memory_governor.limit_bytes)
+Gauge(
+    "heavy_fetch_in_flight",
+    "Heavy HTML fetches currently admitted.",
+    lambda: memory_governor.in_flight,
+)
+Gauge(
+    "heavy_fetch_response_bytes",
+    "Response bytes held by admitted heavy HTML fetches.",
+    lambda: memory_governor.response_bytes,
+)
@@ -0,0 +1,192 @@
+import logging
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from typing import Callable
+
+import aiohttp
+from aiohttp import web
+
+METRIC_PREFIX = "spotify_bot_"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+_registry: list = []
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def format_labels(labelnames: tuple[str, ...], labels: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = defaultdict(float)
+        _registry.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] += amount
+
+    def value(self, *labels) -> float:
+        return self._values.get(labels, 0.0)
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, labels)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Per label set: non-cumulative bucket counts (+Inf last), sum, count.
+        self._series: dict[tuple, list] = {}
+        _registry.append(self)
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, *labels) -> int:
+        series = self._series.get(labels)
+        return series[2] if series else 0
+
+    def collect(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, (bucket_counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), bucket_counts):
+                cumulative += bucket_count
+                bucket_labels = format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            series_labels = format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{series_labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{series_labels} {count}")
+        return lines
+
+
+class Gauge:
+    """Gauge read from ``callback`` at scrape time, so hot paths never update it."""
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float]):
+        self.name = METRIC_PREFIX + name
+        self.documentation = documentation
+        self.callback = callback
+        _registry.append(self)
+
+    def collect(self) -> list[str]:
+        try:
+            value = self.callback()
+        except Exception as exc:
+            logging.warning("Не удалось снять метрику %s: %s", self.name, exc)
+            return []
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {format_value(value)}",
+        ]
+
+
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    "upstream_request_seconds", "Upstream request latency by host.", ("host",)
+)
+UPSTREAM_RESPONSES_TOTAL = Counter(
+    "upstream_responses_total", "Upstream responses by host and HTTP status.", ("host", "status")
+)
+CACHE_LOOKUPS_TOTAL = Counter(
+    "cache_lookups_total", "Parsed-track cache lookups by result.", ("result",)
+)
+MESSAGE_FILTER_TOTAL = Counter(
+    "message_filter_total", "Messages checked by the music-link filter by result.", ("result",)
+)
+HANDLER_SECONDS = Histogram(
+    "handler_seconds", "Telegram handler duration by update type.", ("handler",)
+)
+TELEGRAM_SEND_SECONDS = Histogram(
+    "telegram_send_seconds", "Time from queueing a Telegram send to its completion."
+)
+
+
+def render_metrics() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+def record_upstream_call(host: str, status, started_at: float):
+    UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - started_at, host)
+    UPSTREAM_RESPONSES_TOTAL.inc(host, str(status))
+
+
+async def _on_request_start(session, context, params):
+    context.started_at = time.perf_counter()
+
+
+async def _on_request_end(session, context, params):
+    record_upstream_call(params.url.host, params.response.status, context.started_at)
+
+
+async def _on_request_exception(session, context, params):
+    record_upstream_call(params.url.host, "error", context.started_at)
+
+
+def build_upstream_trace_config() -> aiohttp.TraceConfig:
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(_on_request_start)
+    trace_config.on_request_end.append(_on_request_end)
+    trace_config.on_request_exception.append(_on_request_exception)
+    return trace_config
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("📈 Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
+
+
+class HandlerTimingMiddleware:
+    """Inner middleware that records how long matched handlers take."""
+
+    def __init__(self, handler_name: str):
+        self.handler_name = handler_name
+
+    async def __call__(self, handler, event, data):
+        started_at = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started_at, self.handler_name)
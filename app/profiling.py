@@ -0,0 +1,175 @@
+import asyncio
+import cProfile
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from app.config import PROFILE_DIR
+from app.health import get_rss_bytes
+
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_TOP_N = 15
+SAMPLE_INTERVAL_SECONDS = 0.005
+TRACEMALLOC_FRAMES = 1
+PROFILE_KINDS = ("sample", "cpu", "mem")
+
+_capture_lock = threading.Lock()
+
+
+class ProfileBusyError(RuntimeError):
+    pass
+
+
+def build_profile_path(kind: str, extension: str) -> str:
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    return os.path.join(PROFILE_DIR, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.{extension}")
+
+
+def format_frame(code_filename: str, line: int, name: str) -> str:
+    return f"{os.path.basename(code_filename)}:{line}({name})"
+
+
+def sample_thread_stacks(thread_id: int, seconds: float, interval: float = SAMPLE_INTERVAL_SECONDS) -> Counter:
+    """Collapsed stacks (``outer;...;inner``) of one thread, sampled from the calling thread."""
+    stacks = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        while frame is not None:
+            names.append(format_frame(frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name))
+            frame = frame.f_back
+        if names:
+            stacks[";".join(reversed(names))] += 1
+        time.sleep(interval)
+    return stacks
+
+
+async def capture_sampled_profile(seconds: float, top: int = PROFILE_TOP_N) -> tuple[str, list[str]]:
+    """Low-overhead profile of the event loop thread: which frames were on top, how often.
+
+    Writes collapsed stacks that flamegraph tools read directly. Time spent
+    waiting for I/O shows up under the selector's ``select``.
+    """
+    stacks = await asyncio.to_thread(sample_thread_stacks, threading.get_ident(), seconds)
+    path = build_profile_path("sample", "folded")
+    with open(path, "w", encoding="utf-8") as profile_file:
+        for stack, count in stacks.most_common():
+            profile_file.write(f"{stack} {count}\n")
+
+    total = sum(stacks.values()) or 1
+    leaves = Counter()
+    for stack, count in stacks.items():
+        leaves[stack.rsplit(";", 1)[-1]] += count
+    summary = [f"{count / total:6.1%}  {frame}" for frame, count in leaves.most_common(top)]
+    return path, summary
+
+
+async def capture_cpu_profile(seconds: float, top: int = PROFILE_TOP_N) -> tuple[str, list[str]]:
+    """Deterministic cProfile capture of the event loop thread, sorted by own time."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.disable()
+
+    path = build_profile_path("cpu", "prof")
+    stats = pstats.Stats(profiler)
+    stats.dump_stats(path)
+    stats.sort_stats("tottime")
+    summary = []
+    for func in stats.fcn_list[:top]:
+        _, calls, own_time, cumulative_time, _ = stats.stats[func]
+        summary.append(f"{own_time:7.3f}s {cumulative_time:7.3f}s {calls:>7}  {format_frame(*func)}")
+    return path, summary
+
+
+async def capture_memory_diff(seconds: float, top: int = PROFILE_TOP_N) -> tuple[str, list[str]]:
+    """tracemalloc growth over ``seconds``, grouped by allocating line."""
+    started_here = not tracemalloc.is_tracing()
+    if started_here:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    rss_before = get_rss_bytes()
+    try:
+        before = tracemalloc.take_snapshot()
+        await asyncio.sleep(seconds)
+        after = tracemalloc.take_snapshot()
+    finally:
+        if started_here:
+            tracemalloc.stop()
+
+    ignored = (tracemalloc.Filter(False, tracemalloc.__file__),)
+    diff = await asyncio.to_thread(
+        lambda: after.filter_traces(ignored).compare_to(before.filter_traces(ignored), "lineno")
+    )
+    path = build_profile_path("memory", "txt")
+    rss_line = f"RSS: {rss_before / 1048576:.1f} МБ -> {get_rss_bytes() / 1048576:.1f} МБ"
+    with open(path, "w", encoding="utf-8") as profile_file:
+        profile_file.write(rss_line + "\n")
+        for stat in diff:
+            profile_file.write(f"{stat}\n")
+
+    summary = [rss_line]
+    for stat in diff[:top]:
+        frame = stat.traceback[0]
+        summary.append(
+            f"{stat.size_diff / 1024:+9.1f} КБ {stat.count_diff:+7}  {os.path.basename(frame.filename)}:{frame.lineno}"
+        )
+    return path, summary
+
+
+CAPTURES = {
+    "sample": capture_sampled_profile,
+    "cpu": capture_cpu_profile,
+    "mem": capture_memory_diff,
+}
+
+
+async def run_profile(kind: str, seconds: float = PROFILE_DEFAULT_SECONDS, top: int = PROFILE_TOP_N):
+    """Run one capture at a time; returns the result file path and a top-N summary."""
+    if kind not in CAPTURES:
+        raise ValueError(f"Неизвестный вид профиля '{kind}'. Допустимо: {', '.join(PROFILE_KINDS)}.")
+    seconds = min(seconds, PROFILE_MAX_SECONDS)
+    if not _capture_lock.acquire(blocking=False):
+        raise ProfileBusyError("Профилирование уже идёт")
+    try:
+        logging.info("🔬 Профилирование %s на %s с", kind, seconds)
+        path, summary = await CAPTURES[kind](seconds, top)
+    finally:
+        _capture_lock.release()
+    logging.info("🔬 Профиль %s записан в %s:\n%s", kind, path, "\n".join(summary))
+    return path, summary
+
+
+def install_profile_signal_handlers(spawn) -> bool:
+    """SIGUSR1 captures a sampled CPU profile, SIGUSR2 a memory diff.
+
+    ``spawn`` starts the capture as a background task. Results only go to the
+    log and ``PROFILE_DIR``.
+    """
+    loop = asyncio.get_running_loop()
+
+    def trigger(kind: str):
+        async def capture():
+            try:
+                await run_profile(kind)
+            except ProfileBusyError as exc:
+                logging.warning("%s, сигнал пропущен", exc)
+            except OSError as exc:
+                logging.warning("Не удалось записать профиль в %s: %s", PROFILE_DIR, exc)
+
+        spawn(capture())
+
+    if not hasattr(signal, "SIGUSR1"):
+        return False
+    loop.add_signal_handler(signal.SIGUSR1, trigger, "sample")
+    loop.add_signal_handler(signal.SIGUSR2, trigger, "mem")
+    return True
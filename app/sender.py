@@ -0,0 +1,181 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable
+
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.metrics import TELEGRAM_SEND_SECONDS
+
+# Telegram asks bots to stay under ~30 messages/s overall, 1 message/s per
+# private chat and 20 messages/min per group.
+GLOBAL_SEND_RATE = 30
+PRIVATE_CHAT_SEND_INTERVAL = 1.0
+GROUP_CHAT_SEND_INTERVAL = 3.0
+MAX_FLOOD_RETRIES = 3
+LATENCY_SAMPLE_SIZE = 512
+
+
+class SendJob:
+    def __init__(self, call: Callable[[], Awaitable], coalesce_key, enqueued_at: float):
+        self.call = call
+        self.coalesce_key = coalesce_key
+        self.enqueued_at = enqueued_at
+        self.attempts = 0
+        self.future = asyncio.get_running_loop().create_future()
+
+
+class OutboundSender:
+    """Per-chat send queues drained under global and per-chat rate limits.
+
+    ``TelegramRetryAfter`` reschedules the job for that chat instead of failing
+    it. A queued job with the same ``coalesce_key`` is replaced by the newer
+    call, and both callers get the result of the one send that is made.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_SEND_RATE,
+        private_interval: float = PRIVATE_CHAT_SEND_INTERVAL,
+        group_interval: float = GROUP_CHAT_SEND_INTERVAL,
+        max_retries: int = MAX_FLOOD_RETRIES,
+    ):
+        self.global_interval = 1 / global_rate
+        self.private_interval = private_interval
+        self.group_interval = group_interval
+        self.max_retries = max_retries
+        self._queues: dict[int, deque[SendJob]] = {}
+        self._chat_intervals: dict[int, float] = {}
+        self._ready_at: dict[int, float] = {}
+        self._in_flight: set[int] = set()
+        self._global_ready_at = 0.0
+        self._worker: asyncio.Task | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._delivery_tasks: set[asyncio.Task] = set()
+        self._latencies: deque[float] = deque(maxlen=LATENCY_SAMPLE_SIZE)
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.coalesced = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+        return {
+            "queued": self.queue_depth,
+            "in_flight": len(self._in_flight),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "coalesced": self.coalesced,
+            "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+            "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+        }
+
+    def enqueue(self, chat_id: int, call: Callable[[], Awaitable], *, group: bool = False, coalesce_key=None) -> asyncio.Future:
+        """Queue ``call`` without waiting for it; the future resolves once it was sent or failed."""
+        loop = asyncio.get_running_loop()
+        queue = self._queues.setdefault(chat_id, deque())
+        self._chat_intervals[chat_id] = self.group_interval if group else self.private_interval
+
+        if coalesce_key is not None:
+            for queued_job in queue:
+                if queued_job.coalesce_key == coalesce_key:
+                    queued_job.call = call
+                    self.coalesced += 1
+                    return queued_job.future
+
+        job = SendJob(call, coalesce_key, loop.time())
+        queue.append(job)
+        self._ensure_worker()
+        return job.future
+
+    async def send(self, chat_id: int, call: Callable[[], Awaitable], *, group: bool = False, coalesce_key=None):
+        return await asyncio.shield(self.enqueue(chat_id, call, group=group, coalesce_key=coalesce_key))
+
+    async def drain(self):
+        """Wait until every queued send was delivered or failed."""
+        while self.queue_depth or self._in_flight:
+            await asyncio.sleep(0.05)
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+        else:
+            self._wakeup.set()
+
+    def _next_ready_chat(self) -> tuple[int | None, float]:
+        best_chat, best_ready_at = None, 0.0
+        for chat_id, queue in self._queues.items():
+            if not queue or chat_id in self._in_flight:
+                continue
+            ready_at = self._ready_at.get(chat_id, 0.0)
+            if best_chat is None or ready_at < best_ready_at:
+                best_chat, best_ready_at = chat_id, ready_at
+        return best_chat, best_ready_at
+
+    async def _wait(self, timeout: float | None):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while self.queue_depth:
+            chat_id, ready_at = self._next_ready_chat()
+            if chat_id is None:
+                await self._wait(None)
+                continue
+
+            delay = max(ready_at, self._global_ready_at) - loop.time()
+            if delay > 0:
+                await self._wait(delay)
+                continue
+
+            job = self._queues[chat_id].popleft()
+            self._in_flight.add(chat_id)
+            self._global_ready_at = loop.time() + self.global_interval
+            task = asyncio.create_task(self._deliver(chat_id, job))
+            self._delivery_tasks.add(task)
+            task.add_done_callback(self._delivery_tasks.discard)
+
+        for chat_id in [chat_id for chat_id, queue in self._queues.items() if not queue]:
+            if chat_id not in self._in_flight:
+                self._queues.pop(chat_id, None)
+
+    async def _deliver(self, chat_id: int, job: SendJob):
+        loop = asyncio.get_running_loop()
+        interval = self._chat_intervals.get(chat_id, self.private_interval)
+        try:
+            result = await job.call()
+        except TelegramRetryAfter as exc:
+            job.attempts += 1
+            if job.attempts > self.max_retries:
+                self.failed += 1
+                job.future.set_exception(exc)
+            else:
+                logging.warning(
+                    "Flood control в чате %s, повтор через %s с", chat_id, exc.retry_after
+                )
+                self.retried += 1
+                self._queues.setdefault(chat_id, deque()).appendleft(job)
+                interval = max(interval, exc.retry_after)
+        except Exception as exc:
+            self.failed += 1
+            job.future.set_exception(exc)
+        else:
+            self.sent += 1
+            latency = loop.time() - job.enqueued_at
+            self._latencies.append(latency)
+            TELEGRAM_SEND_SECONDS.observe(latency)
+            job.future.set_result(result)
+        finally:
+            self._in_flight.discard(chat_id)
+            self._ready_at[chat_id] = loop.time() + interval
+            self._ensure_worker()
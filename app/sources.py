@@ -2,17 +2,37 @@ import asyncio
 import json
 import logging
 import re
+import sqlite3
 import threading
+import time
 from urllib.parse import parse_qs, urljoin, urlparse
 
 import aiohttp
 from bs4 import BeautifulSoup
 from yandex_music import Client as YandexMusicClient
 
-from app.cache import get_cached_track, init_cache_db, set_cached_track
-from app.config import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET
+from app.cache import (
+    init_cache_db,
+    record_track_hit,
+    remember_track_entity,
+    search_cached_tracks,
+)
+from app.cache_backends import build_track_store
+from app.adapters import (
+    UNKNOWN_URL_CLASSIFICATION,
+    SourceAdapter,
+    build_host_index,
+    get_adapter_semaphore,
+)
+from app.config import SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET, UPSTREAM_BASE_URL
+from app.health import timed_fetch
+from app.memory_governor import MemoryPressureError, memory_governor
+from app.metrics import build_upstream_trace_config, record_upstream_call
+from app.tracing import span, traced
 from app.formatting import (
+    are_durations_compatible,
     build_track_payload,
+    build_track_signature,
     format_date_ru,
     get_meta_content,
     is_suspicious_yandex_label,
@@ -20,11 +40,37 @@ from app.formatting import (
     tokenize_text,
 )
 
+track_store = build_track_store()
+UPSTREAM_TRACE_CONFIG = build_upstream_trace_config()
+YANDEX_API_HOST = "api.music.yandex.net"
 _yandex_client = None
 _yandex_client_lock = threading.Lock()
 HTTP_TIMEOUT = aiohttp.ClientTimeout(total=15, connect=3, sock_connect=3, sock_read=10)
 MAX_RESPONSE_BYTES = 1_048_576
 MAX_REDIRECT_HOPS = 3
+SPOTIFY_TRACKS_BATCH_SIZE = 50
+SPOTIFY_ALBUMS_BATCH_SIZE = 20
+SPOTIFY_BATCH_WINDOW_SECONDS = 0.02
+_spotify_pending_tracks: dict[str, asyncio.Future] = {}
+_spotify_batch_timer: asyncio.TimerHandle | None = None
+_spotify_background_tasks: set[asyncio.Task] = set()
+ALBUM_LABEL_CACHE_SIZE = 4096
+_album_label_cache: dict[str, str] = {}
+SEARCH_PAGE_SIZE = 5
+SEARCH_MAX_PAGES = 6
+SEARCH_PAGE_CACHE_SIZE = 512
+SEARCH_PAGE_CACHE_TTL_SECONDS = 300
+_search_page_cache: dict[tuple[str, str], tuple[float, list[dict], str]] = {}
+_search_latency: dict[str, float] = {}
+_yandex_search_per_page = 10
+LOCAL_SEARCH_MIN_RESULTS = 3
+YANDEX_REFINEMENT_MEMO_SIZE = 2048
+_yandex_refinement_results: dict[str, dict | None] = {}
+_yandex_refinement_tasks: dict[str, asyncio.Task] = {}
+YANDEX_REFINED_FIELDS = ("artist", "track", "album", "label", "release_date")
+memory_governor.register_cache("album_labels", lambda: _album_label_cache)
+memory_governor.register_cache("search_pages", lambda: _search_page_cache)
+memory_governor.register_cache("yandex_refinements", lambda: _yandex_refinement_results)
 
 SUPPORTED_TRACK_SERVICES = {
     "spotify",
@@ -53,14 +99,39 @@ SOUNDCLOUD_REDIRECT_HOSTS = {
 }
 
 
+def upstream_url(url: str) -> str:
+    """Route an upstream URL through ``UPSTREAM_BASE_URL`` as ``<base>/<host><path>``.
+
+    Used by load tests to point every outgoing request at a local fake server.
+    """
+    if not UPSTREAM_BASE_URL:
+        return url
+    parsed = urlparse(url)
+    rewritten = f"{UPSTREAM_BASE_URL}/{parsed.netloc}{parsed.path}"
+    return f"{rewritten}?{parsed.query}" if parsed.query else rewritten
+
+
 def create_http_session() -> aiohttp.ClientSession:
     return aiohttp.ClientSession(
         timeout=HTTP_TIMEOUT,
         max_line_size=8190,
         max_field_size=8190,
+        trace_configs=[UPSTREAM_TRACE_CONFIG],
     )
 
 
+async def call_yandex_api(method, *args, **kwargs):
+    """Run a blocking ``yandex-music`` client call off-loop and record it as upstream traffic."""
+    started_at = time.perf_counter()
+    try:
+        result = await asyncio.to_thread(method, *args, **kwargs)
+    except Exception:
+        record_upstream_call(YANDEX_API_HOST, "error", started_at)
+        raise
+    record_upstream_call(YANDEX_API_HOST, 200, started_at)
+    return result
+
+
 async def read_response_bytes(resp: aiohttp.ClientResponse) -> bytes | None:
     content_length = resp.content_length
     if content_length is not None and content_length > MAX_RESPONSE_BYTES:
@@ -98,86 +169,96 @@ async def read_response_json(resp: aiohttp.ClientResponse):
     return json.loads(payload)
 
 
+def remember_bounded(cache: dict, key, value, limit: int):
+    if key not in cache and len(cache) >= limit:
+        cache.pop(next(iter(cache)))
+    cache[key] = value
+
+
 def query_contains_cyrillic(query: str) -> bool:
     return bool(re.search(r"[а-яё]", query.lower()))
 
 
+def classify_spotify_shortlink(parsed, path_parts: list[str], query: dict) -> dict:
+    return {"service": "spotify_shortlink", "kind": "shortlink", "supported": True}
+
+
+def classify_soundcloud_shortlink(parsed, path_parts: list[str], query: dict) -> dict:
+    return {"service": "soundcloud_shortlink", "kind": "shortlink", "supported": True}
+
+
+def classify_spotify_url(parsed, path_parts: list[str], query: dict) -> dict:
+    if "track" in path_parts:
+        return {"service": "spotify", "kind": "track", "supported": True}
+    if "album" in path_parts:
+        return {"service": "spotify", "kind": "album", "supported": False}
+    if "playlist" in path_parts:
+        return {"service": "spotify", "kind": "playlist", "supported": False}
+    if "artist" in path_parts:
+        return {"service": "spotify", "kind": "artist", "supported": False}
+    return UNKNOWN_URL_CLASSIFICATION
+
+
+def classify_apple_music_url(parsed, path_parts: list[str], query: dict) -> dict:
+    if "i" in query or "song" in path_parts:
+        return {"service": "apple_music", "kind": "track", "supported": True}
+    if "album" in path_parts:
+        return {"service": "apple_music", "kind": "album", "supported": False}
+    if "playlist" in path_parts:
+        return {"service": "apple_music", "kind": "playlist", "supported": False}
+    if "artist" in path_parts:
+        return {"service": "apple_music", "kind": "artist", "supported": False}
+    return UNKNOWN_URL_CLASSIFICATION
+
+
+def classify_yandex_music_url(parsed, path_parts: list[str], query: dict) -> dict:
+    if "track" in path_parts:
+        return {"service": "yandex_music", "kind": "track", "supported": True}
+    if "album" in path_parts:
+        return {"service": "yandex_music", "kind": "album", "supported": False}
+    if "playlists" in path_parts or "users" in path_parts:
+        return {"service": "yandex_music", "kind": "playlist", "supported": False}
+    if "artist" in path_parts:
+        return {"service": "yandex_music", "kind": "artist", "supported": False}
+    return UNKNOWN_URL_CLASSIFICATION
+
+
+def classify_soundcloud_url(parsed, path_parts: list[str], query: dict) -> dict:
+    if "sets" in path_parts:
+        return {"service": "soundcloud", "kind": "set", "supported": False}
+    if len(path_parts) >= 2 and path_parts[0] not in SOUNDCLOUD_NON_TRACK_PREFIXES:
+        return {"service": "soundcloud", "kind": "track", "supported": True}
+    return {"service": "soundcloud", "kind": "page", "supported": False}
+
+
+def classify_youtube_music_url(parsed, path_parts: list[str], query: dict) -> dict:
+    if "list" in query or "playlist" in path_parts:
+        return {"service": "youtube_music", "kind": "playlist", "supported": False}
+    if parsed.path == "/watch" and "v" in query:
+        return {"service": "youtube_music", "kind": "track", "supported": True}
+    return {"service": "youtube_music", "kind": "page", "supported": False}
+
+
+def classify_youtube_url(parsed, path_parts: list[str], query: dict) -> dict:
+    if parsed.netloc.lower().removeprefix("www.") == "youtu.be":
+        return {"service": "youtube", "kind": "video", "supported": False}
+    if "list" in query or "playlist" in path_parts:
+        return {"service": "youtube", "kind": "playlist", "supported": False}
+    if "shorts" in path_parts:
+        return {"service": "youtube", "kind": "short", "supported": False}
+    if parsed.path == "/watch" and "v" in query:
+        return {"service": "youtube", "kind": "video", "supported": True}
+    return {"service": "youtube", "kind": "page", "supported": False}
+
+
 def classify_music_url(url: str) -> dict:
     parsed = urlparse(url)
-    host = parsed.netloc.lower().removeprefix("www.")
-    path = parsed.path.strip("/")
-    path_parts = [part for part in path.split("/") if part]
-    query = parse_qs(parsed.query)
-
-    if host == "spotify.link":
-        return {
-            "service": "spotify_shortlink",
-            "kind": "shortlink",
-            "supported": True,
-        }
-
-    if host in {"on.soundcloud.com", "soundcloud.app.goo.gl"}:
-        return {
-            "service": "soundcloud_shortlink",
-            "kind": "shortlink",
-            "supported": True,
-        }
+    adapter = SOURCE_ADAPTERS_BY_HOST.get(parsed.netloc.lower().removeprefix("www."))
+    if adapter is None:
+        return dict(UNKNOWN_URL_CLASSIFICATION)
 
-    if host == "open.spotify.com":
-        if "track" in path_parts:
-            return {"service": "spotify", "kind": "track", "supported": True}
-        if "album" in path_parts:
-            return {"service": "spotify", "kind": "album", "supported": False}
-        if "playlist" in path_parts:
-            return {"service": "spotify", "kind": "playlist", "supported": False}
-        if "artist" in path_parts:
-            return {"service": "spotify", "kind": "artist", "supported": False}
-
-    if host == "music.apple.com":
-        if "i" in query or "song" in path_parts:
-            return {"service": "apple_music", "kind": "track", "supported": True}
-        if "album" in path_parts:
-            return {"service": "apple_music", "kind": "album", "supported": False}
-        if "playlist" in path_parts:
-            return {"service": "apple_music", "kind": "playlist", "supported": False}
-        if "artist" in path_parts:
-            return {"service": "apple_music", "kind": "artist", "supported": False}
-
-    if host == "music.yandex.ru":
-        if "track" in path_parts:
-            return {"service": "yandex_music", "kind": "track", "supported": True}
-        if "album" in path_parts:
-            return {"service": "yandex_music", "kind": "album", "supported": False}
-        if "playlists" in path_parts or "users" in path_parts:
-            return {"service": "yandex_music", "kind": "playlist", "supported": False}
-        if "artist" in path_parts:
-            return {"service": "yandex_music", "kind": "artist", "supported": False}
-
-    if host == "soundcloud.com":
-        if "sets" in path_parts:
-            return {"service": "soundcloud", "kind": "set", "supported": False}
-        if len(path_parts) >= 2 and path_parts[0] not in SOUNDCLOUD_NON_TRACK_PREFIXES:
-            return {"service": "soundcloud", "kind": "track", "supported": True}
-        return {"service": "soundcloud", "kind": "page", "supported": False}
-
-    if host in {"youtube.com", "m.youtube.com", "music.youtube.com", "youtu.be"}:
-        if host == "youtu.be":
-            return {"service": "youtube", "kind": "video", "supported": False}
-        if host == "music.youtube.com":
-            if "list" in query or "playlist" in path_parts:
-                return {"service": "youtube_music", "kind": "playlist", "supported": False}
-            if parsed.path == "/watch" and "v" in query:
-                return {"service": "youtube_music", "kind": "track", "supported": True}
-            return {"service": "youtube_music", "kind": "page", "supported": False}
-        if "list" in query or "playlist" in path_parts:
-            return {"service": "youtube", "kind": "playlist", "supported": False}
-        if "shorts" in path_parts:
-            return {"service": "youtube", "kind": "short", "supported": False}
-        if parsed.path == "/watch" and "v" in query:
-            return {"service": "youtube", "kind": "video", "supported": True}
-        return {"service": "youtube", "kind": "page", "supported": False}
-
-    return {"service": None, "kind": None, "supported": False}
+    path_parts = [part for part in parsed.path.strip("/").split("/") if part]
+    return dict(adapter.classify(parsed, path_parts, parse_qs(parsed.query)))
 
 
 def build_unsupported_url_message(classification: dict) -> str | None:
@@ -243,7 +324,7 @@ def get_yandex_client():
     if _yandex_client is None:
         with _yandex_client_lock:
             if _yandex_client is None:
-                _yandex_client = YandexMusicClient().init()
+                _yandex_client = YandexMusicClient(base_url=upstream_url(f"https://{YANDEX_API_HOST}")).init()
     return _yandex_client
 
 
@@ -252,12 +333,13 @@ def extract_track_id(spotify_url: str):
     return match.group(1) if match else None
 
 
+@traced("spotify.token")
 async def get_spotify_token():
     url = "https://accounts.spotify.com/api/token"
     data = {"grant_type": "client_credentials"}
     async with create_http_session() as session:
         async with session.post(
-            url,
+            upstream_url(url),
             data=data,
             auth=aiohttp.BasicAuth(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET),
         ) as resp:
@@ -271,7 +353,8 @@ async def resolve_spotify_link(short_url: str) -> str:
     return await resolve_redirect_url(short_url, SPOTIFY_REDIRECT_HOSTS)
 
 
-async def resolve_redirect_url(short_url: str, allowed_hosts: set[str]) -> str | None:
+@traced("resolve.redirect")
+async def resolve_redirect_url(short_url: str, allowed_hosts: set[str] | frozenset[str]) -> str | None:
     current_url = short_url
     async with create_http_session() as session:
         try:
@@ -281,7 +364,7 @@ async def resolve_redirect_url(short_url: str, allowed_hosts: set[str]) -> str |
                     logging.warning("Redirect target is outside the allowed hosts")
                     return None
 
-                async with session.get(current_url, allow_redirects=False) as resp:
+                async with session.get(upstream_url(current_url), allow_redirects=False) as resp:
                     if resp.status in {301, 302, 303, 307, 308}:
                         location = resp.headers.get("Location")
                         if not location:
@@ -289,7 +372,7 @@ async def resolve_redirect_url(short_url: str, allowed_hosts: set[str]) -> str |
                         current_url = urljoin(current_url, location)
                         continue
 
-                    final_url = str(resp.url)
+                    final_url = current_url
                     final_host = urlparse(final_url).netloc.lower().removeprefix("www.")
                     if 200 <= resp.status < 300 and final_host in allowed_hosts:
                         return final_url
@@ -302,12 +385,17 @@ async def resolve_redirect_url(short_url: str, allowed_hosts: set[str]) -> str |
             return None
 
 
+@traced("spotify.album_label")
 async def get_album_label(album_id: str) -> str:
+    cached_label = _album_label_cache.get(album_id)
+    if cached_label:
+        return cached_label
+
     token = await get_spotify_token()
     headers = {"Authorization": f"Bearer {token}"}
     async with create_http_session() as session:
         async with session.get(
-            f"https://api.spotify.com/v1/albums/{album_id}",
+            upstream_url(f"https://api.spotify.com/v1/albums/{album_id}"),
             headers=headers,
         ) as resp:
             if resp.status != 200:
@@ -315,7 +403,9 @@ async def get_album_label(album_id: str) -> str:
             data = await read_response_json(resp)
             if not data:
                 return "Unknown Label"
-            return data.get("label", "Unknown Label")
+            label = data.get("label", "Unknown Label")
+    remember_bounded(_album_label_cache, album_id, label, ALBUM_LABEL_CACHE_SIZE)
+    return label
 
 
 def extract_apple_music_song_url(url: str) -> str | None:
@@ -390,85 +480,96 @@ async def parse_apple_music(url: str):
     if canonical_song_url and canonical_song_url not in candidate_urls:
         candidate_urls.insert(0, canonical_song_url)
 
-    async with create_http_session() as session:
-        for candidate_url in candidate_urls:
-            async with session.get(
-                candidate_url,
-                headers={"User-Agent": "Mozilla/5.0"},
-            ) as resp:
-                if resp.status != 200:
-                    continue
+    try:
+        async with memory_governor.heavy_fetch() as lease, create_http_session() as session:
+            for candidate_url in candidate_urls:
+                async with session.get(
+                    upstream_url(candidate_url),
+                    headers={"User-Agent": "Mozilla/5.0"},
+                ) as resp:
+                    if resp.status != 200:
+                        continue
 
-                html = await read_response_text(resp)
-                if html is None:
-                    continue
-                soup = BeautifulSoup(html, "html.parser")
-
-                parsed_from_schema = parse_apple_music_ld_json(soup)
-                if parsed_from_schema:
-                    return build_track_payload(
-                        artist=parsed_from_schema["artist"],
-                        track=parsed_from_schema["track"],
-                        album=parsed_from_schema["album"],
-                        image=parsed_from_schema["image"],
-                        label="Apple Music",
-                        release_date=parsed_from_schema["release_date"],
-                        source="apple_music",
-                        source_url=url,
-                    )
+                    html = await read_response_text(resp)
+                    if html is None:
+                        continue
+                    lease.hold(len(html))
+                    payload = parse_apple_music_html(html, url)
+                    if payload:
+                        return payload
+    except MemoryPressureError as exc:
+        logging.warning("%s: %s", exc, url)
 
-                title_text = (
-                    get_meta_content(soup, name="apple:title")
-                    or get_meta_content(soup, property_name="og:title")
-                )
-                desc_text = (
-                    get_meta_content(soup, name="apple:description")
-                    or get_meta_content(soup, property_name="og:description")
-                )
-                image_url = get_meta_content(soup, property_name="og:image")
+    return None
 
-                if not title_text or not desc_text:
-                    continue
 
-                artist = None
-                track = title_text
-                if " by " in title_text and " on Apple Music" in title_text:
-                    song_artist = title_text.replace(" on Apple Music", "").split(" by ", 1)
-                    track = song_artist[0].strip()
-                    artist = song_artist[1].strip()
-
-                album = "Unknown Album"
-                release_date = "Unknown Date"
-                if (
-                    "Listen to " in desc_text
-                    and " by " in desc_text
-                    and " on Apple Music." in desc_text
-                ):
-                    artist = artist or desc_text.split(" by ", 1)[1].split(
-                        " on Apple Music.",
-                        1,
-                    )[0].strip()
-                if " · " in desc_text:
-                    parts = desc_text.split(" · ")
-                    if len(parts) >= 2:
-                        album = parts[0].replace("Song", "").strip() or "Unknown Album"
-                        release_date = parts[1].strip()
-
-                if not artist:
-                    continue
+def parse_apple_music_html(html: str, url: str):
+    """Parse a song page: ld+json first, then the apple:/og: meta tags."""
+    soup = BeautifulSoup(html, "html.parser")
+
+    parsed_from_schema = parse_apple_music_ld_json(soup)
+    if parsed_from_schema:
+        return build_track_payload(
+            artist=parsed_from_schema["artist"],
+            track=parsed_from_schema["track"],
+            album=parsed_from_schema["album"],
+            image=parsed_from_schema["image"],
+            label="Apple Music",
+            release_date=parsed_from_schema["release_date"],
+            source="apple_music",
+            source_url=url,
+        )
 
-                return build_track_payload(
-                    artist=artist,
-                    track=track,
-                    album=album,
-                    image=image_url,
-                    label="Apple Music",
-                    release_date=release_date,
-                    source="apple_music",
-                    source_url=url,
-                )
+    title_text = (
+        get_meta_content(soup, name="apple:title")
+        or get_meta_content(soup, property_name="og:title")
+    )
+    desc_text = (
+        get_meta_content(soup, name="apple:description")
+        or get_meta_content(soup, property_name="og:description")
+    )
+    image_url = get_meta_content(soup, property_name="og:image")
 
-    return None
+    if not title_text or not desc_text:
+        return None
+
+    artist = None
+    track = title_text
+    if " by " in title_text and " on Apple Music" in title_text:
+        song_artist = title_text.replace(" on Apple Music", "").split(" by ", 1)
+        track = song_artist[0].strip()
+        artist = song_artist[1].strip()
+
+    album = "Unknown Album"
+    release_date = "Unknown Date"
+    if (
+        "Listen to " in desc_text
+        and " by " in desc_text
+        and " on Apple Music." in desc_text
+    ):
+        artist = artist or desc_text.split(" by ", 1)[1].split(
+            " on Apple Music.",
+            1,
+        )[0].strip()
+    if " · " in desc_text:
+        parts = desc_text.split(" · ")
+        if len(parts) >= 2:
+            album = parts[0].replace("Song", "").strip() or "Unknown Album"
+            release_date = parts[1].strip()
+
+    if not artist:
+        return None
+
+    return build_track_payload(
+        artist=artist,
+        track=track,
+        album=album,
+        image=image_url,
+        label="Apple Music",
+        release_date=release_date,
+        source="apple_music",
+        source_url=url,
+    )
 
 
 def extract_yandex_track_ref(url: str):
@@ -525,6 +626,7 @@ def build_yandex_payload(track, url: str):
         release_date=release_date,
         source="yandex_music",
         source_url=url,
+        duration_ms=getattr(track, "duration_ms", None),
     )
 
 
@@ -577,13 +679,16 @@ def score_yandex_candidate(
     return score
 
 
-async def refine_yandex_payload(url: str, base_track, base_payload: dict):
+def should_refine_yandex_payload(base_track, base_payload: dict) -> bool:
     current_label = base_payload.get("label", "Яндекс.Музыка")
     artist_field = base_payload.get("artist", "")
-    should_refine = is_suspicious_yandex_label(current_label) or (
+    return is_suspicious_yandex_label(current_label) or (
         "&" in artist_field and len(base_track.artists or []) <= 1
     )
-    if not should_refine:
+
+
+async def refine_yandex_payload(url: str, base_track, base_payload: dict):
+    if not should_refine_yandex_payload(base_track, base_payload):
         return base_payload
 
     query = f"{base_payload.get('artist', '')} {base_payload.get('track', '')}".strip()
@@ -592,7 +697,7 @@ async def refine_yandex_payload(url: str, base_track, base_payload: dict):
 
     try:
         client = get_yandex_client()
-        search_result = await asyncio.to_thread(client.search, query)
+        search_result = await call_yandex_api(client.search, query)
     except Exception as exc:
         logging.warning(
             "Не удалось выполнить поиск Яндекс.Музыки для уточнения %s: %s",
@@ -645,14 +750,77 @@ async def refine_yandex_payload(url: str, base_track, base_payload: dict):
     return refined_payload
 
 
+def extract_yandex_track_id(url: str) -> str | None:
+    track_ref = extract_yandex_track_ref(url)
+    return track_ref.split(":", 1)[0] if track_ref else None
+
+
+def remember_yandex_refinement(track_id: str, refined_payload: dict | None):
+    remember_bounded(
+        _yandex_refinement_results,
+        track_id,
+        refined_payload,
+        YANDEX_REFINEMENT_MEMO_SIZE,
+    )
+
+
+async def run_yandex_refinement(url: str, track_id: str, base_track, base_payload: dict):
+    try:
+        refined_payload = await refine_yandex_payload(url, base_track, base_payload)
+    except Exception as exc:
+        logging.warning("Не удалось уточнить трек Яндекс.Музыки %s: %s", url, exc)
+        refined_payload = base_payload
+
+    outcome = None if refined_payload is base_payload else refined_payload
+    remember_yandex_refinement(track_id, outcome)
+    if outcome:
+        await store_parsed_track(SOURCE_ADAPTERS_BY_SERVICE["yandex_music"], url, outcome, record_hit=False)
+    return outcome
+
+
+def is_superseded_by_yandex_refinement(url: str, payload: dict) -> bool:
+    """True for a base payload whose refinement already finished with different metadata."""
+    refined = _yandex_refinement_results.get(extract_yandex_track_id(url))
+    return bool(refined) and any(refined.get(field) != payload.get(field) for field in YANDEX_REFINED_FIELDS)
+
+
+def schedule_yandex_refinement(url: str, track_id: str, base_track, base_payload: dict):
+    task = _yandex_refinement_tasks.get(track_id)
+    if task is None:
+        task = asyncio.create_task(
+            run_yandex_refinement(url, track_id, base_track, base_payload)
+        )
+        _yandex_refinement_tasks[track_id] = task
+        task.add_done_callback(lambda _: _yandex_refinement_tasks.pop(track_id, None))
+    return task
+
+
+def get_pending_yandex_refinement(url: str) -> asyncio.Future | None:
+    """The running refinement task, or a finished future if it already completed."""
+    track_id = extract_yandex_track_id(url)
+    if not track_id:
+        return None
+    task = _yandex_refinement_tasks.get(track_id)
+    if task is not None or track_id not in _yandex_refinement_results:
+        return task
+    finished = asyncio.get_running_loop().create_future()
+    finished.set_result(_yandex_refinement_results[track_id])
+    return finished
+
+
 async def parse_yandex_music(url: str):
     track_ref = extract_yandex_track_ref(url)
     if not track_ref:
         return None
 
+    track_id = extract_yandex_track_id(url)
+    refined_payload = _yandex_refinement_results.get(track_id)
+    if refined_payload:
+        return {**refined_payload, "source_url": url}
+
     try:
         client = get_yandex_client()
-        tracks = await asyncio.to_thread(client.tracks, [track_ref])
+        tracks = await call_yandex_api(client.tracks, [track_ref])
     except Exception as exc:
         logging.warning("Не удалось получить данные Яндекс.Музыки для %s: %s", url, exc)
         return None
@@ -662,41 +830,56 @@ async def parse_yandex_music(url: str):
         return None
 
     base_payload = build_yandex_payload(track, url)
-    return await refine_yandex_payload(url, track, base_payload)
+    # The reply goes out with the base payload; refinement edits it later if needed.
+    if (
+        track_id not in _yandex_refinement_results
+        and should_refine_yandex_payload(track, base_payload)
+    ):
+        schedule_yandex_refinement(url, track_id, track, base_payload)
+    return base_payload
 
 
 async def parse_soundcloud(url: str):
-    async with create_http_session() as session:
-        async with session.get(url, headers={"User-Agent": "Mozilla/5.0"}) as resp:
-            if resp.status != 200:
-                return None
-            html = await read_response_text(resp)
-            if html is None:
-                return None
-            soup = BeautifulSoup(html, "html.parser")
+    try:
+        async with memory_governor.heavy_fetch() as lease, create_http_session() as session:
+            async with session.get(upstream_url(url), headers={"User-Agent": "Mozilla/5.0"}) as resp:
+                if resp.status != 200:
+                    return None
+                html = await read_response_text(resp)
+                if html is None:
+                    return None
+                lease.hold(len(html))
+                return parse_soundcloud_html(html, url)
+    except MemoryPressureError as exc:
+        logging.warning("%s: %s", exc, url)
+        return None
 
-            title_text = get_meta_content(soup, property_name="og:title")
-            image_url = get_meta_content(soup, property_name="og:image")
 
-            if not title_text:
-                return None
+def parse_soundcloud_html(html: str, url: str):
+    soup = BeautifulSoup(html, "html.parser")
 
-            cleaned_title = clean_soundcloud_title(title_text)
-            if " - " in cleaned_title:
-                artist, track = cleaned_title.split(" - ", 1)
-            else:
-                return None
+    title_text = get_meta_content(soup, property_name="og:title")
+    image_url = get_meta_content(soup, property_name="og:image")
 
-            return build_track_payload(
-                artist=artist.strip(),
-                track=track.strip(),
-                album="Unknown Album",
-                image=image_url,
-                label="SoundCloud",
-                release_date="Unknown Date",
-                source="soundcloud",
-                source_url=url,
-            )
+    if not title_text:
+        return None
+
+    cleaned_title = clean_soundcloud_title(title_text)
+    if " - " in cleaned_title:
+        artist, track = cleaned_title.split(" - ", 1)
+    else:
+        return None
+
+    return build_track_payload(
+        artist=artist.strip(),
+        track=track.strip(),
+        album="Unknown Album",
+        image=image_url,
+        label="SoundCloud",
+        release_date="Unknown Date",
+        source="soundcloud",
+        source_url=url,
+    )
 
 
 def clean_soundcloud_title(title: str) -> str:
@@ -735,7 +918,7 @@ def clean_youtube_music_track(value: str) -> str:
 async def parse_youtube_music(url: str):
     oembed_url = f"https://www.youtube.com/oembed?url={url}&format=json"
     async with create_http_session() as session:
-        async with session.get(oembed_url, headers={"User-Agent": "Mozilla/5.0"}) as resp:
+        async with session.get(upstream_url(oembed_url), headers={"User-Agent": "Mozilla/5.0"}) as resp:
             if resp.status != 200:
                 return None
             data = await read_response_json(resp)
@@ -774,13 +957,17 @@ def is_probable_youtube_track(title: str, author_name: str) -> bool:
 async def parse_youtube(url: str):
     oembed_url = f"https://www.youtube.com/oembed?url={url}&format=json"
     async with create_http_session() as session:
-        async with session.get(oembed_url, headers={"User-Agent": "Mozilla/5.0"}) as resp:
+        async with session.get(upstream_url(oembed_url), headers={"User-Agent": "Mozilla/5.0"}) as resp:
             if resp.status != 200:
                 return None
             data = await read_response_json(resp)
             if not data:
                 return None
 
+    return build_youtube_payload(data, url)
+
+
+def build_youtube_payload(data: dict, url: str):
     raw_title = data.get("title", "Unknown Track")
     raw_author = data.get("author_name", "Unknown Artist")
     image_url = data.get("thumbnail_url")
@@ -809,54 +996,170 @@ async def parse_youtube(url: str):
     )
 
 
-async def get_track_info(track_id: str):
+def build_spotify_track_payload(data: dict, label: str) -> dict:
+    album_data = data["album"]
+    image_url = album_data["images"][0]["url"] if album_data.get("images") else None
+    return {
+        "artist": ", ".join(artist["name"] for artist in data["artists"]),
+        "track": data["name"],
+        "album": album_data["name"],
+        "image": image_url,
+        "label": label,
+        "release_date": format_date_ru(album_data.get("release_date", "Unknown Date")),
+        "source": "spotify",
+        "source_url": f"https://open.spotify.com/track/{data['id']}",
+        "duration_ms": data.get("duration_ms"),
+        "isrc": (data.get("external_ids") or {}).get("isrc"),
+    }
+
+
+@traced("spotify.album_labels")
+async def get_album_labels(album_ids: list[str], token: str | None = None) -> dict[str, str]:
+    labels = {
+        album_id: _album_label_cache[album_id]
+        for album_id in album_ids
+        if album_id in _album_label_cache
+    }
+    missing_ids = [album_id for album_id in album_ids if album_id not in labels]
+    if not missing_ids:
+        return labels
+
+    token = token or await get_spotify_token()
+    headers = {"Authorization": f"Bearer {token}"}
+    async with create_http_session() as session:
+        for start in range(0, len(missing_ids), SPOTIFY_ALBUMS_BATCH_SIZE):
+            chunk = missing_ids[start:start + SPOTIFY_ALBUMS_BATCH_SIZE]
+            async with session.get(
+                upstream_url("https://api.spotify.com/v1/albums"),
+                params={"ids": ",".join(chunk)},
+                headers=headers,
+            ) as resp:
+                if resp.status != 200:
+                    continue
+                data = await read_response_json(resp)
+            for album in (data or {}).get("albums") or []:
+                if album and album.get("id"):
+                    labels[album["id"]] = album.get("label") or "Unknown Label"
+                    remember_bounded(
+                        _album_label_cache,
+                        album["id"],
+                        labels[album["id"]],
+                        ALBUM_LABEL_CACHE_SIZE,
+                    )
+    return {album_id: labels.get(album_id, "Unknown Label") for album_id in album_ids}
+
+
+def count_background_tasks() -> int:
+    return len(_spotify_background_tasks) + len(_yandex_refinement_tasks)
+
+
+def spawn_spotify_task(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _spotify_background_tasks.add(task)
+    task.add_done_callback(_spotify_background_tasks.discard)
+    return task
+
+
+async def _warm_album_labels(album_ids: list[str]):
+    try:
+        await get_album_labels(album_ids)
+    except Exception as exc:
+        logging.warning("Не удалось прогреть лейблы альбомов Spotify: %s", exc)
+
+
+def warm_album_label_cache(album_ids: list[str]):
+    missing_ids = [
+        album_id
+        for album_id in dict.fromkeys(album_ids)
+        if album_id and album_id not in _album_label_cache
+    ]
+    if missing_ids:
+        spawn_spotify_task(_warm_album_labels(missing_ids))
+
+
+async def fetch_spotify_tracks_batch(track_ids: list[str]) -> dict[str, dict]:
     token = await get_spotify_token()
     headers = {"Authorization": f"Bearer {token}"}
     async with create_http_session() as session:
         async with session.get(
-            f"https://api.spotify.com/v1/tracks/{track_id}",
+            upstream_url("https://api.spotify.com/v1/tracks"),
+            params={"ids": ",".join(track_ids)},
             headers=headers,
         ) as resp:
             if resp.status != 200:
-                return None
+                logging.warning("Spotify tracks batch error: %s", resp.status)
+                return {}
             data = await read_response_json(resp)
             if not data:
-                return None
+                return {}
+
+    tracks = [item for item in data.get("tracks") or [] if item and item.get("id")]
+    album_ids = list(dict.fromkeys(item["album"]["id"] for item in tracks))
+    labels = await get_album_labels(album_ids, token)
+    return {
+        item["id"]: build_spotify_track_payload(item, labels[item["album"]["id"]])
+        for item in tracks
+    }
 
-            artist_names = ", ".join(artist["name"] for artist in data["artists"])
-            track_name = data["name"]
-            album_data = data["album"]
-            album_name = album_data["name"]
-            album_id = album_data["id"]
-            image_url = album_data["images"][0]["url"] if album_data.get("images") else None
-            release_date_raw = album_data.get("release_date", "Unknown Date")
-            release_date = format_date_ru(release_date_raw)
-
-        label = await get_album_label(album_id)
-        return {
-            "artist": artist_names,
-            "track": track_name,
-            "album": album_name,
-            "image": image_url,
-            "label": label,
-            "release_date": release_date,
-            "source": "spotify",
-            "source_url": f"https://open.spotify.com/track/{track_id}",
-        }
 
+async def _resolve_spotify_track_batch(batch: dict[str, asyncio.Future]):
+    track_ids = list(batch)
+    payloads = {}
+    for start in range(0, len(track_ids), SPOTIFY_TRACKS_BATCH_SIZE):
+        chunk = track_ids[start:start + SPOTIFY_TRACKS_BATCH_SIZE]
+        try:
+            payloads.update(await fetch_spotify_tracks_batch(chunk))
+        except Exception as exc:
+            logging.warning("Не удалось получить пакет треков Spotify: %s", exc)
+
+    for track_id, future in batch.items():
+        if not future.done():
+            future.set_result(payloads.get(track_id))
 
-async def search_spotify_tracks(query: str):
+
+def _dispatch_spotify_track_batch():
+    global _spotify_batch_timer
+    if _spotify_batch_timer is not None:
+        _spotify_batch_timer.cancel()
+        _spotify_batch_timer = None
+
+    batch = dict(_spotify_pending_tracks)
+    _spotify_pending_tracks.clear()
+    if batch:
+        spawn_spotify_task(_resolve_spotify_track_batch(batch))
+
+
+@traced("spotify.track")
+async def get_track_info(track_id: str):
+    # Concurrent lookups are coalesced into one /v1/tracks?ids= call per window.
+    global _spotify_batch_timer
+    future = _spotify_pending_tracks.get(track_id)
+    if future is None:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        _spotify_pending_tracks[track_id] = future
+        if len(_spotify_pending_tracks) >= SPOTIFY_TRACKS_BATCH_SIZE:
+            _dispatch_spotify_track_batch()
+        elif _spotify_batch_timer is None:
+            _spotify_batch_timer = loop.call_later(
+                SPOTIFY_BATCH_WINDOW_SECONDS,
+                _dispatch_spotify_track_batch,
+            )
+    return await asyncio.shield(future)
+
+
+async def search_spotify_tracks(query: str, limit: int = 5, offset: int = 0):
     token = await get_spotify_token()
     if not token:
         logging.warning("Не удалось получить Spotify token для поиска")
         return []
 
     headers = {"Authorization": f"Bearer {token}"}
-    params = {"q": query, "type": "track", "limit": 5}
+    params = {"q": query, "type": "track", "limit": limit, "offset": offset}
 
     async with create_http_session() as session:
         async with session.get(
-            "https://api.spotify.com/v1/search",
+            upstream_url("https://api.spotify.com/v1/search"),
             headers=headers,
             params=params,
         ) as resp:
@@ -870,9 +1173,16 @@ async def search_spotify_tracks(query: str):
             return data.get("tracks", {}).get("items", []) or []
 
 
-async def search_spotify_track_payloads(query: str, limit: int = 3):
-    items = await search_spotify_tracks(query)
+async def search_spotify_track_payloads(
+    query: str,
+    limit: int = 3,
+    offset: int = 0,
+    warm_labels: bool = True,
+):
+    # Search hits carry no label: answer with what we have and warm labels in background.
+    items = await search_spotify_tracks(query, limit, offset)
     payloads = []
+    album_ids = []
     for item in items[:limit]:
         track = item.get("name", "Unknown")
         artist = ", ".join(a["name"] for a in item.get("artists", [])) or "Unknown"
@@ -880,7 +1190,13 @@ async def search_spotify_track_payloads(query: str, limit: int = 3):
         image_url = item.get("album", {}).get("images", [{}])[0].get("url")
         spotify_url = item.get("external_urls", {}).get("spotify", "")
         album_id = item.get("album", {}).get("id")
-        label = item.get("album", {}).get("label") or await get_album_label(album_id)
+        label = (
+            item.get("album", {}).get("label")
+            or _album_label_cache.get(album_id)
+            or "Spotify"
+        )
+        if label == "Spotify":
+            album_ids.append(album_id)
         release_date = format_date_ru(item.get("album", {}).get("release_date", "Unknown Date"))
 
         payloads.append(
@@ -893,16 +1209,21 @@ async def search_spotify_track_payloads(query: str, limit: int = 3):
                 release_date=release_date,
                 source="spotify",
                 source_url=spotify_url,
+                duration_ms=item.get("duration_ms"),
+                isrc=(item.get("external_ids") or {}).get("isrc"),
             )
         )
+        payloads[-1]["album_id"] = album_id
+    if warm_labels:
+        warm_album_label_cache(album_ids)
     return payloads
 
 
-async def search_apple_music_tracks(query: str, limit: int = 3):
-    params = {"term": query, "entity": "song", "limit": str(limit)}
+async def search_apple_music_tracks(query: str, limit: int = 3, offset: int = 0):
+    params = {"term": query, "entity": "song", "limit": str(limit), "offset": str(offset)}
     async with create_http_session() as session:
         async with session.get(
-            "https://itunes.apple.com/search",
+            upstream_url("https://itunes.apple.com/search"),
             params=params,
             headers={"User-Agent": "Mozilla/5.0"},
         ) as resp:
@@ -924,20 +1245,33 @@ async def search_apple_music_tracks(query: str, limit: int = 3):
                 release_date=format_date_ru(item.get("releaseDate", "Unknown Date")),
                 source="apple_music",
                 source_url=item.get("trackViewUrl") or item.get("collectionViewUrl") or "",
+                duration_ms=item.get("trackTimeMillis"),
             )
         )
     return payloads
 
 
-async def search_yandex_music_tracks(query: str, limit: int = 3):
+async def search_yandex_music_tracks(query: str, limit: int = 3, offset: int = 0):
+    global _yandex_search_per_page
+    # Yandex search is page-based; page size is learned from the first response.
+    page, page_offset = divmod(offset, _yandex_search_per_page)
     try:
         client = get_yandex_client()
-        search_result = await asyncio.to_thread(client.search, query)
+        search_result = await call_yandex_api(
+            client.search,
+            query,
+            type_="track",
+            page=page,
+        )
     except Exception as exc:
         logging.warning("Не удалось выполнить поиск Яндекс.Музыки для %s: %s", query, exc)
         return []
 
-    tracks = (getattr(getattr(search_result, "tracks", None), "results", None) or [])[:limit]
+    track_results = getattr(search_result, "tracks", None)
+    per_page = getattr(track_results, "per_page", None)
+    if isinstance(per_page, int) and per_page > 0:
+        _yandex_search_per_page = per_page
+    tracks = (getattr(track_results, "results", None) or [])[page_offset:page_offset + limit]
     payloads = []
     for track in tracks:
         album = next(iter(track.albums or []), None)
@@ -953,52 +1287,402 @@ async def search_yandex_music_tracks(query: str, limit: int = 3):
     return payloads
 
 
-async def search_multisource_tracks(query: str, limit_per_source: int = 3):
-    spotify_results, apple_results, yandex_results = await asyncio.gather(
-        search_spotify_track_payloads(query, limit_per_source),
-        search_apple_music_tracks(query, limit_per_source),
-        search_yandex_music_tracks(query, limit_per_source),
-    )
+def dedupe_track_payloads(payloads: list[dict]) -> list[dict]:
+    """Collapse copies of one recording found in several sources.
+
+    Items match by ISRC, or by artist and title token sets when the durations
+    agree. The first copy wins and collects the other copies' links.
+    """
+    unique = []
+    by_isrc = {}
+    by_signature = {}
+    for payload in payloads:
+        isrc = (payload.get("isrc") or "").upper()
+        signature = build_track_signature(payload)
+        match = by_isrc.get(isrc) if isrc else None
+        if match is None and all(signature):
+            match = next(
+                (
+                    candidate
+                    for candidate in by_signature.get(signature, [])
+                    if are_durations_compatible(candidate, payload)
+                ),
+                None,
+            )
 
+        if match is None:
+            match = {**payload, "links": {payload["source"]: payload["source_url"]}}
+            unique.append(match)
+            by_signature.setdefault(signature, []).append(match)
+        else:
+            match["links"].setdefault(payload["source"], payload["source_url"])
+            for key, unknown in (
+                ("album", "Unknown Album"),
+                ("release_date", "Unknown Date"),
+                ("image", None),
+                ("duration_ms", None),
+                ("isrc", None),
+            ):
+                if match.get(key) == unknown and payload.get(key) != unknown:
+                    match[key] = payload[key]
+        if isrc:
+            by_isrc.setdefault(isrc, match)
+    return unique
+
+
+async def timed_source_search(source: str, search):
+    started_at = time.monotonic()
+    try:
+        return await search
+    finally:
+        elapsed = time.monotonic() - started_at
+        previous = _search_latency.get(source)
+        _search_latency[source] = (
+            elapsed if previous is None else previous * 0.8 + elapsed * 0.2
+        )
+
+
+def order_search_sources(query: str) -> list[str]:
     if query_contains_cyrillic(query):
-        ordered_sources = [spotify_results, yandex_results, apple_results]
+        return ["spotify", "yandex_music", "apple_music"]
+    return ["spotify", "apple_music", "yandex_music"]
+
+
+def get_fastest_search_source(query: str) -> str:
+    ordered_sources = order_search_sources(query)
+    return min(
+        ordered_sources,
+        key=lambda source: (_search_latency.get(source, 0.0), ordered_sources.index(source)),
+    )
+
+
+async def search_source_tracks(source: str, query: str, limit: int, offset: int = 0):
+    if source == "spotify":
+        search = search_spotify_track_payloads(query, limit, offset)
+    elif source == "apple_music":
+        search = search_apple_music_tracks(query, limit, offset)
+    elif source == "yandex_music":
+        search = search_yandex_music_tracks(query, limit, offset)
     else:
-        ordered_sources = [spotify_results, apple_results, yandex_results]
+        return []
+    return await timed_source_search(source, search)
 
+
+async def search_multisource_tracks(
+    query: str,
+    limit_per_source: int = 3,
+    source_offsets: dict[str, int] | None = None,
+):
+    source_offsets = source_offsets or {}
+    spotify_results, apple_results, yandex_results = await asyncio.gather(
+        timed_source_search(
+            "spotify",
+            search_spotify_track_payloads(
+                query,
+                limit_per_source,
+                source_offsets.get("spotify", 0),
+                warm_labels=False,
+            ),
+        ),
+        timed_source_search(
+            "apple_music",
+            search_apple_music_tracks(query, limit_per_source, source_offsets.get("apple_music", 0)),
+        ),
+        timed_source_search(
+            "yandex_music",
+            search_yandex_music_tracks(query, limit_per_source, source_offsets.get("yandex_music", 0)),
+        ),
+    )
+
+    results_by_source = {
+        "spotify": spotify_results,
+        "apple_music": apple_results,
+        "yandex_music": yandex_results,
+    }
     results = []
-    for source_results in ordered_sources:
-        results.extend(source_results)
+    for source in order_search_sources(query):
+        results.extend(results_by_source[source])
+
+    # Labels are only warmed for the Spotify hits that survive deduplication.
+    results = dedupe_track_payloads(results)
+    warm_album_label_cache([
+        item.get("album_id")
+        for item in results
+        if item["source"] == "spotify" and item["label"] == "Spotify"
+    ])
     return results
 
 
+def parse_search_offset(offset: str, query: str) -> tuple[int, str]:
+    page_text, _, source = (offset or "").partition(":")
+    if page_text.isdigit() and source in order_search_sources(query):
+        return int(page_text), source
+    return 0, get_fastest_search_source(query)
+
+
+async def search_tracks_page(query: str, offset: str = "") -> tuple[list[dict], str]:
+    """Return one inline page of search results and the next_offset for Telegram.
+
+    The first request is answered from the local index of already resolved
+    tracks; remote sources are queried only when it has too few hits.
+    """
+    if offset:
+        return await search_remote_tracks_page(query, offset)
+
+    local_items = dedupe_track_payloads(search_cached_tracks(query, SEARCH_PAGE_SIZE))
+    if len(local_items) >= LOCAL_SEARCH_MIN_RESULTS:
+        return local_items, f"0:{get_fastest_search_source(query)}"
+
+    items, next_offset = await search_remote_tracks_page(query)
+    if local_items:
+        items = dedupe_track_payloads(local_items + items)
+    return items, next_offset
+
+
+async def search_remote_tracks_page(query: str, offset: str = "") -> tuple[list[dict], str]:
+    """Return one page of remote search results and the next_offset.
+
+    The first page holds the fastest source's top hits. Page N asks every source
+    for its next slice, skipping what the fastest source already gave on page 0.
+    """
+    page, fastest_source = parse_search_offset(offset, query)
+    cache_key = (normalize_text(query), f"{page}:{fastest_source}")
+    cached_page = _search_page_cache.get(cache_key)
+    if cached_page and cached_page[0] > time.monotonic():
+        return cached_page[1], cached_page[2]
+
+    if page == 0:
+        items = await search_source_tracks(fastest_source, query, SEARCH_PAGE_SIZE)
+        if not items:
+            return await search_remote_tracks_page(query, f"1:{fastest_source}")
+    else:
+        source_offsets = {
+            source: (page if source == fastest_source else page - 1) * SEARCH_PAGE_SIZE
+            for source in order_search_sources(query)
+        }
+        items = await search_multisource_tracks(query, SEARCH_PAGE_SIZE, source_offsets)
+
+    has_more = bool(items) and page + 1 < SEARCH_MAX_PAGES
+    next_offset = f"{page + 1}:{fastest_source}" if has_more else ""
+    remember_bounded(
+        _search_page_cache,
+        cache_key,
+        (time.monotonic() + SEARCH_PAGE_CACHE_TTL_SECONDS, items, next_offset),
+        SEARCH_PAGE_CACHE_SIZE,
+    )
+    return items, next_offset
+
+
+def extract_youtube_video_id(url: str) -> str | None:
+    return next(iter(parse_qs(urlparse(url).query).get("v", [])), None)
+
+
+def extract_apple_music_song_id(url: str) -> str | None:
+    song_url = extract_apple_music_song_url(url)
+    return song_url.rsplit("/", 1)[-1] if song_url else None
+
+
+def extract_soundcloud_track_path(url: str) -> str | None:
+    return urlparse(url).path.strip("/").lower() or None
+
+
+async def fetch_spotify_track(url: str):
+    track_id = extract_track_id(url)
+    return await get_track_info(track_id) if track_id else None
+
+
+async def fetch_spotify_tracks_coalesced(track_ids: list[str]) -> dict[str, dict]:
+    """Batch fetch through ``get_track_info``, so IDs from concurrent updates share one call."""
+    payloads = await asyncio.gather(*(get_track_info(track_id) for track_id in track_ids))
+    return {track_id: payload for track_id, payload in zip(track_ids, payloads) if payload}
+
+
+# Adapters call parsers through lambdas so module-level patches in tests still apply.
+SOURCE_ADAPTERS = [
+    SourceAdapter(
+        service="spotify_shortlink",
+        hosts=frozenset({"spotify.link"}),
+        classify=classify_spotify_shortlink,
+        redirect_hosts=frozenset(SPOTIFY_REDIRECT_HOSTS),
+    ),
+    SourceAdapter(
+        service="soundcloud_shortlink",
+        hosts=frozenset({"on.soundcloud.com", "soundcloud.app.goo.gl"}),
+        classify=classify_soundcloud_shortlink,
+        redirect_hosts=frozenset(SOUNDCLOUD_REDIRECT_HOSTS),
+    ),
+    SourceAdapter(
+        service="spotify",
+        hosts=frozenset({"open.spotify.com"}),
+        classify=classify_spotify_url,
+        extract_id=lambda url: extract_track_id(url),
+        fetch=lambda url: fetch_spotify_track(url),
+        fetch_batch=lambda track_ids: fetch_spotify_tracks_coalesced(track_ids),
+        max_concurrency=SPOTIFY_TRACKS_BATCH_SIZE,
+    ),
+    SourceAdapter(
+        service="apple_music",
+        hosts=frozenset({"music.apple.com"}),
+        classify=classify_apple_music_url,
+        extract_id=lambda url: extract_apple_music_song_id(url),
+        fetch=lambda url: parse_apple_music(url),
+        max_concurrency=3,
+    ),
+    SourceAdapter(
+        service="yandex_music",
+        hosts=frozenset({"music.yandex.ru"}),
+        classify=classify_yandex_music_url,
+        extract_id=lambda url: extract_yandex_track_id(url),
+        fetch=lambda url: parse_yandex_music(url),
+        max_concurrency=2,
+    ),
+    SourceAdapter(
+        service="soundcloud",
+        hosts=frozenset({"soundcloud.com"}),
+        classify=classify_soundcloud_url,
+        extract_id=lambda url: extract_soundcloud_track_path(url),
+        fetch=lambda url: parse_soundcloud(url),
+        max_concurrency=3,
+    ),
+    SourceAdapter(
+        service="youtube_music",
+        hosts=frozenset({"music.youtube.com"}),
+        classify=classify_youtube_music_url,
+        extract_id=lambda url: extract_youtube_video_id(url),
+        fetch=lambda url: parse_youtube_music(url),
+    ),
+    SourceAdapter(
+        service="youtube",
+        hosts=frozenset({"youtube.com", "m.youtube.com", "youtu.be"}),
+        classify=classify_youtube_url,
+        extract_id=lambda url: extract_youtube_video_id(url),
+        fetch=lambda url: parse_youtube(url),
+    ),
+]
+SOURCE_ADAPTERS_BY_HOST = build_host_index(SOURCE_ADAPTERS)
+SOURCE_ADAPTERS_BY_SERVICE = {adapter.service: adapter for adapter in SOURCE_ADAPTERS}
+
+
+async def store_parsed_track(adapter: SourceAdapter, url: str, parsed: dict | None, record_hit: bool = True):
+    if not parsed:
+        return parsed
+    fetched = parsed
+    with span("cache.store", service=adapter.service):
+        try:
+            # The entity merge writes SQLite; keep it off the event loop.
+            parsed = await asyncio.to_thread(remember_track_entity, parsed, adapter.extract_id(url))
+            # Checked after the await: a refinement finishing meanwhile must not be overwritten.
+            if adapter.service == "yandex_music" and is_superseded_by_yandex_refinement(url, fetched):
+                logging.info("Базовые данные %s не кешируются: уточнение уже готово", url)
+            else:
+                await track_store.set(url, parsed, adapter.cache_ttl)
+        except (sqlite3.Error, OSError) as exc:
+            # The reply doesn't depend on the cache; answer with what was fetched.
+            logging.warning("Не удалось сохранить %s в кеш: %s", url, exc)
+        if record_hit:
+            record_track_hit(url)
+    return parsed
+
+
+def get_fetch_adapter(url: str) -> SourceAdapter | None:
+    classification = classify_music_url(url)
+    if not classification.get("supported"):
+        return None
+    adapter = SOURCE_ADAPTERS_BY_SERVICE.get(classification["service"])
+    if adapter is None or adapter.fetch is None:
+        return None
+    return adapter
+
+
+async def expand_short_link(url: str) -> tuple[str | None, dict]:
+    """Follow a short link within its adapter's ``redirect_hosts``.
+
+    Returns the expanded URL and its classification; other URLs come back
+    unchanged. The URL is ``None`` when the short link could not be expanded.
+    """
+    classification = classify_music_url(url)
+    adapter = SOURCE_ADAPTERS_BY_SERVICE.get(classification.get("service"))
+    if adapter is None or not adapter.redirect_hosts:
+        return url, classification
+    expanded = await resolve_redirect_url(url, adapter.redirect_hosts)
+    if not expanded:
+        return None, classification
+    return expanded, classify_music_url(expanded)
+
+
+def get_canonical_track_key(url: str) -> str:
+    adapter = get_fetch_adapter(url)
+    track_id = adapter.extract_id(url) if adapter else None
+    return f"{adapter.service}:{track_id}" if track_id else url
+
+
 async def parse_music_url(url: str):
-    cached = get_cached_track(url)
+    with span("cache.get"):
+        cached = await track_store.get(url)
     if cached:
+        record_track_hit(url)
         return cached
 
-    classification = classify_music_url(url)
-    if not classification.get("supported"):
+    adapter = get_fetch_adapter(url)
+    if adapter is None:
         return None
 
-    parsed = None
-    if classification["service"] == "apple_music":
-        parsed = await parse_apple_music(url)
-    elif classification["service"] == "yandex_music":
-        parsed = await parse_yandex_music(url)
-    elif classification["service"] == "soundcloud":
-        parsed = await parse_soundcloud(url)
-    elif classification["service"] == "youtube_music":
-        parsed = await parse_youtube_music(url)
-    elif classification["service"] == "youtube":
-        parsed = await parse_youtube(url)
-    elif classification["service"] == "spotify":
-        track_id = extract_track_id(url)
-        if track_id:
-            parsed = await get_track_info(track_id)
-
-    if parsed:
-        set_cached_track(url, parsed)
-    return parsed
+    with span("fetch", service=adapter.service):
+        async with get_adapter_semaphore(adapter):
+            parsed = await timed_fetch(adapter.service, adapter.fetch(url))
+    return await store_parsed_track(adapter, url, parsed)
+
+
+async def parse_music_urls(urls: list[str]) -> dict[str, dict | None]:
+    """Resolve several URLs at once, using an adapter's batch fetch when it has one."""
+    results = {}
+    batches: dict[str, list[str]] = {}
+    singles = []
+    cached_tracks = await track_store.get_many(list(dict.fromkeys(urls)))
+    for url in dict.fromkeys(urls):
+        cached = cached_tracks.get(url)
+        if cached:
+            record_track_hit(url)
+            results[url] = cached
+            continue
+        adapter = get_fetch_adapter(url)
+        if adapter is None:
+            results[url] = None
+        elif adapter.fetch_batch and adapter.extract_id(url):
+            batches.setdefault(adapter.service, []).append(url)
+        else:
+            singles.append(url)
+
+    async def resolve_batch(adapter: SourceAdapter, batch_urls: list[str]):
+        track_ids = {url: adapter.extract_id(url) for url in batch_urls}
+        try:
+            async with get_adapter_semaphore(adapter):
+                payloads = await timed_fetch(
+                    adapter.service, adapter.fetch_batch(list(dict.fromkeys(track_ids.values())))
+                )
+        except Exception as exc:
+            # Only this batch fails; the other URLs of the call still resolve.
+            logging.warning("Не удалось получить пакет треков %s: %s", adapter.service, exc)
+            payloads = {}
+        for url, track_id in track_ids.items():
+            results[url] = await store_parsed_track(adapter, url, payloads.get(track_id))
+
+    async def resolve_single(url: str):
+        try:
+            results[url] = await parse_music_url(url)
+        except Exception as exc:
+            # Parsers don't catch network errors themselves; one bad link must not drop the others.
+            logging.warning("Не удалось получить трек %s: %s", url, exc)
+            results[url] = None
+
+    await asyncio.gather(
+        *(
+            resolve_batch(SOURCE_ADAPTERS_BY_SERVICE[service], batch_urls)
+            for service, batch_urls in batches.items()
+        ),
+        *(resolve_single(url) for url in singles),
+    )
+    return {url: results.get(url) for url in dict.fromkeys(urls)}
 
 
 init_cache_db()
@@ -1,9 +1,13 @@
 import asyncio
+import html
 import logging
+import signal
 from urllib.parse import quote
 
 from aiogram import Bot, Dispatcher, F, types
-from aiogram.filters import Command
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject
 from aiogram.types import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
@@ -11,21 +15,114 @@ from aiogram.types import (
     InlineQueryResultArticle,
     InputTextMessageContent,
 )
-
-from app.config import AUTO_DELETE_DELAY, TELEGRAM_TOKEN
-from app.formatting import build_caption, build_inline_description
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from app.auto_delete import AutoDeleteScheduler
+from app.cache import run_track_hit_flusher, table_row_counts
+from app.config import (
+    ADMIN_USER_IDS,
+    AUTO_DELETE_DELAY,
+    LOOP_LAG_THRESHOLD_SECONDS,
+    LOOP_MONITOR_ENABLED,
+    METRICS_HOST,
+    METRICS_PORT,
+    TELEGRAM_API_URL,
+    TELEGRAM_TOKEN,
+    UPDATE_QUEUE_LIMIT,
+    UPDATE_RECORD_PATH,
+    UPDATE_SHED_AFTER_SECONDS,
+    UPDATE_WORKERS,
+    WEBHOOK_HOST,
+    WEBHOOK_PATH,
+    WEBHOOK_PORT,
+    WEBHOOK_SECRET,
+    WEBHOOK_URL,
+)
+from app.formatting import (
+    append_sender_footer,
+    build_caption,
+    build_digest_caption,
+    build_inline_description,
+    should_show_label,
+)
+from app.health import SOURCE_STATS_WINDOWS, get_memory_limit_bytes, get_rss_bytes, source_health
+from app.loop_monitor import LoopLagMonitor
+from app.memory_governor import MEMORY_GOVERNOR_DECISIONS_TOTAL, memory_governor
+from app.metrics import CACHE_LOOKUPS_TOTAL, MESSAGE_FILTER_TOTAL, Gauge, HandlerTimingMiddleware, start_metrics_server
+from app.profiling import (
+    PROFILE_DEFAULT_SECONDS,
+    PROFILE_KINDS,
+    ProfileBusyError,
+    install_profile_signal_handlers,
+    run_profile,
+)
+from app.sender import OutboundSender
+from app.tracing import TracingMiddleware, capture_span_context, resume_span, span
 from app.sources import (
     build_unsupported_url_message,
     classify_music_url,
+    count_background_tasks,
+    expand_short_link,
+    extract_track_id,
+    get_canonical_track_key,
+    get_pending_yandex_refinement,
     parse_music_url,
-    resolve_redirect_url,
-    resolve_spotify_link,
-    SOUNDCLOUD_REDIRECT_HOSTS,
-    search_multisource_tracks,
+    parse_music_urls,
+    remember_bounded,
+    SEARCH_PAGE_SIZE,
+    SOURCE_ADAPTERS_BY_HOST,
+    search_tracks_page,
 )
+from app.update_queue import PriorityUpdateMiddleware
+from app.update_recorder import UpdateRecorderMiddleware
+
 
-bot = Bot(token=TELEGRAM_TOKEN)
+def build_bot_session() -> AiohttpSession | None:
+    # TELEGRAM_API_URL points the bot at a local Bot API server or a load-test stand-in.
+    if not TELEGRAM_API_URL:
+        return None
+    return AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+
+
+bot = Bot(token=TELEGRAM_TOKEN, session=build_bot_session())
 dp = Dispatcher()
+_background_tasks: set[asyncio.Task] = set()
+LAZY_SPOTIFY_RESULT_PREFIX = "spotify-lazy-"
+MUSIC_LINK_HOSTS = frozenset(SOURCE_ADAPTERS_BY_HOST)
+MAX_LINKS_PER_MESSAGE = 10
+LINK_RESOLVE_CONCURRENCY = 4
+SOURCE_BUTTON_LABELS = {
+    "spotify": "🎧 Spotify",
+    "apple_music": "🍎 Apple Music",
+    "yandex_music": "🎶 Яндекс.Музыка",
+    "soundcloud": "☁️ SoundCloud",
+    "youtube": "▶️ YouTube",
+    "youtube_music": "🎵 YouTube Music",
+}
+RENDERED_OUTPUT_CACHE_SIZE = 4096
+_rendered_output_cache: dict = {}
+memory_governor.register_cache("rendered_output", lambda: _rendered_output_cache)
+outbound_sender = OutboundSender()
+update_scheduler = PriorityUpdateMiddleware(
+    workers=UPDATE_WORKERS,
+    max_queued=UPDATE_QUEUE_LIMIT,
+    shed_after=UPDATE_SHED_AFTER_SECONDS,
+)
+if UPDATE_RECORD_PATH:
+    # Registered first, so updates are recorded on arrival rather than when a worker takes them.
+    dp.update.outer_middleware(UpdateRecorderMiddleware(UPDATE_RECORD_PATH))
+dp.update.outer_middleware(update_scheduler)
+for handler_name, observer in (
+    ("message", dp.message),
+    ("channel_post", dp.channel_post),
+    ("inline_query", dp.inline_query),
+    ("chosen_inline_result", dp.chosen_inline_result),
+):
+    observer.middleware(HandlerTimingMiddleware(handler_name))
+    observer.middleware(TracingMiddleware(handler_name))
+Gauge("send_queue_depth", "Telegram sends waiting in the outbound queue.", lambda: outbound_sender.queue_depth)
+Gauge("update_queue_depth", "Updates waiting for a worker.", lambda: update_scheduler.queue_depth)
 
 
 def build_inline_notice_result(query_text: str, message: str):
@@ -49,28 +146,84 @@ def build_inline_track_result(
     source: str,
     source_url: str,
     sender_display: str | None = None,
+    links: dict | None = None,
 ):
-    caption = build_caption(
-        artist,
-        track,
-        album,
-        release_date,
-        label,
-        source,
-        sender_display=sender_display,
-    )
-    keyboard = generate_keyboard(track, artist, source_url, source)
-    return InlineQueryResultArticle(
-        id=result_id,
-        title=f"{artist} — {track}",
-        description=build_inline_description(album, label, source),
-        thumb_url=image_url,
-        input_message_content=InputTextMessageContent(
-            message_text=caption,
-            parse_mode="Markdown",
-        ),
-        reply_markup=keyboard,
-    )
+    track_info = {
+        "artist": artist,
+        "track": track,
+        "album": album,
+        "release_date": release_date,
+        "label": label,
+        "links": links,
+    }
+    key = ("inline", result_id, image_url, build_render_key(track_info, source_url), source, sender_display)
+    result = _rendered_output_cache.get(key)
+    if result is None:
+        caption, keyboard = render_track_card(track_info, source, source_url, sender_display)
+        result = InlineQueryResultArticle(
+            id=result_id,
+            title=f"{artist} — {track}",
+            description=build_inline_description(album, label, source),
+            thumb_url=image_url,
+            input_message_content=InputTextMessageContent(
+                message_text=caption,
+                parse_mode="Markdown",
+            ),
+            reply_markup=keyboard,
+        )
+        remember_bounded(_rendered_output_cache, key, result, RENDERED_OUTPUT_CACHE_SIZE)
+    return result
+
+
+def build_render_key(track_info: dict, source_url: str) -> int:
+    return hash((
+        track_info["artist"],
+        track_info["track"],
+        track_info["album"],
+        track_info["release_date"],
+        track_info["label"],
+        source_url,
+        tuple(sorted((track_info.get("links") or {}).items())),
+    ))
+
+
+def render_track_card(track_info: dict, source: str, source_url: str, sender_display: str | None):
+    """Caption and keyboard for a track, rendered once per payload and source.
+
+    The cached caption has no sender footer; it is appended per call because it
+    differs for every sender.
+    """
+    key = ("card", build_render_key(track_info, source_url), source)
+    rendered = _rendered_output_cache.get(key)
+    if rendered is None:
+        rendered = (
+            build_caption(
+                track_info["artist"],
+                track_info["track"],
+                track_info["album"],
+                track_info["release_date"],
+                track_info["label"],
+                source,
+            ),
+            generate_keyboard(
+                track_info["track"],
+                track_info["artist"],
+                source_url,
+                source,
+                track_info.get("links"),
+            ),
+        )
+        remember_bounded(_rendered_output_cache, key, rendered, RENDERED_OUTPUT_CACHE_SIZE)
+    caption, keyboard = rendered
+    return append_sender_footer(caption, sender_display), keyboard
+
+
+def build_inline_result_id(item: dict) -> str:
+    # Spotify hits answered without a label are enriched once the user picks one.
+    track_id = extract_track_id(item["source_url"]) if item["source"] == "spotify" else None
+    if track_id and item["label"] == "Spotify":
+        return f"{LAZY_SPOTIFY_RESULT_PREFIX}{track_id}"
+    return f"{item['source']}-{hash((item['artist'], item['track'], item['source_url']))}"
 
 
 def get_sender_display(user: types.User | None) -> str | None:
@@ -127,17 +280,11 @@ def build_inline_search_shortcuts(query_text: str):
     return results
 
 
-def generate_keyboard(track, artist, source_url, source="spotify"):
+def generate_keyboard(track, artist, source_url, source="spotify", links=None):
+    # Services where the recording is already known get a direct link instead of search.
+    links = links or {}
     query_encoded = quote(f"{track} {artist}")
-    source_button_labels = {
-        "spotify": "🎧 Spotify",
-        "apple_music": "🍎 Apple Music",
-        "yandex_music": "🎶 Яндекс.Музыка",
-        "soundcloud": "☁️ SoundCloud",
-        "youtube": "▶️ YouTube",
-        "youtube_music": "🎵 YouTube Music",
-    }
-    source_button_label = source_button_labels.get(source, "🔗 Открыть источник")
+    source_button_label = SOURCE_BUTTON_LABELS.get(source, "🔗 Открыть источник")
     music_buttons = [
         (
             "spotify",
@@ -172,7 +319,7 @@ def generate_keyboard(track, artist, source_url, source="spotify"):
         ),
     ]
     filtered_buttons = [
-        InlineKeyboardButton(text=text, url=url)
+        InlineKeyboardButton(text=text, url=links.get(button_source) or url)
         for button_source, text, url in music_buttons
         if button_source != source
     ]
@@ -185,6 +332,57 @@ def generate_keyboard(track, artist, source_url, source="spotify"):
     )
 
 
+def extract_url_host(url: str) -> str:
+    rest = url.split("://", 1)[-1]
+    for separator in "/?#":
+        rest = rest.split(separator, 1)[0]
+    return rest.rsplit("@", 1)[-1].split(":", 1)[0].lower().removeprefix("www.")
+
+
+def extract_message_urls(message: types.Message) -> list[str]:
+    text = message.text or message.caption or ""
+    entities = message.entities or message.caption_entities or []
+    urls = []
+    for entity in entities:
+        if entity.type == "url":
+            urls.append(entity.extract_from(text))
+        elif entity.type == "text_link" and entity.url:
+            urls.append(entity.url)
+    return urls
+
+
+def extract_music_urls(message: types.Message) -> list[str]:
+    urls = [
+        url
+        for url in extract_message_urls(message)
+        if extract_url_host(url) in MUSIC_LINK_HOSTS
+    ]
+    return list(dict.fromkeys(urls))[:MAX_LINKS_PER_MESSAGE]
+
+
+def is_music_link_candidate(message: types.Message) -> bool:
+    # Runs for every group message, so it only looks at entities and a host set.
+    if any(extract_url_host(url) in MUSIC_LINK_HOSTS for url in extract_message_urls(message)):
+        MESSAGE_FILTER_TOTAL.inc("processed")
+        return True
+    MESSAGE_FILTER_TOTAL.inc("filtered")
+    return False
+
+
+def generate_digest_keyboard(tracks: list[dict]):
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(
+                    text=f"{index}. {SOURCE_BUTTON_LABELS.get(track_info['source'], '🔗 Открыть источник')}",
+                    url=track_info["source_url"],
+                )
+            ]
+            for index, track_info in enumerate(tracks, start=1)
+        ]
+    )
+
+
 def should_auto_delete(chat: types.Chat) -> bool:
     return AUTO_DELETE_DELAY > 0 and chat.type in {"group", "supergroup", "channel"}
 
@@ -193,13 +391,109 @@ def should_send_error_feedback(chat: types.Chat) -> bool:
     return chat.type == "private"
 
 
+async def send_to_chat(chat: types.Chat, call, coalesce_key=None):
+    """Send through the rate-limited outbound queue of ``chat``."""
+    with span("telegram.send"):
+        return await outbound_sender.send(
+            chat.id,
+            call,
+            group=chat.type != "private",
+            coalesce_key=coalesce_key,
+        )
+
+
+def queue_to_chat(chat: types.Chat, call, on_sent=None, coalesce_key=None) -> asyncio.Future:
+    """Queue a send on the outbound queue of ``chat`` and return without waiting.
+
+    Handlers never wait for group spacing or flood waits, so those don't hold
+    update workers. ``on_sent`` is a coroutine function that gets the sent
+    message and runs as a background task once the send went through.
+    """
+    trace_context = capture_span_context()
+
+    async def traced_call():
+        with resume_span(trace_context, "telegram.send", chat_type=chat.type):
+            return await call()
+
+    future = outbound_sender.enqueue(chat.id, traced_call, group=chat.type != "private", coalesce_key=coalesce_key)
+    future.add_done_callback(lambda done: finish_queued_send(chat, done, on_sent))
+    return future
+
+
+def finish_queued_send(chat: types.Chat, future: asyncio.Future, on_sent):
+    if future.cancelled():
+        return
+    if future.exception() is not None:
+        logging.warning("Не удалось отправить сообщение в чат %s: %s", chat.id, future.exception())
+        return
+    if on_sent and future.result():
+        spawn_background_task(on_sent(future.result()))
+
+
+async def delete_chat_messages(chat_id: int, message_ids: list[int]):
+    return await outbound_sender.send(
+        chat_id,
+        lambda: bot.delete_messages(chat_id=chat_id, message_ids=message_ids),
+        group=True,
+    )
+
+
+auto_delete_scheduler = AutoDeleteScheduler(delete_chat_messages)
+
+
 async def auto_delete_messages(delay: int, messages: list[types.Message]):
-    await asyncio.sleep(delay)
+    message_ids_by_chat = {}
     for msg in messages:
-        try:
-            await msg.delete()
-        except Exception as exc:
-            logging.warning("Не удалось удалить сообщение %s: %s", msg.message_id, exc)
+        message_ids_by_chat.setdefault(msg.chat.id, []).append(msg.message_id)
+    for chat_id, message_ids in message_ids_by_chat.items():
+        auto_delete_scheduler.schedule(chat_id, message_ids, delay)
+
+
+def spawn_background_task(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def apply_deferred_refinement(
+    sent_message: types.Message,
+    refinement: asyncio.Future,
+    track_info: dict,
+    sender_display: str | None,
+):
+    refined = await refinement
+    if not refined or refined.get("label") == track_info.get("label"):
+        return
+
+    caption, keyboard = render_track_card(
+        {**refined, "links": track_info.get("links")},
+        refined["source"],
+        track_info.get("source_url", refined["source_url"]),
+        sender_display,
+    )
+    if sent_message.photo:
+        def edit():
+            return bot.edit_message_caption(
+                chat_id=sent_message.chat.id,
+                message_id=sent_message.message_id,
+                caption=caption,
+                parse_mode="Markdown",
+                reply_markup=keyboard,
+            )
+    else:
+        def edit():
+            return bot.edit_message_text(
+                chat_id=sent_message.chat.id,
+                message_id=sent_message.message_id,
+                text=caption,
+                parse_mode="Markdown",
+                reply_markup=keyboard,
+            )
+    try:
+        await send_to_chat(sent_message.chat, edit, coalesce_key=("edit", sent_message.message_id))
+    except Exception as exc:
+        logging.warning("Не удалось обновить сообщение %s: %s", sent_message.message_id, exc)
 
 
 @dp.message(Command("help"))
@@ -216,6 +510,95 @@ async def send_help(message: types.Message):
     await message.answer(text, parse_mode="HTML")
 
 
+def is_admin(user: types.User | None) -> bool:
+    return user is not None and user.id in ADMIN_USER_IDS
+
+
+def format_window(seconds: int) -> str:
+    return f"{seconds // 3600} ч" if seconds % 3600 == 0 else f"{seconds // 60} мин"
+
+
+def build_stats_text() -> str:
+    """Health summary for admins, built only from in-memory counters."""
+    hits = CACHE_LOOKUPS_TOTAL.value("hit")
+    lookups = hits + CACHE_LOOKUPS_TOTAL.value("miss") + CACHE_LOOKUPS_TOTAL.value("expired")
+    hit_rate = f"{hits / lookups:.0%}" if lookups else "—"
+    lines = [
+        "📊 <b>Статистика бота</b>",
+        "",
+        f"🗄 Кеш: попаданий {hit_rate} из {int(lookups)} запросов, записей {table_row_counts['url_cache']}",
+    ]
+
+    for window in SOURCE_STATS_WINDOWS:
+        lines.append(f"\n⏱ Источники за {format_window(window)}:")
+        summary = source_health.summary(window)
+        if not summary:
+            lines.append("нет запросов")
+        for source, stats in summary.items():
+            lines.append(
+                f"{source}: p50 {stats['p50'] * 1000:.0f} мс, p95 {stats['p95'] * 1000:.0f} мс, "
+                f"ошибок {stats['error_rate']:.0%} ({stats['count']})"
+            )
+
+    scheduler_stats = update_scheduler.stats()
+    sender_stats = outbound_sender.stats()
+    rss = get_rss_bytes()
+    memory_limit = get_memory_limit_bytes()
+    lines.extend(
+        [
+            "",
+            f"⚙️ Апдейты: в работе {scheduler_stats['in_progress']}, в очереди {update_scheduler.queue_depth}",
+            f"📤 Отправка: в очереди {sender_stats['queued']}, в полёте {sender_stats['in_flight']}",
+            f"🧵 Фоновые задачи: {len(_background_tasks) + count_background_tasks()}, всего задач {len(asyncio.all_tasks())}",
+            f"🗑 Ждут автоудаления: {table_row_counts['pending_deletions']}",
+            f"🧠 Память: {rss / 1048576:.0f} МБ из {memory_limit / 1048576:.0f} МБ ({rss / memory_limit:.0%})",
+            f"🛡 Тяжёлые загрузки: в работе {memory_governor.in_flight}, "
+            f"отложено {int(MEMORY_GOVERNOR_DECISIONS_TOTAL.value('delayed'))}, "
+            f"отклонено {int(MEMORY_GOVERNOR_DECISIONS_TOTAL.value('rejected'))}",
+        ]
+    )
+    return "\n".join(lines)
+
+
+@dp.message(Command("stats"))
+async def send_stats(message: types.Message):
+    # Ignored for everyone else, so the command does not reveal itself.
+    if not is_admin(message.from_user):
+        return
+    await message.answer(build_stats_text(), parse_mode="HTML")
+
+
+async def report_profile(message: types.Message, kind: str, seconds: float):
+    try:
+        path, summary = await run_profile(kind, seconds)
+    except ProfileBusyError:
+        await message.answer("⏳ Профилирование уже идёт, дождись результата.")
+        return
+    except OSError as exc:
+        logging.warning("Не удалось записать профиль: %s", exc)
+        await message.answer("❌ Не удалось записать профиль.")
+        return
+    body = html.escape("\n".join(summary))[:3500]
+    await message.answer(f"🔬 Профиль записан в <code>{html.escape(path)}</code>\n<pre>{body}</pre>", parse_mode="HTML")
+
+
+@dp.message(Command("profile"))
+async def start_profile(message: types.Message, command: CommandObject):
+    if not is_admin(message.from_user):
+        return
+    args = (command.args or "").split()
+    kind = args[0] if args else "sample"
+    try:
+        seconds = float(args[1]) if len(args) > 1 else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        seconds = 0
+    if kind not in PROFILE_KINDS or seconds <= 0:
+        await message.answer(f"Использование: /profile [{'|'.join(PROFILE_KINDS)}] [секунды]")
+        return
+    await message.answer(f"🔬 Профилирую {kind} {seconds:g} с…")
+    spawn_background_task(report_profile(message, kind, seconds))
+
+
 @dp.inline_query()
 async def inline_handler(query: InlineQuery):
     text = query.query.strip()
@@ -223,18 +606,13 @@ async def inline_handler(query: InlineQuery):
         return
 
     results = []
+    next_offset = ""
     sender_display = get_sender_display(query.from_user)
     initial_classification = classify_music_url(text)
     if initial_classification.get("service") or "spotify.link/" in text:
-        if initial_classification.get("service") == "spotify_shortlink":
-            text = await resolve_spotify_link(text)
-            if not text:
-                return
-        elif initial_classification.get("service") == "soundcloud_shortlink":
-            text = await resolve_redirect_url(text, SOUNDCLOUD_REDIRECT_HOSTS)
-            if not text:
-                return
-        classification = classify_music_url(text)
+        text, classification = await expand_short_link(text)
+        if not text:
+            return
 
         if not classification.get("supported"):
             message = build_unsupported_url_message(classification)
@@ -268,13 +646,15 @@ async def inline_handler(query: InlineQuery):
                 source=source,
                 source_url=source_url,
                 sender_display=sender_display,
+                links=track_info.get("links"),
             )
         )
     else:
-        items = await search_multisource_tracks(text)
+        with span("search"):
+            items, next_offset = await search_tracks_page(text, query.offset)
         if not items:
             await query.answer(
-                build_inline_search_shortcuts(text),
+                [] if query.offset else build_inline_search_shortcuts(text),
                 cache_time=1,
                 is_personal=True,
             )
@@ -283,7 +663,7 @@ async def inline_handler(query: InlineQuery):
         for item in items:
             results.append(
                 build_inline_track_result(
-                    result_id=f"{item['source']}-{hash((item['artist'], item['track'], item['source_url']))}",
+                    result_id=build_inline_result_id(item),
                     artist=item["artist"],
                     track=item["track"],
                     album=item["album"],
@@ -293,111 +673,255 @@ async def inline_handler(query: InlineQuery):
                     source=item["source"],
                     source_url=item["source_url"],
                     sender_display=sender_display,
+                    links=item.get("links"),
                 )
             )
 
-        if len(items) < 6:
+        if not query.offset and len(items) < SEARCH_PAGE_SIZE:
             results.extend(build_inline_search_shortcuts(text))
 
-    await query.answer(results, cache_time=1, is_personal=True)
+    with span("telegram.answer_inline"):
+        await query.answer(results, cache_time=1, is_personal=True, next_offset=next_offset)
 
 
-async def process_music_message(message: types.Message):
-    if not message.text:
+@dp.chosen_inline_result(F.result_id.startswith(LAZY_SPOTIFY_RESULT_PREFIX))
+async def enrich_chosen_inline_result(chosen: types.ChosenInlineResult):
+    if not chosen.inline_message_id:
         return
 
-    url = message.text.strip()
-    classification = classify_music_url(url)
-    if classification.get("service") == "spotify_shortlink":
-        url = await resolve_spotify_link(url)
-        if not url:
-            if should_send_error_feedback(message.chat):
-                await message.reply("Не удалось раскрыть короткую ссылку 😕")
-            return
-        classification = classify_music_url(url)
-    elif classification.get("service") == "soundcloud_shortlink":
-        url = await resolve_redirect_url(url, SOUNDCLOUD_REDIRECT_HOSTS)
-        if not url:
-            if should_send_error_feedback(message.chat):
-                await message.reply("Не удалось раскрыть короткую ссылку SoundCloud 😕")
-            return
-        classification = classify_music_url(url)
-
-    if classification.get("service"):
-        if not classification.get("supported"):
-            unsupported_message = build_unsupported_url_message(classification)
-            if unsupported_message and should_send_error_feedback(message.chat):
-                await message.reply(unsupported_message)
-            return
-
-        track_info = await parse_music_url(url)
-        if not track_info:
-            if should_send_error_feedback(message.chat):
-                await message.reply("Не удалось получить информацию о треке 😢")
-            return
+    track_id = chosen.result_id.removeprefix(LAZY_SPOTIFY_RESULT_PREFIX)
+    track_info = await parse_music_url(f"https://open.spotify.com/track/{track_id}")
+    if not track_info or not should_show_label("spotify", track_info["label"]):
+        return
 
-        artist = track_info["artist"]
-        track = track_info["track"]
-        album = track_info["album"]
-        image_url = track_info["image"]
-        label = track_info["label"]
-        release_date = track_info["release_date"]
-        source = track_info.get("source", "spotify")
-        source_url = track_info.get("source_url", url)
-
-        caption = build_caption(
-            artist,
-            track,
-            album,
-            release_date,
-            label,
-            source,
-            sender_display=get_sender_display(message.from_user),
+    caption, keyboard = render_track_card(
+        track_info,
+        "spotify",
+        track_info["source_url"],
+        get_sender_display(chosen.from_user),
+    )
+    try:
+        await bot.edit_message_text(
+            inline_message_id=chosen.inline_message_id,
+            text=caption,
+            parse_mode="Markdown",
+            reply_markup=keyboard,
         )
-        keyboard = generate_keyboard(track, artist, source_url, source)
-
-        if image_url:
-            sent_message = await bot.send_photo(
+    except Exception as exc:
+        logging.warning("Не удалось дополнить inline-сообщение %s: %s", chosen.result_id, exc)
+
+
+async def resolve_message_link(url: str) -> tuple[str | None, str | None]:
+    """Expand a short link and check support; returns (track URL, error message)."""
+    url, classification = await expand_short_link(url)
+    if not url:
+        return None, "Не удалось раскрыть короткую ссылку 😕"
+
+    if not classification.get("service"):
+        return None, None
+    if not classification.get("supported"):
+        return None, build_unsupported_url_message(classification)
+    return url, None
+
+
+def send_track_card(message: types.Message, url: str, track_info: dict, sender_display: str | None, on_sent=None):
+    source = track_info.get("source", "spotify")
+    source_url = track_info.get("source_url", url)
+    caption, keyboard = render_track_card(track_info, source, source_url, sender_display)
+    # Taken before sending: the task leaves the registry as soon as it finishes.
+    refinement = get_pending_yandex_refinement(url) if source == "yandex_music" else None
+
+    async def follow_up(sent_message: types.Message):
+        if on_sent:
+            await on_sent(sent_message)
+        if refinement:
+            await apply_deferred_refinement(sent_message, refinement, track_info, sender_display)
+
+    if track_info["image"]:
+        return queue_to_chat(
+            message.chat,
+            lambda: bot.send_photo(
                 chat_id=message.chat.id,
-                photo=image_url,
+                photo=track_info["image"],
                 caption=caption,
                 parse_mode="Markdown",
                 reply_markup=keyboard,
-            )
-        else:
-            sent_message = await bot.send_message(
-                chat_id=message.chat.id,
-                text=caption,
-                parse_mode="Markdown",
-                reply_markup=keyboard,
-            )
+            ),
+            on_sent=follow_up,
+        )
+    return queue_to_chat(
+        message.chat,
+        lambda: bot.send_message(
+            chat_id=message.chat.id,
+            text=caption,
+            parse_mode="Markdown",
+            reply_markup=keyboard,
+        ),
+        on_sent=follow_up,
+    )
+
+
+def send_track_digest(message: types.Message, tracks: list[dict], sender_display: str | None, on_sent=None):
+    captions = [
+        render_track_card(
+            track_info,
+            track_info.get("source", "spotify"),
+            track_info["source_url"],
+            None,
+        )[0]
+        for track_info in tracks
+    ]
+    text = build_digest_caption(captions, sender_display)
+    keyboard = generate_digest_keyboard(tracks)
+    return queue_to_chat(
+        message.chat,
+        lambda: bot.send_message(
+            chat_id=message.chat.id,
+            text=text,
+            parse_mode="Markdown",
+            reply_markup=keyboard,
+        ),
+        on_sent=on_sent,
+    )
+
+
+async def process_music_message(message: types.Message):
+    """Resolve the links of ``message`` and queue the reply; the send itself runs after return."""
+    urls = extract_music_urls(message)
+    if not urls:
+        return
 
-        if should_auto_delete(message.chat) and sent_message:
-            asyncio.create_task(auto_delete_messages(AUTO_DELETE_DELAY, [message]))
+    semaphore = asyncio.Semaphore(LINK_RESOLVE_CONCURRENCY)
+
+    async def resolve_link(url: str):
+        async with semaphore:
+            return await resolve_message_link(url)
+
+    with span("resolve_links", links=len(urls)):
+        resolved_links = await asyncio.gather(*(resolve_link(url) for url in urls))
+    errors = [error for _, error in resolved_links if error]
+    track_urls = {}
+    for url, _ in resolved_links:
+        if url:
+            track_urls.setdefault(get_canonical_track_key(url), url)
+
+    with span("fetch_tracks", tracks=len(track_urls)):
+        # One cache round trip for all links and one batch call per service that has one.
+        fetched = await parse_music_urls(list(track_urls.values()))
+    tracks = [(url, track_info) for url, track_info in fetched.items() if track_info]
+    if not tracks:
+        if track_urls and not errors:
+            errors.append("Не удалось получить информацию о треке 😢")
+        if errors and should_send_error_feedback(message.chat):
+            queue_to_chat(message.chat, lambda: message.reply(errors[0]))
+        return
+
+    async def schedule_source_deletion(_sent_message: types.Message):
+        await auto_delete_messages(AUTO_DELETE_DELAY, [message])
 
+    on_sent = schedule_source_deletion if should_auto_delete(message.chat) else None
+    sender_display = get_sender_display(message.from_user)
+    with span("telegram.enqueue"):
+        if len(tracks) == 1:
+            url, track_info = tracks[0]
+            send_track_card(message, url, track_info, sender_display, on_sent)
+        else:
+            send_track_digest(message, [track_info for _, track_info in tracks], sender_display, on_sent)
 
-@dp.message()
+
+@dp.message(is_music_link_candidate)
 async def handle_music_link(message: types.Message):
     await process_music_message(message)
 
 
-@dp.channel_post()
+@dp.channel_post(is_music_link_candidate)
 async def handle_channel_music_post(message: types.Message):
     await process_music_message(message)
 
 
 async def on_startup():
+    spawn_background_task(auto_delete_scheduler.run())
+    spawn_background_task(run_track_hit_flusher())
+    spawn_background_task(memory_governor.run())
+    install_profile_signal_handlers(spawn_background_task)
+    if LOOP_MONITOR_ENABLED:
+        spawn_background_task(LoopLagMonitor(threshold=LOOP_LAG_THRESHOLD_SECONDS).run())
     logging.info("✅ Бот запущен и готов к работе (включая inline-режим)")
 
 
+async def on_shutdown():
+    for task in list(_background_tasks):
+        task.cancel()
+
+
 dp.startup.register(on_startup)
+dp.shutdown.register(on_shutdown)
+
+
+async def set_telegram_webhook(app: web.Application):
+    await bot.set_webhook(
+        f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+
+
+async def drain_updates(app: web.Application):
+    await update_scheduler.drain()
+    await outbound_sender.drain()
+
+
+def build_webhook_app() -> web.Application:
+    """aiohttp app that feeds Telegram webhook calls into ``dp``.
+
+    Requests without the ``WEBHOOK_SECRET`` header are rejected with 401.
+    Queued updates are drained on shutdown before the bot session is closed.
+    """
+    app = web.Application()
+    app.on_startup.append(set_telegram_webhook)
+    app.on_shutdown.append(drain_updates)
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        # update_scheduler already queues updates; answering after it keeps backpressure.
+        handle_in_background=False,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook():
+    runner = web.AppRunner(build_webhook_app())
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logging.info("🌐 Webhook слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
 
 
 async def main():
+    metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT) if METRICS_PORT else None
     try:
-        await dp.start_polling(bot)
+        if WEBHOOK_URL:
+            await run_webhook()
+        else:
+            # Updates are queued by update_scheduler, so polling itself stays sequential.
+            await dp.start_polling(bot, handle_as_tasks=False)
     except Exception as exc:
         logging.error("❌ Бот упал: %s", exc)
     finally:
+        await update_scheduler.drain()
+        await outbound_sender.drain()
+        if metrics_runner:
+            await metrics_runner.cleanup()
         await bot.session.close()
         logging.info("🧩 Бот завершил работу корректно.")
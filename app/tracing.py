@@ -0,0 +1,188 @@
+import functools
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from app.config import TRACE_FILE_PATH, TRACE_SAMPLE_RATE
+
+TRACE_WINDOW_SIZE = 500
+TRACE_MIN_SAMPLES = 20
+SLOW_TRACE_PERCENTILE = 0.95
+
+_active_trace: ContextVar["Trace | None"] = ContextVar("active_trace", default=None)
+_active_span: ContextVar["Span | None"] = ContextVar("active_span", default=None)
+_trace_durations: dict[str, deque] = {}
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, name: str, parent_id: str | None, attributes: dict):
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = self.start_ns
+        self.error = None
+
+    def to_otlp(self, trace_id: str) -> dict:
+        return {
+            "traceId": trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [
+                {"key": key, "value": {"stringValue": str(value)}}
+                for key, value in self.attributes.items()
+            ],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+
+
+class Trace:
+    __slots__ = ("trace_id", "spans", "kept")
+
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans: list[Span] = []
+        # None while the root span runs, then whether the trace was sampled.
+        self.kept: bool | None = None
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a stage of the current trace; a no-op outside of ``start_trace``."""
+    trace = _active_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    parent = _active_span.get()
+    record = Span(name, parent.span_id if parent else None, attributes)
+    token = _active_span.set(record)
+    try:
+        yield record
+    except BaseException as exc:
+        record.error = type(exc).__name__
+        raise
+    finally:
+        record.end_ns = time.time_ns()
+        _active_span.reset(token)
+        trace.spans.append(record)
+
+
+def capture_span_context() -> tuple | None:
+    """The current trace and span, for work that is queued now and runs in another task."""
+    trace = _active_trace.get()
+    return None if trace is None else (trace, _active_span.get())
+
+
+@contextmanager
+def resume_span(context: tuple | None, name: str, **attributes):
+    """Span for queued work under the trace that queued it, e.g. a Telegram send.
+
+    While that trace still runs the span joins it. Once it was exported, the
+    span is written as its own record with the same trace id; traces that were
+    not sampled drop it.
+    """
+    if context is None or context[0].kept is False:
+        yield None
+        return
+
+    trace, parent = context
+    record = Span(name, parent.span_id if parent else None, attributes)
+    try:
+        yield record
+    except BaseException as exc:
+        record.error = type(exc).__name__
+        raise
+    finally:
+        record.end_ns = time.time_ns()
+        if trace.kept is None:
+            trace.spans.append(record)
+        else:
+            export_trace(trace.trace_id, [record])
+
+
+def traced(name: str):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class TracingMiddleware:
+    """Inner middleware that opens a trace around every matched handler."""
+
+    def __init__(self, handler_name: str):
+        self.handler_name = handler_name
+
+    async def __call__(self, handler, event, data):
+        with start_trace(self.handler_name):
+            return await handler(event, data)
+
+
+@contextmanager
+def start_trace(name: str, **attributes):
+    """Root span of one update. Finished traces are sampled into ``TRACE_FILE_PATH``."""
+    if not TRACE_FILE_PATH:
+        yield None
+        return
+
+    trace = Trace()
+    token = _active_trace.set(trace)
+    try:
+        with span(name, **attributes) as root:
+            yield root
+    finally:
+        _active_trace.reset(token)
+        duration = (root.end_ns - root.start_ns) / 1e9
+        trace.kept = should_keep_trace(name, duration)
+        if trace.kept:
+            export_trace(trace.trace_id, trace.spans)
+
+
+def should_keep_trace(name: str, duration: float) -> bool:
+    """Keep every trace slower than the recent p95, plus a random sample of the rest."""
+    window = _trace_durations.setdefault(name, deque(maxlen=TRACE_WINDOW_SIZE))
+    if len(window) < TRACE_MIN_SAMPLES:
+        keep = True
+    else:
+        ordered = sorted(window)
+        keep = duration >= ordered[int(len(ordered) * SLOW_TRACE_PERCENTILE)]
+    window.append(duration)
+    return keep or random.random() < TRACE_SAMPLE_RATE
+
+
+def export_trace(trace_id: str, spans: list[Span]):
+    record = {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [{"key": "service.name", "value": {"stringValue": "spotify_bot"}}]
+                },
+                "scopeSpans": [
+                    {
+                        "scope": {"name": "app.tracing"},
+                        "spans": [item.to_otlp(trace_id) for item in spans],
+                    }
+                ],
+            }
+        ]
+    }
+    try:
+        with open(TRACE_FILE_PATH, "a", encoding="utf-8") as trace_file:
+            trace_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as exc:
+        logging.warning("Не удалось записать трейс в %s: %s", TRACE_FILE_PATH, exc)
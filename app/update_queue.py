@@ -0,0 +1,123 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+LANE_INLINE = 0
+LANE_PRIVATE = 1
+LANE_GROUP = 2
+LANE_CHANNEL = 3
+LANE_NAMES = ("inline", "private", "group", "channel")
+
+
+def get_update_lane(update: Update) -> int:
+    if update.inline_query or update.chosen_inline_result:
+        return LANE_INLINE
+    if update.channel_post or update.edited_channel_post:
+        return LANE_CHANNEL
+    message = update.message or update.edited_message
+    if message and message.chat.type != "private":
+        return LANE_GROUP
+    return LANE_PRIVATE
+
+
+class PriorityUpdateMiddleware(BaseMiddleware):
+    """Outer update middleware that hands updates to a bounded worker pool.
+
+    Updates wait in one queue per lane and workers always take the highest
+    priority lane first. When ``max_queued`` updates are waiting, the call
+    blocks, which stalls polling instead of growing memory. Channel posts that
+    waited longer than ``shed_after`` seconds are dropped.
+    """
+
+    def __init__(self, workers: int = 8, max_queued: int = 200, shed_after: float = 30.0):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.shed_after = shed_after
+        self._lanes: list[deque] = [deque() for _ in LANE_NAMES]
+        self._condition: asyncio.Condition | None = None
+        self._worker_tasks: list[asyncio.Task] = []
+        self.in_progress = 0
+        self.processed = 0
+        self.shed = 0
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(lane) for lane in self._lanes)
+
+    def stats(self) -> dict:
+        return {
+            "queued": {name: len(lane) for name, lane in zip(LANE_NAMES, self._lanes)},
+            "in_progress": self.in_progress,
+            "processed": self.processed,
+            "shed": self.shed,
+        }
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: dict[str, Any],
+    ) -> Any:
+        self._ensure_workers()
+        loop = asyncio.get_running_loop()
+        async with self._condition:
+            self._shed_stale(loop.time())
+            await self._condition.wait_for(lambda: self.queue_depth < self.max_queued)
+            self._lanes[get_update_lane(event)].append((loop.time(), handler, event, data))
+            self._condition.notify_all()
+
+    def _ensure_workers(self):
+        if self._worker_tasks and not all(task.done() for task in self._worker_tasks):
+            return
+        self._condition = asyncio.Condition()
+        self._worker_tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    def _shed_stale(self, now: float):
+        lane = self._lanes[LANE_CHANNEL]
+        while lane and now - lane[0][0] > self.shed_after:
+            _, _, event, _ = lane.popleft()
+            self.shed += 1
+            logging.warning("Пропущен устаревший update %s из очереди каналов", event.update_id)
+
+    def _pop_next(self):
+        for lane in self._lanes:
+            if lane:
+                return lane.popleft()
+        return None
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self._condition:
+                await self._condition.wait_for(lambda: self.queue_depth > 0)
+                self._shed_stale(loop.time())
+                item = self._pop_next()
+                self._condition.notify_all()
+            if item is None:
+                continue
+
+            _, handler, event, data = item
+            self.in_progress += 1
+            try:
+                await handler(event, data)
+            except Exception:
+                logging.exception("Ошибка при обработке update %s", event.update_id)
+            finally:
+                self.in_progress -= 1
+                self.processed += 1
+
+    async def drain(self):
+        """Wait until every queued update is handled, then stop the workers."""
+        if self._condition is not None:
+            async with self._condition:
+                await self._condition.wait_for(lambda: self.queue_depth == 0)
+        while self.in_progress:
+            await asyncio.sleep(0.05)
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        self._worker_tasks = []
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+from aiogram.types import ChosenInlineResult, InlineQuery, Message, Update
+
+
+def pseudonymize_id(value: int, salt: bytes) -> int:
+    """Stable within one recording, unlinkable to the real id without the salt."""
+    digest = hashlib.blake2b(str(abs(value)).encode(), key=salt, digest_size=6).digest()
+    pseudonym = int.from_bytes(digest, "big")
+    return -pseudonym if value < 0 else pseudonym
+
+
+def sanitize_person(person, salt: bytes) -> dict:
+    """User or chat reduced to a pseudonymous id, its type and placeholder names."""
+    clean = {"id": pseudonymize_id(person.id, salt)}
+    if getattr(person, "type", None):
+        clean["type"] = person.type
+    if getattr(person, "is_bot", None) is not None:
+        clean["is_bot"] = person.is_bot
+    if getattr(person, "first_name", None):
+        clean["first_name"] = "User"
+    if getattr(person, "title", None):
+        clean["title"] = "Chat"
+    if getattr(person, "username", None):
+        clean["username"] = f"user_{abs(clean['id']) % 1_000_000}"
+    return clean
+
+
+def utf16_length(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def sanitize_message(message: Message, salt: bytes) -> dict:
+    """Only the links survive; the rest of the text is dropped."""
+    source_text = message.text or message.caption or ""
+    links = []
+    for entity in message.entities or message.caption_entities or []:
+        if entity.type == "url":
+            links.append(entity.extract_from(source_text))
+        elif entity.type == "text_link" and entity.url:
+            links.append(entity.url)
+
+    entities = []
+    offset = 0
+    for link in links:
+        length = utf16_length(link)
+        entities.append({"type": "url", "offset": offset, "length": length})
+        offset += length + 1
+
+    clean = {
+        "message_id": message.message_id,
+        "date": int(message.date.timestamp()),
+        "chat": sanitize_person(message.chat, salt),
+        "text": "\n".join(links) or "…",
+    }
+    if entities:
+        clean["entities"] = entities
+    if message.from_user:
+        clean["from"] = sanitize_person(message.from_user, salt)
+    if message.sender_chat:
+        clean["sender_chat"] = sanitize_person(message.sender_chat, salt)
+    return clean
+
+
+def sanitize_inline_query(query: InlineQuery, salt: bytes) -> dict:
+    clean = {
+        "id": query.id,
+        "from": sanitize_person(query.from_user, salt),
+        "query": query.query,
+        "offset": query.offset,
+    }
+    if query.chat_type:
+        clean["chat_type"] = query.chat_type
+    return clean
+
+
+def sanitize_chosen_inline_result(chosen: ChosenInlineResult, salt: bytes) -> dict:
+    clean = {
+        "result_id": chosen.result_id,
+        "from": sanitize_person(chosen.from_user, salt),
+        "query": chosen.query,
+    }
+    if chosen.inline_message_id:
+        clean["inline_message_id"] = chosen.inline_message_id
+    return clean
+
+
+def sanitize_update(update: Update, salt: bytes) -> dict | None:
+    """Replayable copy of an update without names or message text.
+
+    Returns None for update types the bot does not handle.
+    """
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        message = getattr(update, key)
+        if message is not None:
+            return {"update_id": update.update_id, key: sanitize_message(message, salt)}
+    if update.inline_query:
+        return {"update_id": update.update_id, "inline_query": sanitize_inline_query(update.inline_query, salt)}
+    if update.chosen_inline_result:
+        return {
+            "update_id": update.update_id,
+            "chosen_inline_result": sanitize_chosen_inline_result(update.chosen_inline_result, salt),
+        }
+    return None
+
+
+class UpdateRecorderMiddleware:
+    """Outer update middleware that appends sanitized updates to a JSON-lines file.
+
+    Each line is ``{"offset": seconds since the first update, "update": {...}}``,
+    the format ``tests/load/replay_updates.py`` replays. User and chat ids are
+    replaced by salted hashes; the salt is per process and never written out.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.salt = os.urandom(16)
+        self.started_at: float | None = None
+        self.recorded = 0
+
+    async def __call__(self, handler, event: Update, data):
+        self.record(event)
+        return await handler(event, data)
+
+    def record(self, update: Update):
+        now = time.monotonic()
+        if self.started_at is None:
+            self.started_at = now
+        sanitized = sanitize_update(update, self.salt)
+        if sanitized is None:
+            return
+        line = {"offset": round(now - self.started_at, 3), "update": sanitized}
+        try:
+            with open(self.path, "a", encoding="utf-8") as record_file:
+                record_file.write(json.dumps(line, ensure_ascii=False) + "\n")
+        except OSError as exc:
+            logging.warning("Не удалось записать апдейт в %s: %s", self.path, exc)
+            return
+        self.recorded += 1
@@ -0,0 +1,185 @@
+"""Offline CPU benchmarks for the parsers and renderers over recorded fixtures.
+
+Usage:
+    python tests/benchmarks/run_parsers.py --output bench.json
+    python tests/benchmarks/run_parsers.py --compare bench.json
+
+Results are JSON: one entry per case with the best and median time per call in
+microseconds, plus the git commit so runs can be compared between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+ROOT = Path(__file__).resolve().parents[2]
+FIXTURES = Path(__file__).resolve().parent / "fixtures"
+
+# Importing the bot needs credentials and a writable cache; neither is used here.
+os.environ.setdefault("TELEGRAM_TOKEN", "123456789:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi")
+os.environ.setdefault("SPOTIFY_CLIENT_ID", "benchmark")
+os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "benchmark")
+os.environ.setdefault("CACHE_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench.sqlite3"))
+sys.path.insert(0, str(ROOT))
+
+from bs4 import BeautifulSoup  # noqa: E402
+
+from app import sources, telegram_app  # noqa: E402
+from app.formatting import build_caption  # noqa: E402
+
+
+def load_text(name: str) -> str:
+    return (FIXTURES / name).read_text(encoding="utf-8")
+
+
+def load_json(name: str):
+    return json.loads(load_text(name))
+
+
+def to_namespace(value):
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: to_namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [to_namespace(item) for item in value]
+    return value
+
+
+def build_cases() -> dict:
+    apple_ld_json = load_text("apple_music_ld_json.html")
+    apple_meta_only = load_text("apple_music_meta_only.html")
+    apple_soup = BeautifulSoup(apple_ld_json, "html.parser")
+    soundcloud_html = load_text("soundcloud_track.html")
+    oembed = load_json("youtube_oembed.json")
+    spotify_track = load_json("spotify_track.json")
+    spotify_search = load_json("spotify_search.json")["tracks"]["items"]
+    yandex_candidates = to_namespace(load_json("yandex_tracks.json"))
+    payload = sources.build_spotify_track_payload(spotify_track, "Anjunadeep")
+    apple_url = "https://music.apple.com/us/song/follow-me/1481264325"
+
+    return {
+        "parse_apple_music_ld_json": lambda: sources.parse_apple_music_ld_json(apple_soup),
+        "parse_apple_music_html_ld_json": lambda: sources.parse_apple_music_html(apple_ld_json, apple_url),
+        "parse_apple_music_html_meta_only": lambda: sources.parse_apple_music_html(apple_meta_only, apple_url),
+        "parse_soundcloud_html": lambda: sources.parse_soundcloud_html(
+            soundcloud_html, "https://soundcloud.com/radikon/premiere"
+        ),
+        "clean_youtube_music_track": lambda: sources.clean_youtube_music_track(oembed["title"]),
+        "build_youtube_payload": lambda: sources.build_youtube_payload(
+            oembed, "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+        ),
+        "build_spotify_track_payload": lambda: sources.build_spotify_track_payload(spotify_track, "Anjunadeep"),
+        "build_spotify_search_payloads": lambda: [
+            sources.build_spotify_track_payload(item, "Spotify") for item in spotify_search
+        ],
+        "score_yandex_candidate": lambda: [
+            sources.score_yandex_candidate(candidate, "Follow Me", "Nox Vahn, Marsh", "Prospect EP")
+            for candidate in yandex_candidates
+        ],
+        "build_caption": lambda: build_caption(
+            payload["artist"],
+            payload["track"],
+            payload["album"],
+            payload["release_date"],
+            payload["label"],
+            "spotify",
+            sender_display="@listener_1",
+        ),
+        "generate_keyboard": lambda: telegram_app.generate_keyboard(
+            payload["track"], payload["artist"], payload["source_url"], "spotify"
+        ),
+    }
+
+
+def time_case(func, min_time: float, repeat: int) -> dict:
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time or loops >= 1_000_000:
+            break
+        loops *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        samples.append((time.perf_counter() - started) / loops * 1e6)
+    return {
+        "loops": loops,
+        "best_us": round(min(samples), 3),
+        "median_us": round(statistics.median(samples), 3),
+    }
+
+
+def get_git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(min_time: float = 0.2, repeat: int = 5, only: list[str] | None = None) -> dict:
+    cases = build_cases()
+    return {
+        "commit": get_git_commit(),
+        "python": platform.python_version(),
+        "timestamp": int(time.time()),
+        "results": {
+            name: time_case(func, min_time, repeat)
+            for name, func in cases.items()
+            if not only or name in only
+        },
+    }
+
+
+def compare(current: dict, baseline: dict) -> list[str]:
+    lines = []
+    for name, result in current["results"].items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            lines.append(f"{name:40} {result['best_us']:>12.2f} us  (new)")
+            continue
+        ratio = result["best_us"] / previous["best_us"] if previous["best_us"] else float("inf")
+        lines.append(f"{name:40} {result['best_us']:>12.2f} us  x{ratio:.2f} vs {baseline.get('commit')}")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    parser.add_argument("--compare", help="baseline JSON file to compare against")
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per timing sample")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("cases", nargs="*", help="run only these cases")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.min_time, args.repeat, args.cases)
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        print("\n".join(compare(results, baseline)), file=sys.stderr)
+
+    rendered = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(rendered + "\n", encoding="utf-8")
+    else:
+        print(rendered)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""Stand-in for the Telegram Bot API for replay and throughput tests.
+
+Point the bot at it with ``TELEGRAM_API_URL``. Updates published with
+``publish`` become visible to ``getUpdates`` at their ``available_at`` time.
+Send methods answer with a minimal ``Message`` and are recorded with the
+time they arrived. A share of the sends can be answered with a 429.
+"""
+import asyncio
+import itertools
+import json
+import random
+import threading
+import time
+
+from aiohttp import web
+
+GET_UPDATES_LIMIT = 100
+BOT_USER = {"id": 123456789, "is_bot": True, "first_name": "Load Bot", "username": "load_test_bot"}
+MESSAGE_METHODS = frozenset(
+    {"sendMessage", "sendPhoto", "sendAudio", "sendDocument", "editMessageText", "editMessageCaption"}
+)
+
+
+def get_call_target(params: dict, chat_id: int | None) -> tuple | None:
+    if chat_id is not None:
+        return "chat", chat_id
+    for kind in ("inline_query", "inline_message"):
+        if params.get(f"{kind}_id"):
+            return kind, params[f"{kind}_id"]
+    return None
+
+
+class FakeBotApi:
+    """aiohttp app serving ``getUpdates`` from a published stream and recording every call.
+
+    ``calls`` holds ``(method, received_at, target)``, where the target is
+    ``("chat", id)``, ``("inline_query", id)``, ``("inline_message", id)`` or None;
+    ``served_at`` maps update ids to when ``getUpdates`` handed them out. Times
+    are ``time.perf_counter()`` values.
+    """
+
+    def __init__(self, send_latency: float = 0.0, throttle_rate: float = 0.0, retry_after: int = 1, seed: int | None = None):
+        self.send_latency = send_latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls: list[tuple[str, float, tuple | None]] = []
+        self.served_at: dict[int, float] = {}
+        self._pending: list[tuple[float, dict]] = []
+        self._lock = threading.Lock()
+        self._message_ids = itertools.count(1)
+
+    def publish(self, update: dict, available_at: float | None = None):
+        with self._lock:
+            self._pending.append((time.perf_counter() if available_at is None else available_at, update))
+            self._pending.sort(key=lambda item: item[0])
+
+    @property
+    def unserved(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.dispatch)
+        return app
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0) -> tuple[str, threading.Event]:
+        """Serve from a separate thread and event loop; set the returned event to stop."""
+        started = threading.Event()
+        stop = threading.Event()
+        result = {}
+
+        async def run():
+            runner = web.AppRunner(self.build_app())
+            await runner.setup()
+            site = web.TCPSite(runner, host, port)
+            await site.start()
+            result["base_url"] = f"http://{host}:{site._server.sockets[0].getsockname()[1]}"
+            started.set()
+            while not stop.is_set():
+                await asyncio.sleep(0.05)
+            await runner.cleanup()
+
+        threading.Thread(target=asyncio.run, args=(run(),), name="fake-bot-api", daemon=True).start()
+        started.wait()
+        return result["base_url"], stop
+
+    async def dispatch(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        if method == "getUpdates":
+            return self.ok(await self.get_updates(params))
+        if method == "getMe":
+            return self.ok(BOT_USER)
+
+        received_at = time.perf_counter()
+        chat_id = int(params["chat_id"]) if params.get("chat_id") else None
+        self.calls.append((method, received_at, get_call_target(params, chat_id)))
+        if self.send_latency:
+            await asyncio.sleep(self.send_latency)
+        if method in MESSAGE_METHODS and self.random.random() < self.throttle_rate:
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+            )
+        if method in MESSAGE_METHODS and chat_id is not None:
+            return self.ok(
+                {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+                }
+            )
+        return self.ok(True)
+
+    async def get_updates(self, params: dict) -> list[dict]:
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        deadline = time.perf_counter() + timeout
+        while True:
+            now = time.perf_counter()
+            with self._lock:
+                self._pending = [item for item in self._pending if item[1]["update_id"] >= offset]
+                ready = [update for available_at, update in self._pending if available_at <= now][:GET_UPDATES_LIMIT]
+                if ready:
+                    served = {update["update_id"] for update in ready}
+                    self._pending = [item for item in self._pending if item[1]["update_id"] not in served]
+            if ready or now >= deadline:
+                for update in ready:
+                    self.served_at[update["update_id"]] = now
+                return ready
+            await asyncio.sleep(0.005)
+
+    @staticmethod
+    def ok(result) -> web.Response:
+        return web.Response(text=json.dumps({"ok": True, "result": result}), content_type="application/json")
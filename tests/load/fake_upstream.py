@@ -0,0 +1,256 @@
+"""Fake music-service upstreams for offline end-to-end load tests.
+
+With ``UPSTREAM_BASE_URL`` set, the bot sends every upstream request as
+``<base>/<original host><original path>`` (see ``app.sources.upstream_url``).
+This server answers those paths with the recorded benchmark fixtures. Every
+response can be delayed, and a share of them fails with a 5xx or a 429.
+
+Usage:
+    python tests/load/fake_upstream.py --port 8090 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import copy
+import json
+import random
+import threading
+from collections import Counter
+from pathlib import Path
+
+from aiohttp import web
+
+FIXTURES = Path(__file__).resolve().parents[1] / "benchmarks" / "fixtures"
+
+
+def load_fixture(name: str):
+    text = (FIXTURES / name).read_text(encoding="utf-8")
+    return json.loads(text) if name.endswith(".json") else text
+
+
+def to_yandex_json(value):
+    """The fixtures use snake_case; the real API (and the client) use camelCase."""
+    if isinstance(value, dict):
+        return {
+            "".join(part if index == 0 else part.title() for index, part in enumerate(key.split("_"))): to_yandex_json(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [to_yandex_json(item) for item in value]
+    return value
+
+
+class FakeUpstream:
+    """aiohttp app emulating Spotify, Apple Music, SoundCloud, YouTube and Yandex.
+
+    ``latency`` plus up to ``jitter`` seconds is added to every response.
+    ``error_rate`` of the requests get a 503 and ``throttle_rate`` a 429 with
+    ``Retry-After``. ``requests`` counts requests by (host, status).
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: int = 1,
+        seed: int | None = None,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.requests: Counter = Counter()
+        self.spotify_track = load_fixture("spotify_track.json")
+        self.spotify_search = load_fixture("spotify_search.json")
+        self.apple_html = load_fixture("apple_music_ld_json.html")
+        self.soundcloud_html = load_fixture("soundcloud_track.html")
+        self.youtube_oembed = load_fixture("youtube_oembed.json")
+        self.yandex_tracks = to_yandex_json(load_fixture("yandex_tracks.json"))
+        self.routes = {
+            "accounts.spotify.com": self.spotify_token,
+            "api.spotify.com": self.spotify_api,
+            "itunes.apple.com": self.itunes_search,
+            "music.apple.com": self.html_page(self.apple_html),
+            "soundcloud.com": self.html_page(self.soundcloud_html),
+            "www.soundcloud.com": self.html_page(self.soundcloud_html),
+            "on.soundcloud.com": self.redirect_to("https://soundcloud.com/radikon/premiere"),
+            "spotify.link": self.redirect_to("https://open.spotify.com/track/4uLU6hMCjMI75M1A2tKUQC"),
+            "open.spotify.com": self.html_page("<html></html>"),
+            "www.youtube.com": self.youtube_oembed_handler,
+            "api.music.yandex.net": self.yandex_api,
+        }
+
+    def build_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/{host}/{path:.*}", self.dispatch)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+        runner = web.AppRunner(self.build_app())
+        await runner.setup()
+        site = web.TCPSite(runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        return runner, f"http://{host}:{bound_port}"
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 0) -> tuple[str, "threading.Event"]:
+        """Serve from a separate thread and event loop, so blocking client calls
+        in the bot (the ``yandex-music`` client is synchronous) cannot stall it.
+        Set the returned event to stop the server.
+        """
+        started = threading.Event()
+        stop = threading.Event()
+        result = {}
+
+        async def run():
+            runner, result["base_url"] = await self.start(host, port)
+            started.set()
+            while not stop.is_set():
+                await asyncio.sleep(0.05)
+            await runner.cleanup()
+
+        threading.Thread(target=asyncio.run, args=(run(),), name="fake-upstream", daemon=True).start()
+        started.wait()
+        return result["base_url"], stop
+
+    async def dispatch(self, request: web.Request) -> web.StreamResponse:
+        host = request.match_info["host"]
+        route = self.routes.get(host)
+        delay = self.latency + self.random.uniform(0, self.jitter)
+        if delay:
+            await asyncio.sleep(delay)
+
+        roll = self.random.random()
+        if route is None:
+            response = web.json_response({"error": "unknown host"}, status=404)
+        elif roll < self.throttle_rate:
+            response = web.json_response(
+                {"error": "rate limited"}, status=429, headers={"Retry-After": str(self.retry_after)}
+            )
+        elif roll < self.throttle_rate + self.error_rate:
+            response = web.json_response({"error": "unavailable"}, status=503)
+        else:
+            response = await route(request, "/" + request.match_info["path"])
+        self.requests[host, response.status] += 1
+        return response
+
+    def html_page(self, html: str):
+        async def handler(request, path):
+            return web.Response(text=html, content_type="text/html")
+        return handler
+
+    def redirect_to(self, location: str):
+        async def handler(request, path):
+            return web.Response(status=302, headers={"Location": location})
+        return handler
+
+    async def spotify_token(self, request, path):
+        return web.json_response({"access_token": "fake-token", "token_type": "Bearer", "expires_in": 3600})
+
+    def build_spotify_track(self, track_id: str) -> dict:
+        track = copy.deepcopy(self.spotify_track)
+        track["id"] = track_id
+        track["external_urls"] = {"spotify": f"https://open.spotify.com/track/{track_id}"}
+        return track
+
+    async def spotify_api(self, request, path):
+        ids = [item for item in request.query.get("ids", "").split(",") if item]
+        if path == "/v1/tracks":
+            return web.json_response({"tracks": [self.build_spotify_track(track_id) for track_id in ids]})
+        if path.startswith("/v1/tracks/"):
+            return web.json_response(self.build_spotify_track(path.rsplit("/", 1)[1]))
+        if path == "/v1/albums":
+            return web.json_response({"albums": [{"id": album_id, "label": "Anjunadeep"} for album_id in ids]})
+        if path.startswith("/v1/albums/"):
+            return web.json_response({"id": path.rsplit("/", 1)[1], "label": "Anjunadeep"})
+        if path == "/v1/search":
+            return web.json_response(self.spotify_search)
+        return web.json_response({"error": "not found"}, status=404)
+
+    async def itunes_search(self, request, path):
+        limit = int(request.query.get("limit", "3"))
+        results = [
+            {
+                "artistName": "Nox Vahn, Marsh",
+                "trackName": "Follow Me",
+                "collectionName": "Prospect EP",
+                "artworkUrl100": "https://is1-ssl.mzstatic.com/image/thumb/100x100bb.jpg",
+                "releaseDate": "2019-10-04T07:00:00Z",
+                "trackViewUrl": f"https://music.apple.com/us/album/prospect/1481264320?i={1481264325 + index}",
+            }
+            for index in range(limit)
+        ]
+        return web.json_response({"resultCount": len(results), "results": results})
+
+    async def youtube_oembed_handler(self, request, path):
+        return web.json_response(self.youtube_oembed)
+
+    async def yandex_api(self, request, path):
+        if path == "/account/status":
+            result = {
+                "account": {"now": "2024-01-01T00:00:00+00:00", "serviceAvailable": True, "uid": 0},
+                "permissions": {"until": "2024-01-01T00:00:00+00:00", "values": [], "default": []},
+            }
+        elif path == "/tracks":
+            form = await request.post()
+            ids = str(form.get("track-ids", "")).split(",")
+            result = [
+                {**self.yandex_tracks[0], "id": track_id.split(":")[0]}
+                for track_id in ids
+                if track_id
+            ]
+        elif path == "/search":
+            result = {
+                "searchRequestId": "fake",
+                "text": request.query.get("text", ""),
+                "tracks": {"type": "track", "total": len(self.yandex_tracks), "perPage": 10, "order": 0, "results": self.yandex_tracks},
+            }
+        else:
+            return web.json_response({"error": {"name": "not-found"}}, status=404)
+        return web.json_response({"invocationInfo": {"hostname": "fake-upstream", "req-id": "fake"}, "result": result})
+
+
+async def serve(upstream: FakeUpstream, host: str, port: int):
+    runner, base_url = await upstream.start(host, port)
+    print(f"Fake upstream: UPSTREAM_BASE_URL={base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def add_upstream_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds added to every upstream response")
+    parser.add_argument("--jitter", type=float, default=0.02, help="random extra latency, up to this many seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of upstream responses that are 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of upstream responses that are 429")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def build_upstream(args) -> FakeUpstream:
+    return FakeUpstream(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        seed=args.seed,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    add_upstream_arguments(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(build_upstream(args), args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
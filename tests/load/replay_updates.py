@@ -0,0 +1,216 @@
+"""Replay recorded (or synthetic) updates through the real polling loop and report throughput.
+
+Usage:
+    python tests/load/replay_updates.py updates.jsonl --speed 2
+    python tests/load/replay_updates.py --synthetic 500 --inline-share 0.3 --speed 0
+
+Record a log in production with ``UPDATE_RECORD_PATH`` (see ``app/update_recorder.py``).
+The bot runs ``dp.start_polling`` against ``fake_bot_api.FakeBotApi`` and the
+music services are answered by ``fake_upstream.FakeUpstream``. Each update is
+published at its recorded offset divided by ``--speed`` (0 publishes everything
+at once). Per update type the report gives the share answered, the queueing
+delay (published until ``getUpdates`` returned it), the latency until the first
+Bot API call for its chat or inline query, and outgoing calls by method.
+"""
+import argparse
+import asyncio
+import bisect
+import importlib
+import json
+import os
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_bot_api import FakeBotApi  # noqa: E402
+from fake_upstream import add_upstream_arguments, build_upstream  # noqa: E402
+from run_e2e import LINK_TEMPLATES, build_update, percentile, prepare_environment  # noqa: E402
+
+SETTLE_SECONDS = 0.5
+INLINE_QUERIES = ("follow me", "nox vahn", "anjunadeep", "stephan bodzin singularity")
+
+
+def load_log(path: str) -> list[tuple[float, dict]]:
+    entries = []
+    with open(path, encoding="utf-8") as log_file:
+        for line in log_file:
+            if line.strip():
+                record = json.loads(line)
+                entries.append((float(record["offset"]), record["update"]))
+    return entries
+
+
+def build_synthetic_log(count: int, inline_share: float, rate: float) -> list[tuple[float, dict]]:
+    services = list(LINK_TEMPLATES)
+    entries = []
+    inline_every = round(1 / inline_share) if inline_share else 0
+    for index in range(count):
+        if inline_every and index % inline_every == 0:
+            update = {
+                "update_id": index,
+                "inline_query": {
+                    "id": f"q{index}",
+                    "from": {"id": 20_000 + index, "is_bot": False, "first_name": "User"},
+                    "query": INLINE_QUERIES[index % len(INLINE_QUERIES)],
+                    "offset": "",
+                },
+            }
+        else:
+            update = build_update(index, services[index % len(services)]).model_dump(
+                mode="json", exclude_none=True, by_alias=True
+            )
+        entries.append((index / rate if rate else 0.0, update))
+    return entries
+
+
+def get_update_kind(update: dict) -> str:
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if key in update:
+            return f"{key}:{update[key]['chat']['type']}"
+    return next(key for key in update if key != "update_id")
+
+
+def get_update_target(update: dict) -> tuple | None:
+    for key in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if key in update:
+            return "chat", update[key]["chat"]["id"]
+    if "inline_query" in update:
+        return "inline_query", update["inline_query"]["id"]
+    inline_message_id = update.get("chosen_inline_result", {}).get("inline_message_id")
+    return ("inline_message", inline_message_id) if inline_message_id else None
+
+
+def build_report(entries: list[tuple[int, dict]], api: FakeBotApi, published_at: dict[int, float], elapsed: float) -> dict:
+    """Attribute every Bot API call to the latest update for the same chat or query served before it."""
+    served_by_target = defaultdict(list)
+    for update_id, update in entries:
+        target = get_update_target(update)
+        if target and update_id in api.served_at:
+            served_by_target[target].append((api.served_at[update_id], update_id))
+    for served in served_by_target.values():
+        served.sort()
+
+    kinds = {update_id: get_update_kind(update) for update_id, update in entries}
+    first_call_at: dict[int, float] = {}
+    calls_by_kind = defaultdict(Counter)
+    for method, received_at, target in sorted(api.calls, key=lambda call: call[1]):
+        served = served_by_target.get(target, [])
+        position = bisect.bisect_right(served, (received_at, float("inf"))) - 1
+        if position < 0:
+            calls_by_kind["unattributed"][method] += 1
+            continue
+        update_id = served[position][1]
+        first_call_at.setdefault(update_id, received_at)
+        calls_by_kind[kinds[update_id]][method] += 1
+
+    report = {}
+    for kind in sorted(set(kinds.values())):
+        update_ids = [update_id for update_id, update_kind in kinds.items() if update_kind == kind]
+        queueing = [api.served_at[update_id] - published_at[update_id] for update_id in update_ids if update_id in api.served_at]
+        latencies = [first_call_at[update_id] - published_at[update_id] for update_id in update_ids if update_id in first_call_at]
+        report[kind] = {
+            "updates": len(update_ids),
+            "answered": len(latencies),
+            "throughput_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+            "queueing_p50_ms": round(percentile(queueing, 0.5) * 1000, 1),
+            "queueing_p99_ms": round(percentile(queueing, 0.99) * 1000, 1),
+            "latency_p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+            "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+            "calls": dict(calls_by_kind.get(kind, {})),
+        }
+    if calls_by_kind.get("unattributed"):
+        report["unattributed"] = {"calls": dict(calls_by_kind["unattributed"])}
+    return report
+
+
+async def wait_until_settled(api: FakeBotApi, telegram_app):
+    """Done once everything was served, no work is queued and no call came for a while."""
+    while True:
+        await asyncio.sleep(0.1)
+        scheduler = telegram_app.update_scheduler
+        busy = (
+            api.unserved
+            or scheduler.queue_depth
+            or scheduler.in_progress
+            or telegram_app.outbound_sender.queue_depth
+        )
+        last_call_at = api.calls[-1][1] if api.calls else 0.0
+        if not busy and time.perf_counter() - last_call_at > SETTLE_SECONDS:
+            return
+
+
+async def replay(args) -> dict:
+    upstream_url, stop_upstream = build_upstream(args).start_in_thread()
+    api = FakeBotApi(send_latency=args.send_latency, throttle_rate=args.send_throttle_rate, seed=args.seed)
+    api_url, stop_api = api.start_in_thread()
+    prepare_environment(upstream_url)
+    os.environ["TELEGRAM_API_URL"] = api_url
+    telegram_app = importlib.import_module("app.telegram_app")
+    telegram_app.outbound_sender.global_interval = 1 / args.send_rate
+
+    if args.synthetic:
+        log = build_synthetic_log(args.synthetic, args.inline_share, args.rate)
+    else:
+        log = load_log(args.log)
+    # Renumbered, so getUpdates offsets work whatever ids the recording had.
+    entries = [(update_id, {**update, "update_id": update_id}) for update_id, (_, update) in enumerate(log, start=1)]
+
+    started_at = time.perf_counter()
+    published_at = {}
+    for (offset, _), (update_id, update) in zip(log, entries):
+        published_at[update_id] = started_at + (offset / args.speed if args.speed else 0.0)
+        api.publish(update, published_at[update_id])
+
+    polling = asyncio.create_task(
+        telegram_app.dp.start_polling(telegram_app.bot, handle_as_tasks=False, handle_signals=False, polling_timeout=1)
+    )
+    try:
+        await wait_until_settled(api, telegram_app)
+        elapsed = time.perf_counter() - started_at - SETTLE_SECONDS
+        await telegram_app.dp.stop_polling()
+        await polling
+        await telegram_app.update_scheduler.drain()
+        await telegram_app.outbound_sender.drain()
+    finally:
+        stop_api.set()
+        stop_upstream.set()
+
+    answered_calls = sum(1 for _, received_at, _ in api.calls if received_at >= started_at)
+    return {
+        "updates": len(entries),
+        "elapsed_s": round(elapsed, 3),
+        "outgoing_calls": answered_calls,
+        "by_update_type": build_report(entries, api, published_at, elapsed),
+        "sender": telegram_app.outbound_sender.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log", nargs="?", help="JSON-lines update log written by UPDATE_RECORD_PATH")
+    parser.add_argument("--synthetic", type=int, default=0, help="replay this many generated updates instead of a log")
+    parser.add_argument("--inline-share", type=float, default=0.2, help="share of inline queries in --synthetic")
+    parser.add_argument("--rate", type=float, default=50.0, help="updates per second in --synthetic")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay speed factor, 0 publishes everything at once")
+    parser.add_argument("--send-rate", type=float, default=30.0, help="global Telegram send rate limit")
+    parser.add_argument("--send-latency", type=float, default=0.0, help="seconds per Bot API send call")
+    parser.add_argument("--send-throttle-rate", type=float, default=0.0, help="share of sends answered with 429")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    add_upstream_arguments(parser)
+    args = parser.parse_args()
+    if not args.log and not args.synthetic:
+        parser.error("нужен файл с апдейтами или --synthetic N")
+
+    results = asyncio.run(replay(args))
+    rendered = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(rendered + "\n", encoding="utf-8")
+    else:
+        print(rendered)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""End-to-end load test: synthetic Telegram updates through ``dp`` against the fake upstream.
+
+Usage:
+    python tests/load/run_e2e.py --updates 500 --rate 50 --latency 0.05 --error-rate 0.02
+
+Starts ``fake_upstream.FakeUpstream`` on a free port in its own thread and points the bot at it
+with ``UPSTREAM_BASE_URL``. Bot API calls are answered in-process, so nothing
+leaves the machine. The latency of an update is the time from ``feed_update``
+to the bot's first Telegram call for that chat. Results are JSON.
+"""
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import Chat, Message, Update  # noqa: E402
+
+from fake_upstream import add_upstream_arguments, build_upstream  # noqa: E402
+
+LINK_TEMPLATES = {
+    "spotify": "https://open.spotify.com/track/{index:022d}",
+    "apple_music": "https://music.apple.com/us/album/prospect/1481264320?i={index}",
+    "yandex_music": "https://music.yandex.ru/album/501/track/{index}",
+    "soundcloud": "https://soundcloud.com/radikon/premiere-{index}",
+    "youtube": "https://www.youtube.com/watch?v=v{index:010d}",
+}
+
+
+class RecordingSession(BaseSession):
+    """Bot API session that answers in-process and records when each chat got its reply."""
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.calls: Counter = Counter()
+        self.first_reply_at: dict[int, float] = {}
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is not None:
+            self.first_reply_at.setdefault(chat_id, time.perf_counter())
+        self.calls[method.__api_method__] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if method.__returning__ is Message:
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.now(timezone.utc),
+                chat=Chat(id=chat_id or 0, type="private"),
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def build_update(index: int, service: str) -> Update:
+    chat_id = 10_000 + index
+    link = LINK_TEMPLATES[service].format(index=1_000_000 + index)
+    return Update.model_validate(
+        {
+            "update_id": index,
+            "message": {
+                "message_id": index,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Load", "username": f"load_{index}"},
+                "text": link,
+                "entities": [{"type": "url", "offset": 0, "length": len(link)}],
+            },
+        }
+    )
+
+
+def percentile(values: list[float], share: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * share))]
+
+
+def prepare_environment(upstream_url: str):
+    os.environ.setdefault("TELEGRAM_TOKEN", "123456789:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi")
+    os.environ.setdefault("SPOTIFY_CLIENT_ID", "load-test")
+    os.environ.setdefault("SPOTIFY_CLIENT_SECRET", "load-test")
+    os.environ.setdefault("CACHE_DB_PATH", os.path.join(tempfile.mkdtemp(), "load.sqlite3"))
+    os.environ["UPSTREAM_BASE_URL"] = upstream_url
+
+
+async def run_load(args) -> dict:
+    upstream = build_upstream(args)
+    upstream_url, stop_upstream = upstream.start_in_thread()
+    prepare_environment(upstream_url)
+    telegram_app = importlib.import_module("app.telegram_app")
+
+    session = RecordingSession(args.telegram_latency)
+    telegram_app.bot.session = session
+    telegram_app.outbound_sender.global_interval = 1 / args.send_rate
+    services = args.services or list(LINK_TEMPLATES)
+    fed_at: dict[int, float] = {}
+
+    started_at = time.perf_counter()
+    try:
+        for index in range(args.updates):
+            update = build_update(index, services[index % len(services)])
+            if args.rate:
+                await asyncio.sleep(max(0.0, started_at + index / args.rate - time.perf_counter()))
+            fed_at[update.message.chat.id] = time.perf_counter()
+            await telegram_app.dp.feed_update(telegram_app.bot, update)
+        await telegram_app.update_scheduler.drain()
+        await telegram_app.outbound_sender.drain()
+        finished_at = time.perf_counter()
+    finally:
+        stop_upstream.set()
+
+    latencies = [
+        session.first_reply_at[chat_id] - fed
+        for chat_id, fed in fed_at.items()
+        if chat_id in session.first_reply_at
+    ]
+    elapsed = finished_at - started_at
+    return {
+        "updates": args.updates,
+        "replied": len(latencies),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "latency_max_ms": round(max(latencies, default=0.0) * 1000, 1),
+        "telegram_calls": dict(session.calls),
+        "upstream_requests": {f"{host} {status}": count for (host, status), count in sorted(upstream.requests.items())},
+        "sender": telegram_app.outbound_sender.stats(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--updates", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=0.0, help="updates per second, 0 feeds them all at once")
+    parser.add_argument("--services", nargs="*", choices=sorted(LINK_TEMPLATES), help="link mix, round robin")
+    parser.add_argument("--send-rate", type=float, default=30.0, help="global Telegram send rate limit")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="seconds per Bot API call")
+    parser.add_argument("--output", help="write JSON results to this file instead of stdout")
+    add_upstream_arguments(parser)
+    args = parser.parse_args()
+
+    results = asyncio.run(run_load(args))
+    rendered = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(rendered + "\n", encoding="utf-8")
+    else:
+        print(rendered)
+
+
+if __name__ == "__main__":
+    main()
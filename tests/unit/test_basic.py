@@ -1,7 +1,10 @@
 # tests/unit/test_basic.py
 # flake8: noqa: E402
+import asyncio
+import json
 import os
 import sys
+import time
 from unittest.mock import AsyncMock, patch
 
 import pytest
@@ -9,7 +12,9 @@ import pytest
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 
 import bot
+from app import telegram_app
 from app.sources import read_response_json
+from app.telegram_app import apply_deferred_refinement, enrich_chosen_inline_result
 
 build_inline_search_shortcuts = bot.build_inline_search_shortcuts
 build_inline_track_result = bot.build_inline_track_result
@@ -678,7 +683,9 @@ def test_build_inline_description_keeps_normal_label():
 
 
 @pytest.mark.asyncio
-async def test_parse_yandex_music_prefers_canonical_candidate():
+async def test_parse_yandex_music_prefers_canonical_candidate(monkeypatch, tmp_path):
+    monkeypatch.setattr("app.cache.CACHE_DB_PATH", str(tmp_path / "cache.sqlite3"))
+    bot.init_cache_db()
     base_album = type(
         "Album",
         (),
@@ -736,16 +743,30 @@ async def test_parse_yandex_music_prefers_canonical_candidate():
         },
     )()
 
-    with patch("app.sources.get_yandex_client", return_value=client):
-        result = await parse_yandex_music("https://music.yandex.ru/album/1/track/123")
+    url = "https://music.yandex.ru/album/1/track/123"
+    monkeypatch.setattr("app.sources._yandex_refinement_results", {})
+    with patch("app.sources.get_yandex_client", return_value=client), \
+         patch("app.sources.track_store.set", new_callable=AsyncMock) as mock_set_cache:
+        first_reply = await parse_yandex_music(url)
+        assert first_reply["label"] == "Креатив-ИН"
+
+        result = await bot.sources.get_pending_yandex_refinement(url)
         assert result["artist"] == "Nox Vahn, Marsh, Mimi Page"
         assert result["album"] == "Prospect EP"
         assert result["label"] == "Anjunadeep"
         assert result["release_date"] == "28.05.2019"
+        # The refined payload goes through store_parsed_track: entity links and the adapter TTL.
+        mock_set_cache.assert_awaited_once_with(url, {**result, "links": {"yandex_music": url}}, None)
+
+    client.search = None
+    with patch("app.sources.get_yandex_client", return_value=client):
+        memoized = await parse_yandex_music("https://music.yandex.ru/track/123")
+        assert memoized["label"] == "Anjunadeep"
+        assert memoized["source_url"] == "https://music.yandex.ru/track/123"
 
 
 @pytest.mark.asyncio
-async def test_parse_yandex_music_keeps_specific_base_label_when_refined_is_generic():
+async def test_parse_yandex_music_keeps_specific_base_label_when_refined_is_generic(monkeypatch):
     base_album = type(
         "Album",
         (),
@@ -803,11 +824,20 @@ async def test_parse_yandex_music_keeps_specific_base_label_when_refined_is_gene
         },
     )()
 
-    with patch("app.sources.get_yandex_client", return_value=client):
+    monkeypatch.setattr("app.sources._yandex_refinement_results", {})
+    with patch("app.sources.get_yandex_client", return_value=client), \
+         patch("app.sources.track_store.set", new_callable=AsyncMock) as mock_set_cache:
         result = await parse_yandex_music("https://music.yandex.ru/album/1/track/123")
         assert result["label"] == "Креатив-ИН"
         assert result["release_date"] == "01.10.2019"
 
+        refined = await bot.sources.get_pending_yandex_refinement(
+            "https://music.yandex.ru/album/1/track/123"
+        )
+        assert refined["label"] == "Креатив-ИН"
+        assert refined["release_date"] == "01.10.2019"
+        mock_set_cache.assert_awaited_once()
+
 
 @pytest.mark.asyncio
 async def test_parse_music_url_uses_cache():
@@ -838,3 +868,1556 @@ async def test_parse_music_url_skips_unsupported_classified_links():
         result = await parse_music_url("https://soundcloud.com/artist/sets/live-set")
         assert result is None
         mock_parser.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_get_track_info_coalesces_concurrent_lookups():
+    async def fake_batch(track_ids):
+        return {
+            track_id: {"track": f"Track {track_id}", "source": "spotify"}
+            for track_id in track_ids
+            if track_id != "missing"
+        }
+
+    with patch("app.sources.fetch_spotify_tracks_batch", new_callable=AsyncMock, side_effect=fake_batch) as mock_batch:
+        results = await asyncio.gather(
+            bot.get_track_info("a1"),
+            bot.get_track_info("b2"),
+            bot.get_track_info("a1"),
+            bot.get_track_info("missing"),
+        )
+
+    mock_batch.assert_awaited_once_with(["a1", "b2", "missing"])
+    assert results[0]["track"] == "Track a1"
+    assert results[1]["track"] == "Track b2"
+    assert results[2] == results[0]
+    assert results[3] is None
+
+
+@pytest.mark.asyncio
+async def test_fetch_spotify_tracks_batch_resolves_labels_together():
+    tracks_json = {
+        "tracks": [
+            {
+                "id": "t1",
+                "name": "Woman",
+                "artists": [{"name": "Lane 8"}],
+                "album": {"id": "al1", "name": "Childish", "images": [], "release_date": "2022-01-14"},
+            },
+            None,
+        ]
+    }
+    albums_json = {"albums": [{"id": "al1", "label": "This Never Happened"}]}
+
+    with patch("app.sources.get_spotify_token", new_callable=AsyncMock, return_value="token"), \
+         patch("app.sources.aiohttp.ClientSession.get") as mock_get:
+        mock_resp = AsyncMock()
+        mock_resp.status = 200
+        mock_resp.json = AsyncMock(side_effect=[tracks_json, albums_json])
+        mock_get.return_value.__aenter__.return_value = mock_resp
+
+        result = await bot.sources.fetch_spotify_tracks_batch(["t1", "bad"])
+
+    assert mock_get.call_count == 2
+    assert mock_get.call_args_list[0].kwargs["params"] == {"ids": "t1,bad"}
+    assert result == {
+        "t1": {
+            "artist": "Lane 8",
+            "track": "Woman",
+            "album": "Childish",
+            "image": None,
+            "label": "This Never Happened",
+            "release_date": "14.01.2022",
+            "source": "spotify",
+            "source_url": "https://open.spotify.com/track/t1",
+            "duration_ms": None,
+            "isrc": None,
+        }
+    }
+
+
+@pytest.mark.asyncio
+async def test_apply_deferred_refinement_edits_caption_only_for_better_label():
+    track_info = {
+        "artist": "Nox Vahn & Marsh",
+        "track": "Follow Me",
+        "album": "Prospect EP",
+        "image": "https://example.com/image.jpg",
+        "label": "Креатив-ИН",
+        "release_date": "01.10.2019",
+        "source": "yandex_music",
+        "source_url": "https://music.yandex.ru/album/1/track/123",
+    }
+    refined = {**track_info, "artist": "Nox Vahn, Marsh", "label": "Anjunadeep"}
+    chat = type("Chat", (), {"id": 42, "type": "private"})()
+    sent_message = type("Message", (), {"chat": chat, "message_id": 7, "photo": [object()]})()
+
+    async def outcome(value):
+        return value
+
+    with patch("app.telegram_app.bot.edit_message_caption", new_callable=AsyncMock) as mock_edit:
+        await apply_deferred_refinement(
+            sent_message, asyncio.create_task(outcome(None)), track_info, None
+        )
+        mock_edit.assert_not_called()
+
+        await apply_deferred_refinement(
+            sent_message, asyncio.create_task(outcome(refined)), track_info, "@user"
+        )
+        mock_edit.assert_awaited_once()
+        assert mock_edit.call_args.kwargs["message_id"] == 7
+        assert "Label: Anjunadeep" in mock_edit.call_args.kwargs["caption"]
+
+
+@pytest.mark.asyncio
+async def test_base_yandex_payload_does_not_overwrite_a_finished_refinement(monkeypatch, tmp_path):
+    from app import sources
+
+    monkeypatch.setattr("app.cache.CACHE_DB_PATH", str(tmp_path / "cache.sqlite3"))
+    bot.init_cache_db()
+    url = "https://music.yandex.ru/album/1/track/9028"
+    base = {
+        "artist": "Nox Vahn & Marsh", "track": "Follow Me", "album": "Prospect EP", "image": None,
+        "label": "Креатив-ИН", "release_date": "01.10.2019", "source": "yandex_music", "source_url": url,
+    }
+    refined = {**base, "label": "Anjunadeep"}
+    monkeypatch.setattr(sources, "_yandex_refinement_results", {})
+    monkeypatch.setattr(sources, "refine_yandex_payload", AsyncMock(return_value=refined))
+    adapter = sources.SOURCE_ADAPTERS_BY_SERVICE["yandex_music"]
+    stored = {}
+
+    async def fake_set(url, payload, ttl=None):
+        stored[url] = payload
+
+    monkeypatch.setattr(sources.track_store, "set", fake_set)
+    real_merge = sources.remember_track_entity
+
+    def slow_merge(payload, service_id=None):
+        # The base write is still merging when the refinement finishes.
+        if payload["label"] == base["label"]:
+            time.sleep(0.1)
+        return real_merge(payload, service_id)
+
+    monkeypatch.setattr(sources, "remember_track_entity", slow_merge)
+    await asyncio.gather(
+        sources.store_parsed_track(adapter, url, base),
+        sources.run_yandex_refinement(url, "9028", None, base),
+    )
+
+    assert stored[url]["label"] == "Anjunadeep"
+    assert stored[url]["links"] == {"yandex_music": url}
+
+
+@pytest.mark.asyncio
+async def test_track_card_is_refined_when_refinement_finishes_before_the_send(monkeypatch):
+    from app import sources
+
+    url = "https://music.yandex.ru/album/1/track/9027"
+    track_info = {
+        "artist": "Nox Vahn & Marsh", "track": "Follow Me", "album": "Prospect EP",
+        "image": "https://example.com/image.jpg", "label": "Креатив-ИН", "release_date": "01.10.2019",
+        "source": "yandex_music", "source_url": url,
+    }
+    refined = {**track_info, "label": "Anjunadeep"}
+    monkeypatch.setattr(sources, "_yandex_refinement_results", {})
+    monkeypatch.setattr(sources, "_yandex_refinement_tasks", {})
+    monkeypatch.setattr(sources, "refine_yandex_payload", AsyncMock(return_value=refined))
+    monkeypatch.setattr(sources.track_store, "set", AsyncMock())
+    chat = type("Chat", (), {"id": 9027, "type": "private"})()
+    message = type("Message", (), {"chat": chat})()
+    refinement = sources.schedule_yandex_refinement(url, "9027", None, track_info)
+
+    async def slow_send_photo(**kwargs):
+        await refinement
+        await asyncio.sleep(0)
+        return type("Message", (), {"chat": chat, "message_id": 11, "photo": [object()]})()
+
+    with patch("app.telegram_app.bot.send_photo", side_effect=slow_send_photo), \
+         patch("app.telegram_app.bot.edit_message_caption", new_callable=AsyncMock) as mock_edit:
+        telegram_app.send_track_card(message, url, track_info, None)
+        await telegram_app.outbound_sender.drain()
+        assert sources.get_pending_yandex_refinement(url).result() == refined
+        await asyncio.gather(*telegram_app._background_tasks)
+        await telegram_app.outbound_sender.drain()
+
+    mock_edit.assert_awaited_once()
+    assert "Label: Anjunadeep" in mock_edit.call_args.kwargs["caption"]
+
+
+@pytest.mark.asyncio
+async def test_search_spotify_track_payloads_does_not_wait_for_labels(monkeypatch):
+    items = [
+        {
+            "name": "Woman",
+            "artists": [{"name": "Lane 8"}],
+            "album": {"id": "al1", "name": "Childish", "images": [{"url": "img"}], "release_date": "2022"},
+            "external_urls": {"spotify": "https://open.spotify.com/track/t1"},
+        },
+        {
+            "name": "Brightest Lights",
+            "artists": [{"name": "Lane 8"}],
+            "album": {"id": "al2", "name": "Brightest Lights", "images": [{"url": "img"}], "release_date": "2020"},
+            "external_urls": {"spotify": "https://open.spotify.com/track/t2"},
+        },
+    ]
+    monkeypatch.setattr("app.sources._album_label_cache", {"al2": "This Never Happened"})
+
+    with patch("app.sources.search_spotify_tracks", new_callable=AsyncMock, return_value=items), \
+         patch("app.sources.get_album_label", new_callable=AsyncMock) as mock_label, \
+         patch("app.sources.warm_album_label_cache") as mock_warm:
+        payloads = await bot.search_spotify_track_payloads("lane 8")
+
+    mock_label.assert_not_called()
+    mock_warm.assert_called_once_with(["al1"])
+    assert [payload["label"] for payload in payloads] == ["Spotify", "This Never Happened"]
+    assert build_inline_description("Childish", "Spotify", "spotify") == "Childish"
+
+
+@pytest.mark.asyncio
+async def test_enrich_chosen_inline_result_edits_sent_message():
+    track_info = {
+        "artist": "Lane 8",
+        "track": "Woman",
+        "album": "Childish",
+        "image": None,
+        "label": "This Never Happened",
+        "release_date": "2022",
+        "source": "spotify",
+        "source_url": "https://open.spotify.com/track/t1",
+    }
+    chosen = type(
+        "ChosenInlineResult",
+        (),
+        {
+            "result_id": "spotify-lazy-t1",
+            "inline_message_id": "inline-1",
+            "from_user": type("User", (), {"username": "alex", "full_name": "Alex"})(),
+        },
+    )()
+
+    with patch("app.telegram_app.parse_music_url", new_callable=AsyncMock, return_value=track_info) as mock_parse, \
+         patch("app.telegram_app.bot.edit_message_text", new_callable=AsyncMock) as mock_edit:
+        await enrich_chosen_inline_result(chosen)
+
+    mock_parse.assert_awaited_once_with("https://open.spotify.com/track/t1")
+    assert mock_edit.call_args.kwargs["inline_message_id"] == "inline-1"
+    assert "Label: This Never Happened" in mock_edit.call_args.kwargs["text"]
+    assert "_from @alex_" in mock_edit.call_args.kwargs["text"]
+
+
+@pytest.mark.asyncio
+async def test_search_tracks_page_starts_with_fastest_source_and_caches_pages(monkeypatch):
+    monkeypatch.setattr("app.sources._search_page_cache", {})
+    monkeypatch.setattr("app.sources._search_latency", {"spotify": 0.9, "apple_music": 0.2, "yandex_music": 0.5})
+    apple_payloads = [{"source": "apple_music", "artist": "C", "track": "V"}]
+
+    with patch("app.sources.search_cached_tracks", return_value=[]), \
+         patch("app.sources.search_apple_music_tracks", new_callable=AsyncMock, return_value=apple_payloads) as mock_apple, \
+         patch("app.sources.search_spotify_track_payloads", new_callable=AsyncMock) as mock_spotify:
+        items, next_offset = await bot.sources.search_tracks_page("Lane 8 Woman")
+        cached_items, cached_offset = await bot.sources.search_tracks_page("lane 8  woman")
+
+    assert items == apple_payloads
+    assert next_offset == "1:apple_music"
+    assert (cached_items, cached_offset) == (items, next_offset)
+    mock_apple.assert_awaited_once_with("Lane 8 Woman", 5, 0)
+    mock_spotify.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_search_tracks_page_pulls_deeper_results_from_each_source(monkeypatch):
+    monkeypatch.setattr("app.sources._search_page_cache", {})
+
+    spotify_payloads = [{"source": "spotify", "artist": "A", "track": "T", "label": "L", "source_url": "s"}]
+    apple_payloads = [{"source": "apple_music", "artist": "C", "track": "V", "label": "L", "source_url": "a"}]
+
+    with patch("app.sources.search_spotify_track_payloads", new_callable=AsyncMock, return_value=spotify_payloads) as mock_spotify, \
+         patch("app.sources.search_apple_music_tracks", new_callable=AsyncMock, return_value=apple_payloads) as mock_apple, \
+         patch("app.sources.search_yandex_music_tracks", new_callable=AsyncMock, return_value=[]) as mock_yandex:
+        items, next_offset = await bot.sources.search_tracks_page("Lane 8 Woman", "2:spotify")
+
+    mock_spotify.assert_awaited_once_with("Lane 8 Woman", 5, 10, warm_labels=False)
+    mock_apple.assert_awaited_once_with("Lane 8 Woman", 5, 5)
+    mock_yandex.assert_awaited_once_with("Lane 8 Woman", 5, 5)
+    assert [item["source"] for item in items] == ["spotify", "apple_music"]
+    assert next_offset == "3:spotify"
+
+
+@pytest.mark.asyncio
+async def test_search_multisource_tracks_dedupes_before_label_warming():
+    spotify_payloads = [
+        {"source": "spotify", "artist": "Nox Vahn, Marsh", "track": "Follow Me", "album": "Prospect EP", "image": None,
+         "label": "Spotify", "release_date": "2019", "source_url": "s1", "duration_ms": 300000, "isrc": "GBEWA1900001", "album_id": "al1"},
+        {"source": "spotify", "artist": "Nox Vahn, Marsh", "track": "Follow Me", "album": "Prospect EP", "image": None,
+         "label": "Spotify", "release_date": "2019", "source_url": "s2", "duration_ms": 180000, "isrc": None, "album_id": "al2"},
+    ]
+    apple_payloads = [
+        {"source": "apple_music", "artist": "Marsh & Nox Vahn", "track": "Follow Me", "album": "Prospect EP", "image": "img",
+         "label": "Apple Music", "release_date": "2019", "source_url": "a1", "duration_ms": 301000, "isrc": None},
+    ]
+    yandex_payloads = [
+        {"source": "yandex_music", "artist": "Other", "track": "Song", "album": "Unknown Album", "image": None,
+         "label": "Label", "release_date": "Unknown Date", "source_url": "y1", "duration_ms": None, "isrc": "gbewa1900001"},
+    ]
+
+    with patch("app.sources.search_spotify_track_payloads", new_callable=AsyncMock, return_value=spotify_payloads), \
+         patch("app.sources.search_apple_music_tracks", new_callable=AsyncMock, return_value=apple_payloads), \
+         patch("app.sources.search_yandex_music_tracks", new_callable=AsyncMock, return_value=yandex_payloads), \
+         patch("app.sources.warm_album_label_cache") as mock_warm:
+        results = await search_multisource_tracks("Follow Me")
+
+    assert [item["source_url"] for item in results] == ["s1", "s2"]
+    assert results[0]["links"] == {"spotify": "s1", "apple_music": "a1", "yandex_music": "y1"}
+    assert results[0]["image"] == "img"
+    mock_warm.assert_called_once_with(["al1", "al2"])
+
+
+def test_search_cached_tracks_uses_fts_index_and_popularity(monkeypatch, tmp_path):
+    import sqlite3
+    from collections import Counter
+
+    from app.cache import flush_track_hits
+
+    monkeypatch.setattr("app.cache.CACHE_DB_PATH", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr("app.cache._pending_track_hits", Counter())
+    bot.init_cache_db()
+
+    def payload(track, url):
+        return {
+            "artist": "Ёлка",
+            "track": track,
+            "album": "Unknown Album",
+            "image": None,
+            "label": "Velvet Music",
+            "release_date": "2011",
+            "source": "yandex_music",
+            "source_url": url,
+        }
+
+    set_cached_track("https://music.yandex.ru/track/1", payload("Прованс", "https://music.yandex.ru/track/1"))
+    set_cached_track("https://music.yandex.ru/track/2", payload("Около тебя", "https://music.yandex.ru/track/2"))
+    for _ in range(2):
+        bot.sources.record_track_hit("https://music.yandex.ru/track/2")
+    # Hits are buffered in memory and written by the periodic flush in one transaction.
+    with patch("sqlite3.connect", wraps=sqlite3.connect) as mock_connect:
+        assert flush_track_hits() == 1
+    assert mock_connect.call_count == 1
+
+    results = bot.sources.search_cached_tracks("елка")
+    assert [item["track"] for item in results] == ["Около тебя", "Прованс"]
+    assert [item["track"] for item in bot.sources.search_cached_tracks("Елка прован")] == ["Прованс"]
+    assert bot.sources.search_cached_tracks("velvet   music")[0]["label"] == "Velvet Music"
+    assert bot.sources.search_cached_tracks("!!!") == []
+
+
+@pytest.mark.asyncio
+async def test_search_tracks_page_skips_remote_search_with_enough_local_hits():
+    local_payloads = [
+        {"source": "spotify", "artist": f"Artist {index}", "track": "Woman", "label": "L", "source_url": f"s{index}"}
+        for index in range(3)
+    ]
+
+    with patch("app.sources.search_cached_tracks", return_value=local_payloads), \
+         patch("app.sources.search_remote_tracks_page", new_callable=AsyncMock) as mock_remote:
+        items, next_offset = await bot.sources.search_tracks_page("woman")
+
+    mock_remote.assert_not_called()
+    assert [item["source_url"] for item in items] == ["s0", "s1", "s2"]
+    assert next_offset.startswith("0:")
+
+
+def test_remember_track_entity_shares_metadata_across_services(monkeypatch, tmp_path):
+    monkeypatch.setattr("app.cache.CACHE_DB_PATH", str(tmp_path / "cache.sqlite3"))
+    bot.init_cache_db()
+    spotify_payload = {
+        "artist": "Lane 8",
+        "track": "Woman",
+        "album": "Childish",
+        "image": "https://example.com/spotify.jpg",
+        "label": "This Never Happened",
+        "release_date": "14.01.2022",
+        "source": "spotify",
+        "source_url": "https://open.spotify.com/track/t1",
+        "duration_ms": 245000,
+        "isrc": "GBEWA2100001",
+    }
+    apple_payload = {
+        "artist": "Lane 8",
+        "track": "Woman",
+        "album": "Unknown Album",
+        "image": None,
+        "label": "Apple Music",
+        "release_date": "Unknown Date",
+        "source": "apple_music",
+        "source_url": "https://music.apple.com/us/song/1",
+        "duration_ms": None,
+        "isrc": None,
+    }
+
+    bot.sources.remember_track_entity(spotify_payload, "t1")
+    enriched = bot.sources.remember_track_entity(apple_payload, "1")
+
+    assert enriched["label"] == "This Never Happened"
+    assert enriched["album"] == "Childish"
+    assert enriched["release_date"] == "14.01.2022"
+    assert enriched["links"] == {
+        "spotify": "https://open.spotify.com/track/t1",
+        "apple_music": "https://music.apple.com/us/song/1",
+    }
+
+    keyboard = generate_keyboard("Woman", "Lane 8", apple_payload["source_url"], "apple_music", enriched["links"])
+    button_urls = {button.text: button.url for row in keyboard.inline_keyboard for button in row}
+    assert button_urls["🎧 Spotify"] == "https://open.spotify.com/track/t1"
+    assert button_urls["☁️ SoundCloud"].startswith("https://soundcloud.com/search")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_entity_merges_share_one_entity_per_isrc(monkeypatch, tmp_path):
+    import sqlite3
+    from contextlib import closing
+
+    monkeypatch.setattr("app.cache.CACHE_DB_PATH", str(tmp_path / "cache.sqlite3"))
+    bot.init_cache_db()
+
+    def payload(index, copy):
+        return {
+            "artist": f"Artist {index}", "track": f"Track {index}", "album": "Album", "image": None,
+            "label": "Label", "release_date": "2024", "source": "spotify", "duration_ms": 200000,
+            "source_url": f"https://open.spotify.com/track/t{index}?si={copy}", "isrc": f"GB0000{index:06d}",
+        }
+
+    await asyncio.gather(*(
+        asyncio.to_thread(bot.sources.remember_track_entity, payload(index, copy), f"t{index}")
+        for index in range(50)
+        for copy in range(4)
+    ))
+
+    with closing(sqlite3.connect(str(tmp_path / "cache.sqlite3"))) as conn:
+        assert conn.execute("SELECT COUNT(*), COUNT(DISTINCT isrc) FROM track_entities").fetchone() == (50, 50)
+
+
+@pytest.mark.asyncio
+async def test_store_parsed_track_returns_payload_when_cache_write_fails():
+    import sqlite3
+
+    adapter = bot.sources.SOURCE_ADAPTERS_BY_SERVICE["spotify"]
+    payload = {"artist": "Artist", "track": "Track", "source": "spotify", "source_url": "https://open.spotify.com/track/t1"}
+
+    with patch("app.sources.remember_track_entity", side_effect=sqlite3.IntegrityError("UNIQUE constraint failed")), \
+         patch("app.sources.track_store.set", new_callable=AsyncMock) as mock_set, \
+         patch("app.sources.record_track_hit"):
+        stored = await bot.sources.store_parsed_track(adapter, payload["source_url"], payload)
+
+    assert stored == payload
+    mock_set.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_expand_short_link_follows_adapter_redirect_hosts():
+    sources = bot.sources
+    expanded = "https://soundcloud.com/artist/track"
+
+    with patch("app.sources.resolve_redirect_url", new_callable=AsyncMock, return_value=expanded) as mock_resolve:
+        assert await sources.expand_short_link("https://on.soundcloud.com/abc123") == (
+            expanded, sources.classify_music_url(expanded)
+        )
+        mock_resolve.assert_awaited_once_with(
+            "https://on.soundcloud.com/abc123", sources.SOURCE_ADAPTERS_BY_SERVICE["soundcloud_shortlink"].redirect_hosts
+        )
+        url, classification = await sources.expand_short_link("https://open.spotify.com/track/t1")
+        assert url == "https://open.spotify.com/track/t1" and classification["service"] == "spotify"
+        assert mock_resolve.await_count == 1
+
+        mock_resolve.return_value = None
+        assert (await sources.expand_short_link("https://spotify.link/abc"))[0] is None
+        assert mock_resolve.call_args.args[1] == frozenset(sources.SPOTIFY_REDIRECT_HOSTS)
+
+
+def test_source_adapter_registry_indexes_every_host_once():
+    assert bot.sources.SOURCE_ADAPTERS_BY_HOST["music.youtube.com"].service == "youtube_music"
+    assert bot.sources.SOURCE_ADAPTERS_BY_HOST["youtu.be"].service == "youtube"
+    assert classify_music_url("https://example.com/track/1") == {"service": None, "kind": None, "supported": False}
+
+    duplicate = bot.sources.SourceAdapter(
+        service="copycat",
+        hosts=frozenset({"open.spotify.com"}),
+        classify=bot.sources.classify_spotify_url,
+    )
+    with pytest.raises(ValueError):
+        bot.sources.build_host_index([*bot.sources.SOURCE_ADAPTERS, duplicate])
+
+
+@pytest.mark.asyncio
+async def test_parse_music_urls_uses_adapter_batch_fetch():
+    payloads = {
+        track_id: {"artist": "Unknown Artist", "track": track_id, "source": "spotify", "source_url": track_id}
+        for track_id in ("t1", "t2")
+    }
+
+    with patch("app.sources.track_store.get_many", new_callable=AsyncMock, return_value={}), \
+         patch("app.sources.track_store.get", new_callable=AsyncMock, return_value=None), \
+         patch("app.sources.track_store.set", new_callable=AsyncMock), \
+         patch("app.sources.record_track_hit"), \
+         patch("app.sources.fetch_spotify_tracks_batch", new_callable=AsyncMock, return_value=payloads) as mock_batch, \
+         patch("app.sources.parse_soundcloud", new_callable=AsyncMock, return_value=None) as mock_soundcloud:
+        results = await bot.sources.parse_music_urls([
+            "https://open.spotify.com/track/t1",
+            "https://open.spotify.com/track/t2",
+            "https://open.spotify.com/track/t1",
+            "https://soundcloud.com/artist/track",
+            "https://soundcloud.com/artist/sets/live-set",
+        ])
+
+    mock_batch.assert_awaited_once_with(["t1", "t2"])
+    mock_soundcloud.assert_awaited_once_with("https://soundcloud.com/artist/track")
+    assert results["https://open.spotify.com/track/t2"]["track"] == "t2"
+    assert results["https://soundcloud.com/artist/sets/live-set"] is None
+    assert len(results) == 4
+
+
+@pytest.mark.asyncio
+async def test_concurrent_single_link_messages_share_one_spotify_tracks_call():
+    payloads = {
+        track_id: {"artist": "Unknown Artist", "track": track_id, "source": "spotify", "source_url": track_id}
+        for track_id in ("c1", "c2", "c3")
+    }
+
+    with patch("app.sources.track_store.get_many", new_callable=AsyncMock, return_value={}), \
+         patch("app.sources.track_store.set", new_callable=AsyncMock), \
+         patch("app.sources.record_track_hit"), \
+         patch("app.sources.fetch_spotify_tracks_batch", new_callable=AsyncMock, return_value=payloads) as mock_batch:
+        results = await asyncio.gather(*(
+            bot.sources.parse_music_urls([f"https://open.spotify.com/track/{track_id}"])
+            for track_id in payloads
+        ))
+
+    mock_batch.assert_awaited_once()
+    assert sorted(mock_batch.call_args.args[0]) == ["c1", "c2", "c3"]
+    assert [next(iter(result.values()))["track"] for result in results] == ["c1", "c2", "c3"]
+
+
+@pytest.mark.asyncio
+async def test_parse_music_urls_isolates_a_failing_batch():
+    soundcloud_payload = {
+        "artist": "Artist", "track": "Track", "source": "soundcloud", "source_url": "https://soundcloud.com/artist/track",
+    }
+
+    with patch("app.sources.track_store.get_many", new_callable=AsyncMock, return_value={}), \
+         patch("app.sources.track_store.get", new_callable=AsyncMock, return_value=None), \
+         patch("app.sources.track_store.set", new_callable=AsyncMock), \
+         patch("app.sources.record_track_hit"), \
+         patch("app.sources.fetch_spotify_tracks_batch", new_callable=AsyncMock, side_effect=RuntimeError("token")), \
+         patch("app.sources.parse_soundcloud", new_callable=AsyncMock, return_value=soundcloud_payload):
+        results = await bot.sources.parse_music_urls([
+            "https://open.spotify.com/track/t1",
+            "https://soundcloud.com/artist/track",
+        ])
+
+    assert results["https://open.spotify.com/track/t1"] is None
+    assert results["https://soundcloud.com/artist/track"]["track"] == "Track"
+
+
+@pytest.mark.asyncio
+async def test_parse_music_urls_isolates_a_failing_single_fetch():
+    spotify_payload = {
+        "artist": "Artist", "track": "Song", "source": "spotify", "source_url": "https://open.spotify.com/track/t1",
+    }
+
+    with patch("app.sources.track_store.get_many", new_callable=AsyncMock, return_value={}), \
+         patch("app.sources.track_store.get", new_callable=AsyncMock, return_value=None), \
+         patch("app.sources.track_store.set", new_callable=AsyncMock), \
+         patch("app.sources.record_track_hit"), \
+         patch("app.sources.fetch_spotify_tracks_batch", new_callable=AsyncMock, return_value={"t1": spotify_payload}), \
+         patch("app.sources.parse_soundcloud", new_callable=AsyncMock, side_effect=TimeoutError()):
+        results = await bot.sources.parse_music_urls([
+            "https://open.spotify.com/track/t1",
+            "https://soundcloud.com/artist/track",
+        ])
+
+    assert results["https://open.spotify.com/track/t1"]["track"] == "Song"
+    assert results["https://soundcloud.com/artist/track"] is None
+
+
+def test_is_music_link_candidate_checks_entities_only():
+    from aiogram.types import MessageEntity
+
+    from app.metrics import MESSAGE_FILTER_TOTAL
+
+    filtered, processed = MESSAGE_FILTER_TOTAL.value("filtered"), MESSAGE_FILTER_TOTAL.value("processed")
+
+    def message(text, entities, caption=None):
+        return type("Message", (), {"text": text, "caption": caption, "entities": entities, "caption_entities": None})()
+
+    plain = message("https://open.spotify.com/track/abc but no entity", None)
+    link = "👉 https://www.open.spotify.com/track/abc"
+    with_url = message(link, [MessageEntity(type="url", offset=3, length=len(link) - 3)])
+    other_url = message("https://example.com/x", [MessageEntity(type="url", offset=0, length=21)])
+    text_link = message("listen", [MessageEntity(type="text_link", offset=0, length=6, url="https://music.yandex.ru/track/1")])
+
+    assert telegram_app.is_music_link_candidate(plain) is False
+    assert telegram_app.is_music_link_candidate(with_url) is True
+    assert telegram_app.is_music_link_candidate(other_url) is False
+    assert telegram_app.is_music_link_candidate(text_link) is True
+    assert MESSAGE_FILTER_TOTAL.value("filtered") == filtered + 2
+    assert MESSAGE_FILTER_TOTAL.value("processed") == processed + 2
+    # The filter guarantees entity URLs, so plain text is not treated as a link.
+    assert telegram_app.extract_music_urls(plain) == []
+
+
+@pytest.mark.asyncio
+async def test_process_music_message_resolves_all_links_into_one_reply():
+    from aiogram.types import MessageEntity
+
+    first = "https://open.spotify.com/track/t1"
+    second = "https://music.apple.com/us/song/life/1488790382"
+    text = f"two tracks: {first} and {second} and again {first}?si=abc"
+    entities = [
+        MessageEntity(type="url", offset=text.index(first), length=len(first)),
+        MessageEntity(type="url", offset=text.index(second), length=len(second)),
+        MessageEntity(type="url", offset=text.rindex(first), length=len(first) + 7),
+    ]
+    chat = type("Chat", (), {"id": 1, "type": "group"})()
+    user = type("User", (), {"username": "alex", "full_name": "Alex"})()
+    message = type(
+        "Message",
+        (),
+        {"text": text, "caption": None, "entities": entities, "caption_entities": None, "chat": chat, "from_user": user},
+    )()
+
+    def payload(url, source, track):
+        return {
+            "artist": "Artist", "track": track, "album": "Album", "image": None, "label": "Label",
+            "release_date": "2024", "source": source, "source_url": url,
+        }
+
+    payloads = {first: payload(first, "spotify", "One"), second: payload(second, "apple_music", "Two")}
+
+    with patch(
+        "app.telegram_app.parse_music_urls", new_callable=AsyncMock, side_effect=lambda urls: {url: payloads[url] for url in urls}
+    ) as mock_parse, \
+         patch("app.telegram_app.bot.send_message", new_callable=AsyncMock) as mock_send, \
+         patch("app.telegram_app.bot.send_photo", new_callable=AsyncMock) as mock_photo:
+        await process_music_message(message)
+        await telegram_app.outbound_sender.drain()
+
+    mock_parse.assert_awaited_once_with([first, second])
+    mock_photo.assert_not_called()
+    mock_send.assert_awaited_once()
+    text_sent = mock_send.call_args.kwargs["text"]
+    assert text_sent.startswith("1. `Artist — One`")
+    assert "2. `Artist — Two`" in text_sent
+    assert text_sent.endswith("_from @alex_")
+    buttons = mock_send.call_args.kwargs["reply_markup"].inline_keyboard
+    assert [row[0].url for row in buttons] == [first, second]
+
+
+@pytest.mark.asyncio
+async def test_outbound_sender_reschedules_flood_wait_and_keeps_chat_order():
+    from aiogram.exceptions import TelegramRetryAfter
+    from aiogram.methods import SendMessage
+    from app.sender import OutboundSender
+
+    sender = OutboundSender(global_rate=1000, private_interval=0, group_interval=0)
+    delivered = []
+    flooded = []
+
+    async def send(label):
+        if label == "a1" and not flooded:
+            flooded.append(label)
+            raise TelegramRetryAfter(SendMessage(chat_id=1, text="x"), "Flood control", 0)
+        delivered.append(label)
+        return label
+
+    results = await asyncio.gather(
+        sender.send(1, lambda: send("a1")),
+        sender.send(1, lambda: send("a2")),
+        sender.send(2, lambda: send("b1")),
+    )
+
+    assert results == ["a1", "a2", "b1"]
+    assert delivered.index("a1") < delivered.index("a2")
+    stats = sender.stats()
+    assert stats["sent"] == 3
+    assert stats["retried"] == 1
+    assert stats["queued"] == 0
+
+
+@pytest.mark.asyncio
+async def test_outbound_sender_coalesces_queued_edits():
+    from app.sender import OutboundSender
+
+    sender = OutboundSender(global_rate=1000, private_interval=0.05, group_interval=0.05)
+    calls = []
+
+    async def edit(text):
+        calls.append(text)
+        return text
+
+    first = asyncio.create_task(sender.send(5, lambda: edit("send")))
+    await asyncio.sleep(0)
+    results = await asyncio.gather(
+        sender.send(5, lambda: edit("v1"), coalesce_key=("edit", 1)),
+        sender.send(5, lambda: edit("v2"), coalesce_key=("edit", 1)),
+    )
+
+    assert await first == "send"
+    assert results == ["v2", "v2"]
+    assert calls == ["send", "v2"]
+    assert sender.stats()["coalesced"] == 1
+
+
+def build_test_update(update_id, chat_type=None):
+    from aiogram.types import Chat, InlineQuery, Message, Update, User
+
+    if chat_type is None:
+        user = User(id=1, is_bot=False, first_name="Alex")
+        return Update(update_id=update_id, inline_query=InlineQuery(id="q", from_user=user, query="x", offset=""))
+    message = Message(message_id=update_id, date=0, chat=Chat(id=update_id, type=chat_type), text="x")
+    if chat_type == "channel":
+        return Update(update_id=update_id, channel_post=message)
+    return Update(update_id=update_id, message=message)
+
+
+@pytest.mark.asyncio
+async def test_priority_update_middleware_serves_higher_lanes_first():
+    from app.update_queue import PriorityUpdateMiddleware
+
+    scheduler = PriorityUpdateMiddleware(workers=1, max_queued=10, shed_after=60)
+    release = asyncio.Event()
+    handled = []
+
+    async def handler(event, data):
+        if event.update_id == 0:
+            await release.wait()
+        handled.append(event.update_id)
+
+    await scheduler(handler, build_test_update(0, "group"), {})
+    await asyncio.sleep(0)
+    for update_id, chat_type in ((1, "channel"), (2, "group"), (3, "private"), (4, None)):
+        await scheduler(handler, build_test_update(update_id, chat_type), {})
+    assert scheduler.stats()["queued"] == {"inline": 1, "private": 1, "group": 1, "channel": 1}
+
+    release.set()
+    await scheduler.drain()
+    assert handled == [0, 4, 3, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_group_burst_behind_outbound_sender_does_not_delay_inline_queries(monkeypatch):
+    from aiogram.types import Chat, Message, MessageEntity, Update
+
+    from app.sender import OutboundSender
+    from app.update_queue import PriorityUpdateMiddleware
+
+    sender = OutboundSender()
+    monkeypatch.setattr(telegram_app, "outbound_sender", sender)
+    scheduler = PriorityUpdateMiddleware(workers=2, max_queued=50, shed_after=60)
+    link = "https://open.spotify.com/track/t1"
+    payload = {
+        "artist": "Artist", "track": "One", "album": "Album", "image": None, "label": "Label",
+        "release_date": "2024", "source": "spotify", "source_url": link,
+    }
+    inline_handled_at = []
+
+    async def handler(event, data):
+        if event.inline_query:
+            inline_handled_at.append(time.perf_counter())
+        else:
+            await telegram_app.process_music_message(event.message)
+
+    with patch("app.telegram_app.parse_music_urls", new_callable=AsyncMock, return_value={link: payload}), \
+         patch("app.telegram_app.bot.send_message", new_callable=AsyncMock) as mock_send:
+        for update_id in range(10):
+            message = Message(
+                message_id=update_id,
+                date=0,
+                chat=Chat(id=-100, type="supergroup"),
+                text=link,
+                entities=[MessageEntity(type="url", offset=0, length=len(link))],
+            )
+            await scheduler(handler, Update(update_id=update_id, message=message), {})
+        await asyncio.sleep(0.05)
+        queued_at = time.perf_counter()
+        await scheduler(handler, build_test_update(10), {})
+        await scheduler.drain()
+
+        assert inline_handled_at[0] - queued_at < 0.5
+        assert mock_send.await_count == 1
+        assert sender.queue_depth == 9
+        sender._worker.cancel()
+
+
+@pytest.mark.asyncio
+async def test_priority_update_middleware_sheds_stale_channel_posts():
+    from app.update_queue import PriorityUpdateMiddleware
+
+    scheduler = PriorityUpdateMiddleware(workers=1, max_queued=10, shed_after=0.01)
+    release = asyncio.Event()
+    handled = []
+
+    async def handler(event, data):
+        if event.update_id == 0:
+            await release.wait()
+        handled.append(event.update_id)
+
+    await scheduler(handler, build_test_update(0, "private"), {})
+    await asyncio.sleep(0)
+    await scheduler(handler, build_test_update(1, "channel"), {})
+    await scheduler(handler, build_test_update(2, "group"), {})
+    await asyncio.sleep(0.05)
+
+    release.set()
+    await scheduler.drain()
+    assert handled == [0, 2]
+    assert scheduler.stats()["shed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_auto_delete_scheduler_persists_and_batches_per_chat(monkeypatch, tmp_path):
+    from app.auto_delete import AutoDeleteScheduler
+    from app.cache import get_next_deletion_due
+
+    monkeypatch.setattr("app.cache.CACHE_DB_PATH", str(tmp_path / "cache.sqlite3"))
+    bot.init_cache_db()
+    deleted = []
+
+    async def delete_batch(chat_id, message_ids):
+        deleted.append((chat_id, sorted(message_ids)))
+
+    scheduler = AutoDeleteScheduler(delete_batch)
+    scheduler.schedule(-100, [1, 2], delay=0)
+    scheduler.schedule(-100, [3], delay=0)
+    scheduler.schedule(-200, [4], delay=0)
+    scheduler.schedule(-100, [5], delay=3600)
+
+    # A fresh scheduler sees the same rows, as after a restart.
+    restarted = AutoDeleteScheduler(delete_batch)
+    assert await restarted.flush_due(int(time.time()) + 1) == 4
+    assert sorted(deleted) == [(-200, [4]), (-100, [1, 2, 3])]
+    assert get_next_deletion_due() > time.time() + 3000
+
+
+@pytest.mark.asyncio
+async def test_auto_delete_scheduler_retries_only_transient_failures(monkeypatch, tmp_path):
+    from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError
+    from aiogram.methods import DeleteMessages
+
+    from app.auto_delete import AutoDeleteScheduler
+    from app import cache
+    from app.cache import get_due_deletions
+
+    monkeypatch.setattr("app.cache.CACHE_DB_PATH", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr("app.cache.table_row_counts", {"url_cache": 0, "pending_deletions": 0})
+    bot.init_cache_db()
+    attempts = []
+
+    async def delete_batch(chat_id, message_ids):
+        attempts.append(chat_id)
+        method = DeleteMessages(chat_id=chat_id, message_ids=message_ids)
+        if chat_id == -300:
+            raise TelegramNetworkError(method, "timeout")
+        raise TelegramBadRequest(method, "message to delete not found")
+
+    scheduler = AutoDeleteScheduler(delete_batch, retry_after=60)
+    scheduler.schedule(-300, [1, 2], delay=0)
+    scheduler.schedule(-400, [3], delay=0)
+    now = int(time.time()) + 1
+
+    assert await scheduler.flush_due(now) == 1
+    assert sorted(attempts) == [-400, -300]
+    assert get_due_deletions(now) == []
+    assert sorted(get_due_deletions(now + 60)) == [(-300, 1), (-300, 2)]
+    assert cache.table_row_counts["pending_deletions"] == 2
+
+
+def test_render_track_card_reuses_rendered_output_per_payload(monkeypatch):
+    monkeypatch.setattr(telegram_app, "_rendered_output_cache", {})
+    track_info = {
+        "artist": "Artist", "track": "Song_1", "album": "Album", "release_date": "2024",
+        "label": "Label", "links": {"apple_music": "https://music.apple.com/us/song/x/1"},
+    }
+    url = "https://open.spotify.com/track/t1"
+
+    with patch("app.telegram_app.build_caption", wraps=telegram_app.build_caption) as mock_caption:
+        first_caption, first_keyboard = telegram_app.render_track_card(track_info, "spotify", url, "@alex")
+        second_caption, second_keyboard = telegram_app.render_track_card(dict(track_info), "spotify", url, None)
+        telegram_app.render_track_card({**track_info, "label": "Other"}, "spotify", url, None)
+
+    assert mock_caption.call_count == 2
+    assert second_keyboard is first_keyboard
+    assert first_caption == second_caption + "\n\n_from @alex_"
+    assert "Song\\_1" in second_caption
+
+
+@pytest.mark.asyncio
+async def test_webhook_app_checks_secret_and_feeds_dispatcher(monkeypatch, tmp_path):
+    from aiohttp.test_utils import TestClient, TestServer
+
+    monkeypatch.setattr("app.cache.CACHE_DB_PATH", str(tmp_path / "cache.sqlite3"))
+    bot.init_cache_db()
+    monkeypatch.setattr(telegram_app, "WEBHOOK_SECRET", "s3cret")
+    update = {
+        "update_id": 10,
+        "message": {"message_id": 1, "date": 0, "chat": {"id": 5, "type": "private"}, "text": "hello"},
+    }
+    processed = telegram_app.update_scheduler.processed
+
+    with patch("app.telegram_app.bot.set_webhook", new_callable=AsyncMock) as mock_set_webhook:
+        async with TestClient(TestServer(telegram_app.build_webhook_app())) as client:
+            rejected = await client.post(telegram_app.WEBHOOK_PATH, json=update)
+            accepted = await client.post(
+                telegram_app.WEBHOOK_PATH,
+                json=update,
+                headers={"X-Telegram-Bot-Api-Secret-Token": "s3cret"},
+            )
+
+    assert rejected.status == 401
+    assert accepted.status == 200
+    assert mock_set_webhook.call_args.kwargs["secret_token"] == "s3cret"
+    # Shutdown drains the queue before the app stops.
+    assert telegram_app.update_scheduler.processed == processed + 1
+
+
+async def start_fake_redis(storage: dict, log: list, ttls: dict | None = None):
+    from app.cache_backends import read_resp_reply
+
+    async def handle(reader, writer):
+        log.append("connect")
+        while True:
+            try:
+                command = await read_resp_reply(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                break
+            name, *args = [part.decode() for part in command]
+            log.append((name, *args))
+            if name == "GET":
+                value = storage.get(args[0])
+                writer.write(b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value))
+            elif name == "PTTL":
+                ttl_ms = (ttls or {}).get(args[0], -1) if args[0] in storage else -2
+                writer.write(b":%d\r\n" % ttl_ms)
+            elif name == "SET":
+                storage[args[0]] = args[1].encode()
+                writer.write(b"+OK\r\n")
+            else:
+                writer.write(b"-ERR unknown command\r\n")
+            await writer.drain()
+        writer.close()
+
+    return await asyncio.start_server(handle, "127.0.0.1", 0)
+
+
+@pytest.mark.asyncio
+async def test_redis_track_store_pipelines_lookups_and_falls_back_to_sqlite(monkeypatch, tmp_path):
+    import json
+    import sqlite3
+    from contextlib import closing
+
+    from app.cache_backends import REDIS_KEY_PREFIX, RedisTrackStore, RespClient
+    from app.metrics import CACHE_LOOKUPS_TOTAL
+
+    monkeypatch.setattr("app.cache.CACHE_DB_PATH", str(tmp_path / "cache.sqlite3"))
+    bot.init_cache_db()
+    payload = {
+        "artist": "Artist", "track": "Song", "album": "Album", "image": None, "label": "Label",
+        "release_date": "2024", "source": "spotify", "source_url": "https://open.spotify.com/track/t1",
+    }
+    storage = {REDIS_KEY_PREFIX + "https://open.spotify.com/track/t2": json.dumps(payload).encode()}
+    log = []
+    server = await start_fake_redis(storage, log, {REDIS_KEY_PREFIX + "https://open.spotify.com/track/t2": 90_500})
+    port = server.sockets[0].getsockname()[1]
+    store = RedisTrackStore(RespClient(f"redis://127.0.0.1:{port}/0"))
+
+    await store.set("https://open.spotify.com/track/t1", payload, ttl=60)
+    hits, misses = CACHE_LOOKUPS_TOTAL.value("hit"), CACHE_LOOKUPS_TOTAL.value("miss")
+    results = await store.get_many([
+        "https://open.spotify.com/track/t1",
+        "https://open.spotify.com/track/t2",
+        "https://open.spotify.com/track/t3",
+    ])
+
+    assert set(results) == {"https://open.spotify.com/track/t1", "https://open.spotify.com/track/t2"}
+    # Each URL is counted once: the Redis hit for t2 is a hit, not a local miss.
+    assert CACHE_LOOKUPS_TOTAL.value("hit") == hits + 2
+    assert CACHE_LOOKUPS_TOTAL.value("miss") == misses + 1
+    assert log[0] == "connect" and log.count("connect") == 1
+    assert log[1][:2] == ("SET", REDIS_KEY_PREFIX + "https://open.spotify.com/track/t1")
+    assert log[1][3:] == ("EX", "60")
+    # t1 comes from the local SQLite copy; only the misses go to Redis, in one pipeline.
+    assert log[2:] == [
+        ("GET", REDIS_KEY_PREFIX + "https://open.spotify.com/track/t2"),
+        ("PTTL", REDIS_KEY_PREFIX + "https://open.spotify.com/track/t2"),
+        ("GET", REDIS_KEY_PREFIX + "https://open.spotify.com/track/t3"),
+        ("PTTL", REDIS_KEY_PREFIX + "https://open.spotify.com/track/t3"),
+    ]
+    assert get_cached_track("https://open.spotify.com/track/t2") == payload
+    # The local copy expires together with the shared entry, not a full CACHE_TTL_SECONDS later.
+    with closing(sqlite3.connect(str(tmp_path / "cache.sqlite3"))) as conn:
+        expires_at = conn.execute(
+            "SELECT expires_at FROM url_cache WHERE url = ?", ("https://open.spotify.com/track/t2",)
+        ).fetchone()[0]
+    assert 0 < expires_at - time.time() <= 91
+
+    server.close()
+    await server.wait_closed()
+    store.client.close()
+    assert await store.get("https://open.spotify.com/track/t9") is None
+    assert not store.available
+    # While the breaker is open, lookups and writes don't touch Redis at all.
+    with patch.object(store.client, "pipeline", new_callable=AsyncMock) as mock_pipeline, \
+         patch.object(store.client, "execute", new_callable=AsyncMock) as mock_execute:
+        assert await store.get("https://open.spotify.com/track/t8") is None
+        await store.set("https://open.spotify.com/track/t8", payload)
+    mock_pipeline.assert_not_called()
+    mock_execute.assert_not_called()
+    assert get_cached_track("https://open.spotify.com/track/t8") == payload
+
+
+def test_metrics_render_prometheus_text_format():
+    from app.metrics import Counter, Histogram, _registry
+
+    counter = Counter("test_events_total", "Test events.", ("kind",))
+    histogram = Histogram("test_seconds", "Test latency.", ("host",), buckets=(0.1, 1.0))
+    try:
+        counter.inc('say "hi"')
+        histogram.observe(0.05, "a")
+        histogram.observe(0.5, "a")
+        histogram.observe(5, "a")
+        lines = counter.collect() + histogram.collect()
+    finally:
+        _registry.remove(counter)
+        _registry.remove(histogram)
+
+    assert 'spotify_bot_test_events_total{kind="say \\"hi\\""} 1' in lines
+    assert 'spotify_bot_test_seconds_bucket{host="a",le="0.1"} 1' in lines
+    assert 'spotify_bot_test_seconds_bucket{host="a",le="1.0"} 2' in lines
+    assert 'spotify_bot_test_seconds_bucket{host="a",le="+Inf"} 3' in lines
+    assert 'spotify_bot_test_seconds_count{host="a"} 3' in lines
+
+
+@pytest.mark.asyncio
+async def test_upstream_calls_and_cache_lookups_are_measured(monkeypatch, tmp_path):
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from app.metrics import CACHE_LOOKUPS_TOTAL, UPSTREAM_REQUEST_SECONDS, UPSTREAM_RESPONSES_TOTAL
+
+    async def rate_limited(request):
+        return web.Response(status=429)
+
+    app = web.Application()
+    app.router.add_get("/", rate_limited)
+    async with TestServer(app) as server:
+        before = UPSTREAM_RESPONSES_TOTAL.value(server.host, "429")
+        async with bot.sources.create_http_session() as session:
+            async with session.get(server.make_url("/")) as resp:
+                assert resp.status == 429
+
+    assert UPSTREAM_RESPONSES_TOTAL.value(server.host, "429") == before + 1
+    assert UPSTREAM_REQUEST_SECONDS.count(server.host) >= 1
+
+    monkeypatch.setattr("app.cache.CACHE_DB_PATH", str(tmp_path / "cache.sqlite3"))
+    bot.init_cache_db()
+    misses, hits = CACHE_LOOKUPS_TOTAL.value("miss"), CACHE_LOOKUPS_TOTAL.value("hit")
+    get_cached_track("https://open.spotify.com/track/none")
+    set_cached_track("https://open.spotify.com/track/t1", {"artist": "A", "track": "B"})
+    get_cached_track("https://open.spotify.com/track/t1")
+    assert CACHE_LOOKUPS_TOTAL.value("miss") == misses + 1
+    assert CACHE_LOOKUPS_TOTAL.value("hit") == hits + 1
+
+
+@pytest.mark.asyncio
+async def test_tracing_exports_nested_spans_and_keeps_slow_traces(monkeypatch, tmp_path):
+    import json
+    from collections import deque
+    from app import tracing
+
+    trace_path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_FILE_PATH", str(trace_path))
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 0)
+    monkeypatch.setattr(tracing, "_trace_durations", {"message": deque([0.5] * 30)})
+
+    @tracing.traced("upstream")
+    async def fetch():
+        await asyncio.sleep(0)
+
+    with tracing.start_trace("message", chat_type="group"):
+        with tracing.span("fetch_tracks"):
+            await asyncio.gather(fetch(), fetch())
+    assert not trace_path.exists()
+
+    with patch("app.tracing.time.time_ns", side_effect=[0, 10**9]):
+        with tracing.start_trace("message"):
+            pass
+
+    exported = [json.loads(line) for line in trace_path.read_text().splitlines()]
+    assert len(exported) == 1
+    spans = exported[0]["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [item["name"] for item in spans] == ["message"]
+
+    monkeypatch.setattr(tracing, "_trace_durations", {})
+    with tracing.start_trace("message", chat_type="group"):
+        with tracing.span("fetch_tracks"):
+            await asyncio.gather(fetch(), fetch())
+    spans = json.loads(trace_path.read_text().splitlines()[-1])["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    by_name = {}
+    for item in spans:
+        by_name.setdefault(item["name"], []).append(item)
+    assert len(by_name["upstream"]) == 2
+    assert all(item["parentSpanId"] == by_name["fetch_tracks"][0]["spanId"] for item in by_name["upstream"])
+    assert by_name["fetch_tracks"][0]["parentSpanId"] == by_name["message"][0]["spanId"]
+    assert len({item["traceId"] for item in spans}) == 1
+
+
+@pytest.mark.asyncio
+async def test_queued_send_is_traced_under_the_update_that_queued_it(monkeypatch, tmp_path):
+    import json
+
+    from app import tracing
+    from app.sender import OutboundSender
+
+    trace_path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracing, "TRACE_FILE_PATH", str(trace_path))
+    monkeypatch.setattr(tracing, "_trace_durations", {})
+    monkeypatch.setattr(telegram_app, "outbound_sender", OutboundSender(global_rate=1000))
+    chat = type("Chat", (), {"id": 5, "type": "group"})()
+
+    async def send():
+        await asyncio.sleep(0.01)
+        return "sent"
+
+    with tracing.start_trace("message"):
+        with tracing.span("telegram.enqueue"):
+            future = telegram_app.queue_to_chat(chat, send)
+    assert await future == "sent"
+
+    records = [json.loads(line) for line in trace_path.read_text().splitlines()]
+    update_spans, send_spans = (record["resourceSpans"][0]["scopeSpans"][0]["spans"] for record in records)
+    assert [item["name"] for item in send_spans] == ["telegram.send"]
+    assert send_spans[0]["traceId"] == update_spans[0]["traceId"]
+    enqueue = next(item for item in update_spans if item["name"] == "telegram.enqueue")
+    assert send_spans[0]["parentSpanId"] == enqueue["spanId"]
+
+
+@pytest.mark.asyncio
+async def test_loop_lag_monitor_logs_stack_of_blocking_code(caplog):
+    from app.loop_monitor import LOOP_LAG_SECONDS, LoopLagMonitor
+
+    monitor = LoopLagMonitor(interval=0.01, threshold=0.05)
+    observed = LOOP_LAG_SECONDS.count()
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.03)
+
+    def block_the_loop():
+        time.sleep(0.2)
+
+    with caplog.at_level("WARNING"):
+        block_the_loop()
+        await asyncio.sleep(0.03)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+    assert monitor.stalls == 1
+    assert monitor.max_lag >= 0.1
+    assert LOOP_LAG_SECONDS.count() > observed
+    assert "block_the_loop" in caplog.text
+
+
+def test_parser_benchmark_fixtures_still_parse():
+    import importlib.util
+
+    runner_path = os.path.join(os.path.dirname(__file__), "..", "benchmarks", "run_parsers.py")
+    spec = importlib.util.spec_from_file_location("run_parsers", runner_path)
+    run_parsers = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(run_parsers)
+
+    cases = run_parsers.build_cases()
+    outputs = {name: func() for name, func in cases.items()}
+    assert all(outputs.values())
+    assert outputs["parse_apple_music_html_ld_json"]["artist"] == "Nox Vahn, Marsh"
+    assert outputs["parse_apple_music_html_meta_only"]["artist"] == "Stephan Bodzin"
+    assert outputs["parse_soundcloud_html"]["track"] == "A Piece Of The Sun"
+    assert outputs["clean_youtube_music_track"] == "Stephan Bodzin - Singularity"
+
+    report = run_parsers.run_benchmarks(min_time=0, repeat=1, only=["build_caption"])
+    assert set(report["results"]) == {"build_caption"}
+    assert report["results"]["build_caption"]["best_us"] >= 0
+
+
+def load_fake_upstream():
+    import importlib.util
+
+    module_path = os.path.join(os.path.dirname(__file__), "..", "load", "fake_upstream.py")
+    spec = importlib.util.spec_from_file_location("fake_upstream", module_path)
+    fake_upstream = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(fake_upstream)
+    return fake_upstream
+
+
+def test_upstream_url_is_unchanged_without_override():
+    from app import sources
+
+    url = "https://api.spotify.com/v1/search?q=x&type=track"
+    assert sources.upstream_url(url) == url
+    with patch("app.sources.UPSTREAM_BASE_URL", "http://127.0.0.1:8090"):
+        assert sources.upstream_url(url) == "http://127.0.0.1:8090/api.spotify.com/v1/search?q=x&type=track"
+
+
+@pytest.mark.asyncio
+async def test_fake_upstream_serves_parsers_and_injects_throttling():
+    from app import sources
+
+    upstream = load_fake_upstream().FakeUpstream(seed=1)
+    runner, base_url = await upstream.start()
+    try:
+        with patch("app.sources.UPSTREAM_BASE_URL", base_url):
+            payload = await sources.parse_soundcloud("https://soundcloud.com/radikon/premiere")
+            apple_results = await sources.search_apple_music_tracks("follow me", limit=2)
+
+            upstream.throttle_rate = 1.0
+            throttled = await sources.parse_soundcloud("https://soundcloud.com/radikon/premiere")
+    finally:
+        await runner.cleanup()
+
+    assert payload["track"] == "A Piece Of The Sun"
+    assert [item["track"] for item in apple_results] == ["Follow Me", "Follow Me"]
+    assert throttled is None
+    assert upstream.requests == {
+        ("soundcloud.com", 200): 1,
+        ("itunes.apple.com", 200): 1,
+        ("soundcloud.com", 429): 1,
+    }
+
+
+def test_update_recorder_keeps_links_and_drops_personal_data(tmp_path):
+    from aiogram.types import Update
+
+    from app.update_recorder import UpdateRecorderMiddleware
+
+    text = "Послушай 🎧 https://open.spotify.com/track/abc и ещё ссылку"
+    update = Update.model_validate(
+        {
+            "update_id": 7,
+            "message": {
+                "message_id": 3,
+                "date": 1700000000,
+                "chat": {"id": -100123, "type": "supergroup", "title": "Секретный чат"},
+                "from": {"id": 42, "is_bot": False, "first_name": "Иван", "last_name": "Петров", "username": "ivan"},
+                "text": text,
+                "entities": [
+                    {"type": "url", "offset": 12, "length": 34},
+                    {"type": "text_link", "offset": 52, "length": 6, "url": "https://music.yandex.ru/track/1"},
+                ],
+            },
+        }
+    )
+    recorder = UpdateRecorderMiddleware(str(tmp_path / "updates.jsonl"))
+    handler = AsyncMock(return_value="handled")
+
+    assert asyncio.run(recorder(handler, update, {})) == "handled"
+    recorder.record(update)
+
+    first, second = [json.loads(line) for line in (tmp_path / "updates.jsonl").read_text(encoding="utf-8").splitlines()]
+    message = first["update"]["message"]
+    assert first["offset"] == 0
+    assert message["chat"]["type"] == "supergroup" and message["chat"]["id"] < 0
+    assert message["chat"]["id"] != -100123 and message["from"]["id"] != 42
+    assert message["from"] == second["update"]["message"]["from"]
+    dumped = json.dumps(first, ensure_ascii=False)
+    assert "Иван" not in dumped and "Петров" not in dumped and "Секретный" not in dumped and "ivan" not in dumped
+
+    replayed = Update.model_validate(first["update"])
+    assert telegram_app.extract_message_urls(replayed.message) == [
+        "https://open.spotify.com/track/abc",
+        "https://music.yandex.ru/track/1",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_fake_bot_api_serves_updates_and_records_sends():
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiohttp.test_utils import TestServer
+
+    import importlib.util
+
+    module_path = os.path.join(os.path.dirname(__file__), "..", "load", "fake_bot_api.py")
+    spec = importlib.util.spec_from_file_location("fake_bot_api", module_path)
+    fake_bot_api = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(fake_bot_api)
+
+    api = fake_bot_api.FakeBotApi()
+    server = TestServer(api.build_app())
+    await server.start_server()
+    session = AiohttpSession(api=TelegramAPIServer.from_base(str(server.make_url("")).rstrip("/")))
+    test_bot = Bot(token="123456789:ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghi", session=session)
+    try:
+        api.publish({"update_id": 1, "message": {"message_id": 1, "date": 0, "chat": {"id": 5, "type": "private"}, "text": "hi"}})
+        api.publish({"update_id": 2, "inline_query": {"id": "q", "from": {"id": 5, "is_bot": False, "first_name": "U"}, "query": "x", "offset": ""}})
+        updates = await test_bot.get_updates(offset=0, timeout=0)
+        sent = await test_bot.send_message(chat_id=5, text="reply")
+        await test_bot.answer_inline_query("q", results=[])
+        assert await test_bot.get_updates(offset=3, timeout=0) == []
+    finally:
+        await session.close()
+        await server.close()
+
+    assert [update.update_id for update in updates] == [1, 2]
+    assert sent.chat.id == 5
+    assert set(api.served_at) == {1, 2}
+    assert [(method, target) for method, _, target in api.calls] == [
+        ("sendMessage", ("chat", 5)),
+        ("answerInlineQuery", ("inline_query", "q")),
+    ]
+
+
+def test_source_health_summarizes_sliding_windows():
+    from app.health import SourceHealth
+
+    health = SourceHealth(max_samples=100)
+    health.record("spotify", 5.0, False, now=0)
+    for index in range(20):
+        health.record("spotify", 0.1 + index / 100, index % 10 != 0, now=1000 + index)
+    health.record("apple_music", 0.5, True, now=1010)
+
+    recent = health.summary(300, now=1030)
+    assert recent["spotify"]["count"] == 20
+    assert recent["spotify"]["p50"] == pytest.approx(0.2)
+    assert recent["spotify"]["p95"] == pytest.approx(0.29)
+    assert recent["spotify"]["error_rate"] == pytest.approx(0.1)
+    assert recent["apple_music"]["count"] == 1
+    assert health.summary(3600, now=1030)["spotify"]["count"] == 21
+    assert health.summary(300, now=5000) == {}
+
+
+def test_cache_row_counters_follow_writes_without_scans(monkeypatch, tmp_path):
+    from app import cache
+
+    monkeypatch.setattr("app.cache.CACHE_DB_PATH", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setattr("app.cache.table_row_counts", {"url_cache": 0, "pending_deletions": 0})
+    cache.init_cache_db()
+    payload = {"artist": "A", "track": "T", "album": "", "label": "", "source": "spotify"}
+
+    cache.set_cached_track("https://x/1", payload)
+    cache.set_cached_track("https://x/1", payload)
+    cache.set_cached_track("https://x/2", payload, ttl=-10)
+    assert cache.table_row_counts["url_cache"] == 2
+    assert cache.get_cached_track("https://x/2") is None
+    assert cache.table_row_counts["url_cache"] == 1
+
+    cache.schedule_deletions(-1, [1, 2], 100)
+    cache.schedule_deletions(-1, [2, 3], 200)
+    assert cache.table_row_counts["pending_deletions"] == 3
+    cache.remove_deletions([(-1, 1), (-1, 2)])
+    assert cache.table_row_counts["pending_deletions"] == 1
+    assert cache.get_next_deletion_due() == 200
+
+    cache.init_cache_db()
+    assert cache.table_row_counts == {"url_cache": 1, "pending_deletions": 1}
+
+
+@pytest.mark.asyncio
+async def test_stats_command_answers_admins_only(monkeypatch):
+    from aiogram.types import Chat, Message, User
+
+    from app.health import SourceHealth
+
+    monkeypatch.setattr(telegram_app, "ADMIN_USER_IDS", frozenset({7}))
+    monkeypatch.setattr(telegram_app, "table_row_counts", {"url_cache": 12, "pending_deletions": 3})
+    monkeypatch.setattr(telegram_app, "get_rss_bytes", lambda: 150 * 1048576)
+    monkeypatch.setattr(telegram_app, "get_memory_limit_bytes", lambda: 300 * 1048576)
+    monkeypatch.setattr(telegram_app, "source_health", SourceHealth())
+    telegram_app.source_health.record("soundcloud", 0.25, True)
+    answers = []
+
+    async def fake_answer(self, text, **kwargs):
+        answers.append(text)
+
+    monkeypatch.setattr(Message, "answer", fake_answer)
+    for user_id in (8, 7):
+        message = Message(
+            message_id=1,
+            date=0,
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name="U"),
+            text="/stats",
+        )
+        await telegram_app.send_stats(message)
+
+    assert len(answers) == 1
+    assert "записей 12" in answers[0]
+    assert "soundcloud: p50 250 мс" in answers[0]
+    assert "Ждут автоудаления: 3" in answers[0]
+    assert "Память: 150 МБ из 300 МБ (50%)" in answers[0]
+
+
+def burn_cpu_for_profile(seconds):
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(range(200))
+    return total
+
+
+@pytest.mark.asyncio
+async def test_profiles_are_written_with_top_n_summaries(monkeypatch, tmp_path):
+    from app import profiling
+
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+
+    async def busy_loop():
+        for _ in range(10):
+            burn_cpu_for_profile(0.02)
+            await asyncio.sleep(0)
+
+    worker = asyncio.create_task(busy_loop())
+    path, summary = await profiling.run_profile("sample", 0.15, top=5)
+    await worker
+    assert path.endswith(".folded") and os.path.exists(path)
+    assert 0 < len(summary) <= 5
+    assert any("burn_cpu_for_profile" in line for line in open(path, encoding="utf-8"))
+
+    worker = asyncio.create_task(busy_loop())
+    path, summary = await profiling.run_profile("cpu", 0.1, top=5)
+    await worker
+    assert path.endswith(".prof") and os.path.exists(path)
+    assert any("burn_cpu_for_profile" in line for line in summary)
+
+    retained = []
+
+    async def allocate():
+        await asyncio.sleep(0.01)
+        retained.append([bytearray(1024) for _ in range(200)])
+
+    worker = asyncio.create_task(allocate())
+    path, summary = await profiling.run_profile("mem", 0.05, top=5)
+    await worker
+    assert summary[0].startswith("RSS:")
+    assert any("test_basic.py" in line for line in summary[1:])
+    assert not __import__("tracemalloc").is_tracing()
+
+    with pytest.raises(ValueError):
+        await profiling.run_profile("gpu", 1)
+
+
+@pytest.mark.asyncio
+async def test_profile_command_is_admin_only_and_rejects_overlapping_runs(monkeypatch, tmp_path):
+    from aiogram.filters import CommandObject
+    from aiogram.types import Chat, Message, User
+
+    from app import profiling
+
+    monkeypatch.setattr(telegram_app, "ADMIN_USER_IDS", frozenset({7}))
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    answers = []
+
+    async def fake_answer(self, text, **kwargs):
+        answers.append(text)
+
+    monkeypatch.setattr(Message, "answer", fake_answer)
+
+    def build_message(user_id):
+        return Message(
+            message_id=1,
+            date=0,
+            chat=Chat(id=user_id, type="private"),
+            from_user=User(id=user_id, is_bot=False, first_name="U"),
+            text="/profile",
+        )
+
+    await telegram_app.start_profile(build_message(8), CommandObject(command="profile", args="cpu 0.05"))
+    assert answers == []
+    await telegram_app.start_profile(build_message(7), CommandObject(command="profile", args="gpu"))
+    assert answers[-1].startswith("Использование")
+
+    await telegram_app.start_profile(build_message(7), CommandObject(command="profile", args="cpu 0.05"))
+    await asyncio.sleep(0)
+    await telegram_app.report_profile(build_message(7), "cpu", 0.05)
+    assert "уже идёт" in answers[-1]
+    await asyncio.gather(*telegram_app._background_tasks)
+    assert answers[-1].startswith("🔬 Профиль записан в <code>")
+    assert "<pre>" in answers[-1]
+
+
+@pytest.mark.asyncio
+async def test_memory_governor_admits_heavy_fetches_within_budget():
+    from app.memory_governor import MEMORY_GOVERNOR_DECISIONS_TOTAL, MemoryGovernor, MemoryPressureError
+
+    mib = 1048576
+    rss = {"value": 200 * mib}
+    governor = MemoryGovernor(
+        soft_limit_percent=90,
+        hard_limit_percent=95,
+        reservation_bytes=50 * mib,
+        admission_timeout=0.05,
+        rss_reader=lambda: rss["value"],
+        limit_reader=lambda: 300 * mib,
+    )
+    rejected = MEMORY_GOVERNOR_DECISIONS_TOTAL.value("rejected")
+
+    async with governor.heavy_fetch() as lease:
+        lease.hold(1024)
+        assert governor.in_flight == 1 and governor.response_bytes == 1024
+        with pytest.raises(MemoryPressureError):
+            async with governor.heavy_fetch():
+                pass
+    assert governor.in_flight == 0 and governor.response_bytes == 0 and governor.reserved_bytes == 0
+    assert MEMORY_GOVERNOR_DECISIONS_TOTAL.value("rejected") == rejected + 1
+
+    async def second_fetch():
+        async with governor.heavy_fetch():
+            return governor.in_flight
+
+    rss["value"] = 100 * mib
+    governor.sample(force=True)
+    async with governor.heavy_fetch():
+        assert await second_fetch() == 2
+
+
+def test_memory_governor_shrinks_then_clears_caches_under_pressure():
+    from app.memory_governor import CACHE_ENTRIES_EVICTED_TOTAL, MemoryGovernor
+
+    mib = 1048576
+    caches = {"labels": {index: index for index in range(10)}}
+    governor = MemoryGovernor(
+        soft_limit_percent=70,
+        hard_limit_percent=85,
+        rss_reader=lambda: 0,
+        limit_reader=lambda: 100 * mib,
+    )
+    governor.register_cache("labels", lambda: caches["labels"])
+    evicted = CACHE_ENTRIES_EVICTED_TOTAL.value("labels")
+
+    governor.rss_bytes = 60 * mib
+    governor.relieve_pressure(now=0)
+    assert len(caches["labels"]) == 10
+
+    governor.rss_bytes = 75 * mib
+    governor.relieve_pressure(now=0)
+    assert list(caches["labels"]) == [5, 6, 7, 8, 9]
+    governor.relieve_pressure(now=5)
+    assert len(caches["labels"]) == 5
+
+    governor.rss_bytes = 90 * mib
+    governor.relieve_pressure(now=20)
+    assert caches["labels"] == {}
+    assert CACHE_ENTRIES_EVICTED_TOTAL.value("labels") == evicted + 10
+
+
+@pytest.mark.asyncio
+async def test_heavy_parsers_give_up_when_memory_is_exhausted(monkeypatch):
+    from contextlib import asynccontextmanager
+
+    from app import sources
+    from app.memory_governor import MemoryPressureError
+
+    @asynccontextmanager
+    async def exhausted():
+        raise MemoryPressureError("Недостаточно памяти для загрузки страницы")
+        yield
+
+    monkeypatch.setattr(sources.memory_governor, "heavy_fetch", exhausted)
+    with patch("app.sources.create_http_session") as mock_session:
+        assert await sources.parse_soundcloud("https://soundcloud.com/artist/track") is None
+        assert await sources.parse_apple_music("https://music.apple.com/us/album/x/1?i=2") is None
+    mock_session.assert_not_called()